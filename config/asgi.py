@@ -14,3 +14,16 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_asgi_application()
+
+# Serve the live competition results stream alongside Django
+from drones.streaming import with_live_results  # noqa: E402
+
+application = with_live_results(application)
+
+# With DRONES_WARM_UP=1, load what workers would load on their first
+# requests before a preloading server forks them
+from django.conf import settings  # noqa: E402
+
+if settings.WARM_UP:
+    from drones.warmup import warm_up
+    warm_up()
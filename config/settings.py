@@ -50,13 +50,23 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Must stay first so every query made while handling a request is routed
+    'drones.middleware.ReplicaRoutingMiddleware',
+    # Inactive unless SLOW_QUERY_LOG is set
+    'drones.middleware.SlowQueryMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # Compresses large JSON responses not served precompressed
+    'drones.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # Staff only, on request (X-Drones-Profile header or ?profile=1)
+    'drones.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Sheds low priority requests under overload
+    'drones.middleware.AdaptiveConcurrencyMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -98,9 +108,45 @@ DATABASES = {
         'PASSWORD': 'post1234',
         'HOST': '127.0.0.1',
         'PORT': '5432',
-    }
+    },
+    # Read replicas use the same keys as 'default'. The TEST mirror makes
+    # the test runner point the alias at the test database, e.g.
+    # 'replica': {
+    #     'ENGINE': 'django.db.backends.postgresql',
+    #     'NAME': 'drones',
+    #     'USER': 'postgres',
+    #     'PASSWORD': 'post1234',
+    #     'HOST': '127.0.0.1',
+    #     'PORT': '5433',
+    #     'TEST': {'MIRROR': 'default'},
+    # },
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Shared by the workers through the primary (REPLICA_PIN_CACHE)
+    'replica-pins': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'drones_replica_pins',
+    },
 }
 
+# Safe-method requests read from these aliases (listed in DATABASES above),
+# writes always go to 'default'
+DATABASE_ROUTERS = ['drones.dbrouter.PrimaryReplicaRouter']
+DATABASE_REPLICAS = []
+# After a client writes, its reads stay on 'default' for this many seconds
+REPLICA_STICKY_SECONDS = 5
+# Cache alias of the pins of clients that ignore the pin cookie (token
+# clients), keyed by their credentials. It must be shared by every
+# worker, the check drones.E001 rejects a per-process cache while
+# DATABASE_REPLICAS is set. Create its table with "manage.py createcachetable".
+REPLICA_PIN_CACHE = 'replica-pins'
+# How long a replica health check result is trusted
+REPLICA_HEALTH_CHECK_INTERVAL = 30
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
@@ -143,6 +189,8 @@ REST_FRAMEWORK = {
     
     'DEFAULT_PAGINATION_CLASS': 'drones.custompagination.LimitOffsetPaginationWithUpperBound',
     'PAGE_SIZE': 4,
+    # Options rendered by the browsable API for a related field
+    'HTML_SELECT_CUTOFF': 50,
 
     'DEFAULT_FILTER_BACKENDS': (
         'django_filters.rest_framework.DjangoFilterBackend',
@@ -166,4 +214,175 @@ REST_FRAMEWORK = {
         'drones': '200/hour',
         'pilots': '200/hour',
         }
-}
\ No newline at end of file
+}
+
+# Sync change feeds (?since=)
+SYNC_PAGE_SIZE = 500
+# Rows changed more recently than this are returned by the next sync,
+# so transactions still in flight cannot commit rows behind the cursor.
+# On Postgres the horizon is also held before the oldest open transaction,
+# this then only covers the clock skew with the database.
+SYNC_COMMIT_LAG_SECONDS = 1
+# Tombstones older than this are deleted by the prune_tombstones command,
+# clients that have not synced for as long start over (410 Gone)
+SYNC_TOMBSTONE_RETENTION_DAYS = 30
+
+# Live competition results stream (config/asgi.py)
+COMPETITION_BROADCASTER = 'drones.broadcast.LocalBroadcaster'
+# Events queued per subscriber before the oldest are dropped
+COMPETITION_STREAM_MAX_QUEUED = 100
+# Seconds between keep-alive comments on idle server-sent event streams
+COMPETITION_STREAM_HEARTBEAT = 15
+
+# Background import jobs (import-jobs/)
+IMPORT_JOBS_DIR = os.path.join(BASE_DIR, 'import_jobs')
+IMPORT_JOB_WORKERS = 2
+# Rows committed per transaction, a restarted job resumes at a chunk boundary
+IMPORT_JOB_CHUNK_SIZE = 1000
+# A running job untouched for this long is assumed to have crashed
+IMPORT_JOB_STALE_SECONDS = 300
+
+# Related rows embedded in a representation (pilot competitions,
+# category and user drones), the rest are reachable through the
+# filtered list linked next to them
+NESTED_COLLECTION_LIMIT = 10
+
+# ApproximateCountPagination (drone and competition lists): lists the
+# PostgreSQL planner expects to hold at least this many rows return
+# its estimate instead of running COUNT(*)
+APPROXIMATE_COUNT_THRESHOLD = 10000
+# Exact counts are cached this long unless a counted table changes first
+COUNT_CACHE_TIMEOUT = 300
+# Planner estimates are cached this long for each filter
+COUNT_ESTIMATE_CACHE_TIMEOUT = 60
+
+# Names suggested by the browsable API for related fields
+AUTOCOMPLETE_CHOICES = 25
+# Seconds a drone, category or pilot name -> id mapping stays cached,
+# saves and deletes drop it earlier. Only cached with a shared cache
+# backend or INVALIDATION_TRANSPORT, so other processes forget it too.
+SLUG_CACHE_TIMEOUT = 3600
+
+# Seconds the drone, pilot and competition detail representations stay
+# cached, changes to the rows they show invalidate them earlier
+OBJECT_CACHE_TIMEOUT = 600
+
+# Single-flight coalescing of identical list GETs (drones, competitions):
+# seconds a request waits for the identical one in flight before
+# computing on its own
+SINGLE_FLIGHT_TIMEOUT = 10
+# Also coalesce across workers through a cache lock, the result is
+# kept in the cache this many seconds for the waiting workers
+SINGLE_FLIGHT_SHARED = False
+SINGLE_FLIGHT_SHARED_TTL = 2
+
+# Adaptive concurrency limit (drones.middleware.AdaptiveConcurrencyMiddleware),
+# see drones/concurrency.py
+CONCURRENCY_INITIAL_LIMIT = 20
+CONCURRENCY_MIN_LIMIT = 2
+CONCURRENCY_MAX_LIMIT = 200
+# A view answering this many times slower than unloaded means overload
+CONCURRENCY_LATENCY_TOLERANCE = 2.0
+CONCURRENCY_BACKOFF = 0.9
+CONCURRENCY_RETRY_AFTER = 1
+# Share of the limit each priority class may use, the first matching
+# rule gives a request's class
+CONCURRENCY_PRIORITY_SHARES = {
+    'critical': 1.0,
+    'write': 0.9,
+    'read': 0.75,
+    'browse': 0.5,
+}
+CONCURRENCY_PRIORITY_RULES = [
+    # Owner writes to their drones ('owner' asks the view's owned_by())
+    {'views': ['drone-detail'], 'methods': ['PUT', 'PATCH', 'DELETE'], 'authenticated': True, 'owner': True,
+     'priority': 'critical'},
+    {'methods': ['POST', 'PUT', 'PATCH', 'DELETE'], 'authenticated': True, 'priority': 'write'},
+    {'authenticated': True, 'priority': 'read'},
+    # Anonymous browsing
+    {'priority': 'browse'},
+]
+
+# Rows deleted per transaction by the cascading deletes of the drone,
+# category, pilot and user detail views (drones/fastdelete.py)
+FAST_DELETE_CHUNK_SIZE = 1000
+
+# Slow-query log (drones.middleware.SlowQueryMiddleware): a file path
+# to enable it. Queries over the threshold made by the sampled share
+# of the requests are logged with their plan, the log rotates past
+# SLOW_QUERY_LOG_MAX_BYTES. Summarize it with "manage.py slowqueries".
+SLOW_QUERY_LOG = None
+SLOW_QUERY_THRESHOLD_MS = 200
+# Plans are estimated with a plain EXPLAIN, the query is not run again
+SLOW_QUERY_SAMPLE_RATE = 0.1
+SLOW_QUERY_LOG_MAX_BYTES = 10 * 1024 * 1024
+SLOW_QUERY_LOG_BACKUPS = 3
+
+# Reuse the compiled SQL of the drone, pilot and competition views,
+# binding only the WHERE parameters (drones/precompiled.py)
+PRECOMPILED_SQL = True
+# Also run them as PostgreSQL prepared statements, not behind a
+# transaction pooler such as PgBouncer
+PRECOMPILED_SQL_PREPARE = False
+
+# Request profiles (drones.middleware.ProfilingMiddleware), the
+# newest PROFILE_KEEP are kept and served at profiles/ to staff
+PROFILE_DIR = os.path.join(BASE_DIR, 'profiles')
+PROFILE_KEEP = 50
+# Allocation sites listed per profile
+PROFILE_TOP_ALLOCATIONS = 25
+PROFILE_TRACEMALLOC_FRAMES = 1
+
+# Columnar competition snapshot behind competitions/stats/, written and
+# refreshed by "manage.py competition_snapshot" or a POST to
+# competitions/snapshot/
+COMPETITION_SNAPSHOT_DIR = os.path.join(BASE_DIR, 'snapshots')
+# Competitions read per query while writing it from scratch
+COMPETITION_SNAPSHOT_CHUNK_SIZE = 10000
+
+# Warm up config.wsgi and config.asgi when they are imported, for
+# preforking servers (gunicorn --preload), see drones/warmup.py.
+# "manage.py startup_benchmark" measures the difference.
+WARM_UP = os.environ.get('DRONES_WARM_UP') == '1'
+
+# Most drones a bulk PATCH or DELETE on the drone list may select,
+# by ids or by filter (drones/bulk.py), or a POST to
+# drone-categories2/<pk>/drones/ may create
+BULK_OPERATION_LIMIT = 500
+# Rows per INSERT when drones are created in a batch
+DRONE_BATCH_INSERT_SIZE = 500
+
+# Invalidation bus (drones/invalidation.py) telling the other processes
+# which rows changed, so caches in process memory do not go stale:
+# PostgresTransport (LISTEN/NOTIFY on 'default'), FileTransport for
+# processes sharing a host, LocalTransport for tests. Only set it to
+# None with a shared CACHES backend, the workers would serve each
+# other's stale values otherwise.
+INVALIDATION_TRANSPORT = 'drones.invalidation.PostgresTransport'
+INVALIDATION_FILE = os.path.join(BASE_DIR, 'invalidation.log')
+# Seconds before reconnecting a dropped listener, doubled up to the max
+INVALIDATION_RECONNECT_DELAY = 0.5
+INVALIDATION_MAX_RECONNECT_DELAY = 30
+
+# JSON pages of the pilot and user lists are cached compressed with
+# gzip (and brotli when installed) until their tables change, see
+# drones/compression.py. "manage.py compression_benchmark" measures it.
+PRECOMPRESSED_CACHE = True
+PRECOMPRESSED_CACHE_TIMEOUT = 600
+# Other responses are compressed by CompressionMiddleware, when at least
+# COMPRESSION_MIN_SIZE bytes, COMPRESSION_CHUNK_SIZE bytes at a time
+COMPRESSIBLE_CONTENT_TYPES = ('application/json', 'text/csv', 'application/x-ndjson')
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_CHUNK_SIZE = 65536
+COMPRESSION_LEVEL = 6
+COMPRESSION_BROTLI_QUALITY = 4
+
+# Group commit of competition POSTs (drones/groupcommit.py): concurrent
+# POSTs of a worker are inserted together, in batches of at most
+# MAX_ROWS started at most DELAY_MS apart. At most MAX_QUEUED results
+# wait per worker, the others are answered 503.
+# "manage.py group_commit_benchmark" compares it with a commit per POST.
+COMPETITION_GROUP_COMMIT = False
+COMPETITION_GROUP_COMMIT_MAX_ROWS = 100
+COMPETITION_GROUP_COMMIT_DELAY_MS = 5
+COMPETITION_GROUP_COMMIT_MAX_QUEUED = 1000
@@ -14,3 +14,11 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_wsgi_application()
+
+# With DRONES_WARM_UP=1, load what workers would load on their first
+# requests before a preloading server forks them
+from django.conf import settings  # noqa: E402
+
+if settings.WARM_UP:
+    from drones.warmup import warm_up
+    warm_up()
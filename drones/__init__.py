@@ -0,0 +1 @@
+default_app_config = 'drones.apps.DronesConfig'
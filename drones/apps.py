@@ -1,5 +1,12 @@
 from django.apps import AppConfig
+from django.core import checks
 
 
 class DronesConfig(AppConfig):
     name = 'drones'
+
+    def ready(self):
+        # Connect the model signal handlers
+        import drones.signals  # noqa
+        from drones.dbrouter import check_pin_cache
+        checks.register(check_pin_cache)
@@ -0,0 +1,137 @@
+import asyncio
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+def competition_event(competition, created):
+    """
+    Payload pushed to live result subscribers
+    """
+    return {
+        'pk': competition.pk,
+        'pilot': competition.pilot.name,
+        'drone': competition.drone.name,
+        'distance_in_feet': competition.distance_in_feet,
+        'distance_achievement_date': competition.distance_achievement_date.isoformat(),
+        'created': created,
+        }
+
+
+class Subscription:
+    """
+    A subscriber's bounded queue of events. When the subscriber falls
+    behind, the oldest events are dropped and counted so it can be told
+    to resync instead of letting the queue grow.
+    """
+
+    def __init__(self, loop, pilot_name=None, drone_name=None, min_distance_in_feet=None, max_queued=100):
+        self.loop = loop
+        self.pilot_name = pilot_name
+        self.drone_name = drone_name
+        self.min_distance_in_feet = min_distance_in_feet
+        self.queue = asyncio.Queue(maxsize=max_queued)
+        self.dropped = 0
+
+    def matches(self, event):
+        if self.pilot_name is not None and event['pilot'] != self.pilot_name:
+            return False
+        if self.drone_name is not None and event['drone'] != self.drone_name:
+            return False
+        if self.min_distance_in_feet is not None and event['distance_in_feet'] < self.min_distance_in_feet:
+            return False
+        return True
+
+    def deliver(self, event):
+        # Called on the subscriber's event loop
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+    def take_dropped(self):
+        dropped, self.dropped = self.dropped, 0
+        return dropped
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class BaseBroadcaster:
+    """
+    Fans competition events out to subscribers. publish() is called from
+    synchronous code (signal handlers), subscribe() from a running loop.
+    """
+
+    def subscribe(self, **filters):
+        raise NotImplementedError('subscribe() must be implemented.')
+
+    def unsubscribe(self, subscription):
+        raise NotImplementedError('unsubscribe() must be implemented.')
+
+    def publish(self, event):
+        raise NotImplementedError('publish() must be implemented.')
+
+    def has_subscribers(self):
+        return True
+
+
+class LocalBroadcaster(BaseBroadcaster):
+    """
+    In-process broadcaster, only reaches subscribers connected to the
+    same process as the writer
+    """
+
+    def __init__(self, max_queued=None):
+        if max_queued is None:
+            max_queued = getattr(settings, 'COMPETITION_STREAM_MAX_QUEUED', 100)
+        self.max_queued = max_queued
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self, **filters):
+        subscription = Subscription(
+            asyncio.get_running_loop(),
+            max_queued=self.max_queued,
+            **filters)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def has_subscribers(self):
+        return bool(self._subscriptions)
+
+    def publish(self, event):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        by_loop = defaultdict(list)
+        for subscription in subscriptions:
+            if subscription.matches(event):
+                by_loop[subscription.loop].append(subscription)
+        # One wake-up per event loop rather than one per subscriber
+        for loop, matching in by_loop.items():
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(self._deliver, matching, event)
+
+    @staticmethod
+    def _deliver(subscriptions, event):
+        for subscription in subscriptions:
+            subscription.deliver(event)
+
+
+_broadcaster = None
+
+
+def get_broadcaster():
+    global _broadcaster
+    if _broadcaster is None:
+        broadcaster_class = import_string(getattr(
+            settings, 'COMPETITION_BROADCASTER', 'drones.broadcast.LocalBroadcaster'))
+        _broadcaster = broadcaster_class()
+    return _broadcaster
@@ -0,0 +1,100 @@
+"""
+Bulk updates and deletes on a collection, restricted to the rows the
+requester owns. The rows are picked by a list of pks or by the
+filterset of the list view, changed with one UPDATE (or a chunked
+cascading delete) and reported one outcome per pk.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django_filters.constants import EMPTY_VALUES
+from rest_framework import serializers
+
+from drones import fastdelete
+from drones.signals import rows_updated
+
+UPDATED = 'updated'
+DELETED = 'deleted'
+FORBIDDEN = 'forbidden'
+NOT_FOUND = 'not_found'
+
+
+def bulk_limit():
+    return getattr(settings, 'BULK_OPERATION_LIMIT', 500)
+
+
+def selected_rows(data, queryset, filterset_class, request):
+    """
+    (requested pks or None, queryset of the rows picked) from
+    {'ids': [...]} or {'filter': {...}}
+    """
+    if not isinstance(data, dict) or ('ids' in data) == ('filter' in data):
+        raise serializers.ValidationError({'non_field_errors': ['Give either ids or filter.']})
+    if 'ids' in data:
+        ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False).run_validation(data['ids'])
+        if len(ids) > bulk_limit():
+            raise serializers.ValidationError({'ids': ['At most {0} ids.'.format(bulk_limit())]})
+        return ids, queryset.filter(pk__in=ids)
+    conditions = data['filter']
+    if not isinstance(conditions, dict) or not conditions:
+        raise serializers.ValidationError({'filter': ['Give at least one filter field.']})
+    unknown = set(conditions) - set(filterset_class.base_filters)
+    if unknown:
+        raise serializers.ValidationError({'filter': ['Unknown fields: {0}.'.format(', '.join(sorted(unknown)))]})
+    filterset = filterset_class(data=conditions, queryset=queryset, request=request)
+    if not filterset.is_valid():
+        raise serializers.ValidationError({'filter': filterset.errors})
+    # django-filter skips empty values, {"name": ""} would pick every row
+    if all(filterset.form.cleaned_data.get(name) in EMPTY_VALUES for name in conditions):
+        raise serializers.ValidationError({'filter': ['Give at least one non-empty filter value.']})
+    return None, filterset.qs
+
+
+def owned_rows(requested, queryset, user):
+    """
+    (pks owned by user, outcomes of the others), the owned rows
+    locked until the end of the transaction
+    """
+    rows = dict(queryset.order_by().values_list('pk', 'owner_id')[:bulk_limit() + 1])
+    if len(rows) > bulk_limit():
+        raise serializers.ValidationError(
+            {'filter': ['Matches more than {0} rows, narrow it.'.format(bulk_limit())]})
+    owned = set(queryset.model.objects.filter(
+        pk__in=[pk for pk, owner_id in rows.items() if owner_id == user.pk],
+        owner=user,
+        ).order_by().select_for_update().values_list('pk', flat=True))
+    outcomes = {}
+    for pk, owner_id in rows.items():
+        if pk not in owned:
+            # Deleted or given away since read
+            outcomes[pk] = FORBIDDEN if owner_id != user.pk else NOT_FOUND
+    for pk in requested or ():
+        outcomes.setdefault(pk, NOT_FOUND)
+    return owned, outcomes
+
+
+def results(requested, owned, outcomes, status):
+    outcomes.update((pk, status) for pk in owned)
+    order = requested if requested is not None else sorted(outcomes)
+    return {
+        status: len(owned),
+        'results': [{'id': pk, 'status': outcomes[pk]} for pk in order],
+        }
+
+
+def bulk_update(model, requested, queryset, user, changes):
+    with transaction.atomic():
+        owned, outcomes = owned_rows(requested, queryset, user)
+        if owned:
+            # update() leaves auto_now fields alone, sync feeds need it
+            model.objects.filter(pk__in=owned).update(updated_timestamp=timezone.now(), **changes)
+            rows_updated.send(sender=model, pks=sorted(owned))
+    return results(requested, owned, outcomes, UPDATED)
+
+
+def bulk_delete(model, requested, queryset, user):
+    with transaction.atomic():
+        owned, outcomes = owned_rows(requested, queryset, user)
+        if owned:
+            fastdelete.fast_delete_pks(model, sorted(owned))
+    return results(requested, owned, outcomes, DELETED)
@@ -0,0 +1,79 @@
+"""
+Version stamps of the tables and rows behind cached values. Cached
+values carry the versions of what they were computed from, and a
+write bumps the versions of its table and row so those values are
+never served again.
+"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+def version_key(name):
+    return 'drones:version:{0}'.format(name)
+
+
+def object_name(model, pk):
+    return '{0}:{1}'.format(model._meta.db_table, pk)
+
+
+def initial_version():
+    # Not 1: a version evicted from the cache must not come
+    # back with a value that older keys were built with
+    return int(time.time() * 1000)
+
+
+def get_versions(names):
+    """
+    Map each table or object name to its current version
+    """
+    keys = dict((version_key(name), name) for name in names)
+    found = cache.get_many(list(keys))
+    versions = {}
+    for key, name in keys.items():
+        if key not in found:
+            cache.add(key, initial_version(), None)
+            found[key] = cache.get(key)
+        versions[name] = found[key]
+    return versions
+
+
+def bump_version(name):
+    key = version_key(name)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, initial_version(), None)
+
+
+def changed(name):
+    """
+    Bump the version now for the writer's own reads and again on commit,
+    in case another request cached the uncommitted state in between
+    """
+    bump_version(name)
+    transaction.on_commit(lambda: bump_version(name))
+
+
+def table_changed(table):
+    changed(table)
+
+
+def object_changed(model, pk):
+    changed(object_name(model, pk))
+
+
+def objects_changed(model, pks):
+    """
+    object_changed for many rows, with one cache round trip
+    """
+    names = [object_name(model, pk) for pk in pks]
+
+    def reset():
+        # A new initial version rather than incr() on every key
+        version = initial_version()
+        cache.set_many(dict((version_key(name), version) for name in names), None)
+
+    reset()
+    transaction.on_commit(reset)
@@ -0,0 +1,456 @@
+"""
+Columnar snapshot of the competitions for analytics, so that group-by
+and top-k questions are answered without touching the OLTP tables.
+
+One file per column holds a typed array (native byte order) that is
+memory-mapped when read. Pilot, drone and category are stored as
+dictionary codes, their names live in small JSON dictionaries. The
+manifest holds the row count, so a reader never sees half-appended
+rows. A refresh appends the competitions created since the previous
+export, rewrites in place the ones updated since and those of the
+drones updated since (which may have moved to another category),
+marks the deleted ones (tombstones) as not live and refreshes the names.
+
+numpy is used when installed, the same queries run on the memoryviews
+of the mapped files without it.
+"""
+import fcntl
+import heapq
+import json
+import mmap
+import os
+import shutil
+import sys
+from array import array
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from drones.models import Competition, Drone, DroneCategory, Pilot, Tombstone
+from drones.sync import commit_horizon
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# (column, array typecode)
+COLUMNS = (
+    ('id', 'q'),
+    ('distance_in_feet', 'q'),
+    ('achieved', 'd'),
+    ('pilot', 'i'),
+    ('drone', 'i'),
+    ('category', 'i'),
+    ('live', 'b'),
+    )
+TYPECODES = dict(COLUMNS)
+DICTIONARIES = (
+    ('pilot', Pilot),
+    ('drone', Drone),
+    ('category', DroneCategory),
+    )
+AGGREGATES = ('count', 'sum', 'mean', 'min', 'max')
+SOURCE_FIELDS = (
+    'id', 'distance_in_feet', 'distance_achievement_date',
+    'pilot_id', 'drone_id', 'drone__drone_category_id')
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def snapshot_dir():
+    return getattr(settings, 'COMPETITION_SNAPSHOT_DIR', os.path.join(settings.BASE_DIR, 'snapshots'))
+
+
+def column_path(directory, name):
+    return os.path.join(directory, '{0}.col'.format(name))
+
+
+def dictionary_path(directory, name):
+    return os.path.join(directory, '{0}.dict.json'.format(name))
+
+
+def manifest_path(directory):
+    return os.path.join(directory, 'manifest.json')
+
+
+def write_json(path, value):
+    partial = path + '.partial'
+    with open(partial, 'w', encoding='utf-8') as output:
+        json.dump(value, output)
+    os.replace(partial, path)
+
+
+def read_json(path):
+    with open(path, encoding='utf-8') as source:
+        return json.load(source)
+
+
+class Encoder:
+    """
+    pk -> dictionary code of a model, codes in order of first use
+    """
+
+    def __init__(self, pks=()):
+        self.pks = list(pks)
+        self.codes = dict((pk, code) for code, pk in enumerate(self.pks))
+
+    def encode(self, pk):
+        code = self.codes.get(pk)
+        if code is None:
+            code = self.codes[pk] = len(self.pks)
+            self.pks.append(pk)
+        return code
+
+    def save(self, directory, name, model):
+        names = {}
+        for chunk in chunked(iter(self.pks), 500):
+            names.update(model.objects.filter(pk__in=chunk).values_list('pk', 'name'))
+        write_json(dictionary_path(directory, name), {
+            'pks': self.pks,
+            'names': [names.get(pk) for pk in self.pks],
+            })
+
+
+def encode_row(row, encoders):
+    pk, distance, achieved, pilot_id, drone_id, category_id = row
+    return (
+        pk,
+        distance,
+        achieved.timestamp(),
+        encoders['pilot'].encode(pilot_id),
+        encoders['drone'].encode(drone_id),
+        encoders['category'].encode(category_id),
+        1)
+
+
+def append_rows(directory, rows):
+    columns = dict((name, array(code)) for name, code in COLUMNS)
+    for row in rows:
+        for (name, code), value in zip(COLUMNS, row):
+            columns[name].append(value)
+    for name, values in columns.items():
+        with open(column_path(directory, name), 'ab') as output:
+            values.tofile(output)
+
+
+def patch_rows(directory, positions):
+    """
+    Overwrite the rows at the given positions, {position: encoded row}
+    """
+    for index, (name, code) in enumerate(COLUMNS):
+        size = array(code).itemsize
+        with open(column_path(directory, name), 'r+b') as output:
+            for position, row in sorted(positions.items()):
+                output.seek(position * size)
+                output.write(array(code, [row[index]]).tobytes())
+
+
+def chunked(iterator, size):
+    chunk = []
+    for item in iterator:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def full_export(directory):
+    """
+    Write a new snapshot next to directory and swap it in
+    """
+    building = directory + '.building'
+    shutil.rmtree(building, ignore_errors=True)
+    os.makedirs(building)
+    started = timezone.now()
+    horizon = commit_horizon()
+    encoders = dict((name, Encoder()) for name, model in DICTIONARIES)
+    rows = 0
+    last_id = 0
+    source = Competition.objects.order_by('id').values_list(*SOURCE_FIELDS).iterator()
+    for chunk in chunked(source, snapshot_chunk_size()):
+        append_rows(building, [encode_row(row, encoders) for row in chunk])
+        rows += len(chunk)
+        last_id = chunk[-1][0]
+    for name, model in DICTIONARIES:
+        encoders[name].save(building, name, model)
+    for name, code in COLUMNS:
+        open(column_path(building, name), 'ab').close()
+    manifest = new_manifest(rows, last_id, started, horizon)
+    write_json(manifest_path(building), manifest)
+    replaced = directory + '.old'
+    shutil.rmtree(replaced, ignore_errors=True)
+    if os.path.exists(directory):
+        os.rename(directory, replaced)
+    os.rename(building, directory)
+    # Readers still mapping the old files keep them until they let go
+    shutil.rmtree(replaced, ignore_errors=True)
+    return manifest
+
+
+def new_manifest(rows, last_id, started, horizon):
+    return {
+        'rows': rows,
+        'last_id': last_id,
+        'exported_at': started.isoformat(),
+        'horizon': horizon.isoformat(),
+        'byteorder': sys.byteorder,
+        'columns': dict(COLUMNS),
+        }
+
+
+def refresh(directory):
+    """
+    Bring an existing snapshot up to date, see the module docstring
+    """
+    manifest = read_json(manifest_path(directory))
+    started = timezone.now()
+    horizon = commit_horizon()
+    # Transactions still in flight when the last export ran may have
+    # committed rows stamped after its horizon since. Manifests written
+    # before the horizon was recorded only hold the export's start.
+    if 'horizon' in manifest:
+        since = datetime.fromisoformat(manifest['horizon'])
+    else:
+        since = datetime.fromisoformat(manifest['exported_at']) - timedelta(
+            seconds=getattr(settings, 'SYNC_COMMIT_LAG_SECONDS', 1))
+    encoders = dict(
+        (name, Encoder(read_json(dictionary_path(directory, name))['pks'])) for name, model in DICTIONARIES)
+    changed = list(Competition.objects.filter(
+        Q(id__gt=manifest['last_id']) | Q(updated_timestamp__gte=since) |
+        Q(drone__updated_timestamp__gte=since),
+        ).order_by('id').values_list(*SOURCE_FIELDS))
+    deleted = set(Tombstone.objects.filter(
+        model_name=Competition._meta.model_name, deleted_timestamp__gte=since,
+        ).values_list('object_pk', flat=True))
+
+    rows = manifest['rows']
+    snapshot = Snapshot(directory, manifest)
+    positions = snapshot.positions(set(row[0] for row in changed) | deleted)
+    patches = {}
+    appended = []
+    for row in changed:
+        encoded = encode_row(row, encoders)
+        if row[0] in positions:
+            patches[positions[row[0]]] = encoded
+        else:
+            appended.append(encoded)
+    for pk in deleted:
+        if pk in positions and positions[pk] not in patches:
+            patches[positions[pk]] = snapshot.row(positions[pk])[:-1] + (0,)
+    snapshot = None
+    # Drop what a crashed refresh may have appended past the manifest
+    for name, code in COLUMNS:
+        with open(column_path(directory, name), 'r+b') as column:
+            column.truncate(rows * array(code).itemsize)
+    patch_rows(directory, patches)
+    append_rows(directory, appended)
+    for name, model in DICTIONARIES:
+        encoders[name].save(directory, name, model)
+    manifest = new_manifest(
+        rows + len(appended),
+        max([manifest['last_id']] + [row[0] for row in appended]),
+        started, horizon)
+    write_json(manifest_path(directory), manifest)
+    return manifest
+
+
+def snapshot_chunk_size():
+    return getattr(settings, 'COMPETITION_SNAPSHOT_CHUNK_SIZE', 10000)
+
+
+def export(full=False, directory=None):
+    """
+    Refresh the snapshot, or write it from scratch, return its manifest
+    """
+    directory = directory or snapshot_dir()
+    with export_lock(directory):
+        if full or not os.path.exists(manifest_path(directory)):
+            return full_export(directory)
+        return refresh(directory)
+
+
+@contextmanager
+def export_lock(directory):
+    """
+    Held by one export of directory at a time among the processes of
+    the host, workers and management commands alike. Next to the
+    directory, which a full export replaces. Released by the system
+    when the process dies.
+    """
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    with open(directory + '.lock', 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise SnapshotError('A snapshot export is already running.')
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def map_column(directory, name, rows):
+    code = TYPECODES[name]
+    length = rows * array(code).itemsize
+    if not length:
+        return numpy.zeros(0, dtype=code) if numpy is not None else array(code)
+    if numpy is not None:
+        return numpy.memmap(column_path(directory, name), dtype=code, mode='r', shape=(rows,))
+    with open(column_path(directory, name), 'rb') as source:
+        mapped = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+    return memoryview(mapped)[:length].cast(code)
+
+
+class Snapshot:
+    def __init__(self, directory=None, manifest=None):
+        self.directory = directory or snapshot_dir()
+        self.manifest = manifest or read_json(manifest_path(self.directory))
+        if self.manifest['byteorder'] != sys.byteorder:
+            raise SnapshotError('The snapshot was written on a {0} endian machine.'.format(
+                self.manifest['byteorder']))
+        self.rows = self.manifest['rows']
+        self.columns = dict(
+            (name, map_column(self.directory, name, self.rows)) for name, code in COLUMNS)
+        self.names = dict(
+            (name, read_json(dictionary_path(self.directory, name))['names']) for name, model in DICTIONARIES)
+
+    def positions(self, pks):
+        """
+        pk -> row position of the given competitions present in the snapshot
+        """
+        ids = self.columns['id']
+        if not pks:
+            return {}
+        if numpy is not None:
+            found = numpy.nonzero(numpy.isin(ids, list(pks)))[0]
+            return dict((int(ids[position]), int(position)) for position in found)
+        return dict((pk, position) for position, pk in enumerate(ids) if pk in pks)
+
+    def row(self, position):
+        return tuple(self.columns[name][position] for name, code in COLUMNS)
+
+    def selection(self, since=None, until=None):
+        """
+        Positions (numpy: a boolean mask) of the live rows achieved
+        between since and until, as epoch seconds
+        """
+        live, achieved = self.columns['live'], self.columns['achieved']
+        if numpy is not None:
+            mask = live == 1
+            if since is not None:
+                mask &= achieved >= since
+            if until is not None:
+                mask &= achieved <= until
+            return mask
+        return [
+            position for position in range(self.rows)
+            if live[position] and (since is None or achieved[position] >= since)
+            and (until is None or achieved[position] <= until)]
+
+    def group_by(self, key, aggregate, since=None, until=None):
+        """
+        {code: (aggregate of the distances, count)} per pilot, drone or category
+        """
+        if aggregate not in AGGREGATES:
+            raise SnapshotError('Unknown aggregate {0}.'.format(aggregate))
+        selected = self.selection(since, until)
+        groups = len(self.names[key])
+        if numpy is not None:
+            keys = numpy.asarray(self.columns[key])[selected]
+            values = numpy.asarray(self.columns['distance_in_feet'])[selected].astype('float64')
+            counts = numpy.bincount(keys, minlength=groups)
+            if aggregate in ('sum', 'mean'):
+                result = numpy.bincount(keys, weights=values, minlength=groups)
+                if aggregate == 'mean':
+                    result = result / numpy.maximum(counts, 1)
+            elif aggregate in ('min', 'max'):
+                result = numpy.full(groups, numpy.inf if aggregate == 'min' else -numpy.inf)
+                (numpy.minimum if aggregate == 'min' else numpy.maximum).at(result, keys, values)
+            else:
+                result = counts
+            return dict(
+                (int(code), (float(result[code]), int(counts[code])))
+                for code in numpy.nonzero(counts)[0])
+        keys, values = self.columns[key], self.columns['distance_in_feet']
+        found = {}
+        for position in selected:
+            code, value = keys[position], values[position]
+            current = found.get(code)
+            if current is None:
+                found[code] = [value, value, value, 1]
+            else:
+                current[0] += value
+                current[1] = min(current[1], value)
+                current[2] = max(current[2], value)
+                current[3] += 1
+        pick = {
+            'count': lambda total, low, high, count: count,
+            'sum': lambda total, low, high, count: total,
+            'mean': lambda total, low, high, count: total / count,
+            'min': lambda total, low, high, count: low,
+            'max': lambda total, low, high, count: high,
+            }[aggregate]
+        return dict((code, (float(pick(*value)), value[3])) for code, value in found.items())
+
+    def top_groups(self, key, aggregate, k, since=None, until=None):
+        groups = self.group_by(key, aggregate, since, until)
+        best = heapq.nlargest(k, groups.items(), key=lambda item: (item[1][0], -item[0]))
+        return [
+            {key: self.names[key][code], 'value': value, 'competitions': count}
+            for code, (value, count) in best]
+
+    def top_rows(self, k, since=None, until=None):
+        """
+        The k longest live competitions
+        """
+        distances = self.columns['distance_in_feet']
+        selected = self.selection(since, until)
+        if numpy is not None:
+            positions = numpy.nonzero(selected)[0]
+            values = numpy.asarray(distances)[positions]
+            if len(positions) > k:
+                part = numpy.argpartition(-values, k - 1)[:k]
+                positions, values = positions[part], values[part]
+            best = [int(position) for position in positions[numpy.argsort(-values, kind='stable')]]
+        else:
+            best = heapq.nlargest(k, selected, key=distances.__getitem__)
+        return [self.describe(position) for position in best]
+
+    def describe(self, position):
+        columns = self.columns
+        return {
+            'id': int(columns['id'][position]),
+            'distance_in_feet': int(columns['distance_in_feet'][position]),
+            'distance_achievement_date': datetime.fromtimestamp(
+                float(columns['achieved'][position]), tz=timezone.utc),
+            'pilot': self.names['pilot'][columns['pilot'][position]],
+            'drone': self.names['drone'][columns['drone'][position]],
+            'drone_category': self.names['category'][columns['category'][position]],
+            }
+
+
+_loaded = {}
+
+
+def get_snapshot(directory=None):
+    """
+    The snapshot, mapped once per process and again after each export
+    """
+    directory = directory or snapshot_dir()
+    try:
+        changed = os.stat(manifest_path(directory)).st_mtime_ns
+    except FileNotFoundError:
+        raise SnapshotError('No snapshot yet, run "manage.py competition_snapshot".')
+    loaded = _loaded.get(directory)
+    if loaded is None or loaded[0] != changed:
+        loaded = _loaded[directory] = (changed, Snapshot(directory))
+    return loaded[1]
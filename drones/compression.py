@@ -0,0 +1,218 @@
+"""
+Compressed response bodies. The JSON pages of the large list views are
+cached already compressed with every encoding available and served in
+the best one the client accepts, costing no compression at all while
+their tables are unchanged. Other large responses (the sync exports,
+uncached pages) are compressed by CompressionMiddleware on the way out,
+in chunks streamed to the client.
+"""
+import hashlib
+import zlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+
+from drones import cacheversions, dbrouter
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+IDENTITY = 'identity'
+GZIP = 'gzip'
+BROTLI = 'br'
+
+
+def available_encodings():
+    """
+    Encodings we can produce, the preferred first
+    """
+    return (BROTLI, GZIP) if brotli is not None else (GZIP,)
+
+
+def accepted_encodings(header):
+    """
+    Map each coding of an Accept-Encoding header to its quality
+    """
+    accepted = {}
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding] = quality
+    return accepted
+
+
+def choose_encoding(header, encodings):
+    """
+    The encoding among encodings the client accepts with the highest
+    quality, ties going to the first, identity when it accepts none
+    """
+    accepted = accepted_encodings(header or '')
+    best, best_quality = IDENTITY, 0.0
+    for encoding in encodings:
+        quality = accepted.get(encoding, accepted.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def min_size():
+    return getattr(settings, 'COMPRESSION_MIN_SIZE', 1024)
+
+
+def compress(body, encoding):
+    """
+    Compress body once for many responses, at the slowest settings
+    """
+    if encoding == BROTLI:
+        return brotli.compress(body, quality=11)
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 31)
+    return compressor.compress(body) + compressor.flush()
+
+
+def compressed_bodies(body):
+    """
+    Map identity and each available encoding smaller than it to body
+    in that encoding
+    """
+    bodies = {IDENTITY: body}
+    if len(body) >= min_size():
+        for encoding in available_encodings():
+            compressed = compress(body, encoding)
+            if len(compressed) < len(body):
+                bodies[encoding] = compressed
+    return bodies
+
+
+def stream_compress(chunks, encoding):
+    """
+    Compress the chunks of a body one at a time, at the faster settings
+    used for bodies compressed for a single response
+    """
+    if encoding == BROTLI:
+        compressor = brotli.Compressor(quality=getattr(settings, 'COMPRESSION_BROTLI_QUALITY', 4))
+        process, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(getattr(settings, 'COMPRESSION_LEVEL', 6), zlib.DEFLATED, 31)
+        process, finish = compressor.compress, compressor.flush
+    for chunk in chunks:
+        if chunk:
+            data = process(chunk)
+            if data:
+                yield data
+    yield finish()
+
+
+def chunked(content, size=None):
+    if size is None:
+        size = getattr(settings, 'COMPRESSION_CHUNK_SIZE', 65536)
+    view = memoryview(content)
+    for start in range(0, len(content), size):
+        yield view[start:start + size]
+
+
+def compressible(response):
+    if response.status_code != 200 or response.has_header('Content-Encoding'):
+        return False
+    content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+    if content_type not in getattr(settings, 'COMPRESSIBLE_CONTENT_TYPES', ('application/json',)):
+        return False
+    return response.streaming or len(response.content) >= min_size()
+
+
+def compressed_response(response, encoding):
+    """
+    response streamed in encoding, headers and cookies kept
+    """
+    if response.streaming:
+        compressed = response
+        compressed.streaming_content = stream_compress(response.streaming_content, encoding)
+    else:
+        compressed = StreamingHttpResponse(
+            stream_compress(chunked(response.content), encoding), status=response.status_code)
+        for header, value in response.items():
+            compressed[header] = value
+        compressed.cookies = response.cookies
+    if compressed.has_header('Content-Length'):
+        del compressed['Content-Length']
+    etag = compressed.get('ETag')
+    if etag and not etag.startswith('W/'):
+        # The bytes differ from the identity ones
+        compressed['ETag'] = 'W/' + etag
+    compressed['Content-Encoding'] = encoding
+    return compressed
+
+
+def encoded_response(response, bodies, request):
+    """
+    Give response the body of bodies the client prefers
+    """
+    encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING'), [
+        encoding for encoding in available_encodings() if encoding in bodies])
+    response.content = bodies[encoding]
+    if encoding != IDENTITY:
+        response['Content-Encoding'] = encoding
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+class PrecompressedListMixin:
+    """
+    Serves JSON GETs of a list view from a cached, precompressed body
+    while none of the tables of precompressed_models has changed. Like
+    CachedRepresentationMixin, permissions are checked on every request
+    but the body must not depend on the user, and pages that may be
+    read from a replica are not cached.
+    """
+
+    precompressed_models = ()
+
+    def precompressed_key(self):
+        request = self.request
+        # Hyperlinks hold the host, the query filters and pages, the
+        # media type may ask for indentation
+        variant = '{0}://{1}?{2}|{3}'.format(
+            request.scheme, request.get_host(), '&'.join(sorted(request.GET.urlencode().split('&'))),
+            request.accepted_media_type)
+        return 'drones:precompressed:{0}:{1}'.format(
+            self.name, hashlib.sha1(variant.encode('utf-8')).hexdigest())
+
+    def list(self, request, *args, **kwargs):
+        if not getattr(settings, 'PRECOMPRESSED_CACHE', True) or request.accepted_renderer.format != 'json':
+            return super().list(request, *args, **kwargs)
+        key = self.precompressed_key()
+        entry = cache.get(key)
+        if entry is not None and cacheversions.get_versions(entry['versions']) == entry['versions']:
+            return encoded_response(HttpResponse(content_type=entry['content_type']), entry['bodies'], request)
+        if dbrouter.replica_reads_allowed():
+            # A lagging replica's page would be cached under the current
+            # versions, it is compressed by CompressionMiddleware instead
+            return super().list(request, *args, **kwargs)
+        # Read before serializing, a concurrent write bumps them past these
+        versions = cacheversions.get_versions([model._meta.db_table for model in self.precompressed_models])
+        response = super().list(request, *args, **kwargs)
+
+        def store(rendered):
+            bodies = compressed_bodies(rendered.content)
+            cache.set(key, {
+                'versions': versions,
+                'content_type': rendered['Content-Type'],
+                'bodies': bodies,
+                }, getattr(settings, 'PRECOMPRESSED_CACHE_TIMEOUT', 600))
+            encoded_response(rendered, bodies, request)
+
+        response.add_post_render_callback(store)
+        return response
@@ -0,0 +1,130 @@
+"""
+Adaptive concurrency limit with priority classes (AIMD).
+
+The limit on requests in flight grows by about one per round trip
+while each view's recent latency (a fast moving average) stays close
+to its usual latency (a slow moving average of the uncongested
+samples), and is cut by CONCURRENCY_BACKOFF, once per round trip,
+when the recent latency exceeds CONCURRENCY_LATENCY_TOLERANCE times
+the usual one.
+A priority class is admitted while fewer requests than its share of
+the limit are in flight, so low priorities are shed first.
+"""
+import threading
+import time
+
+from django.conf import settings
+
+DEFAULT_PRIORITY_SHARES = {
+    'critical': 1.0,
+    'write': 0.9,
+    'read': 0.75,
+    'browse': 0.5,
+    }
+
+DEFAULT_PRIORITY_RULES = [
+    {'views': ['drone-detail'], 'methods': ['PUT', 'PATCH', 'DELETE'], 'authenticated': True, 'owner': True,
+     'priority': 'critical'},
+    {'methods': ['POST', 'PUT', 'PATCH', 'DELETE'], 'authenticated': True, 'priority': 'write'},
+    {'authenticated': True, 'priority': 'read'},
+    {'priority': 'browse'},
+    ]
+
+# Weights of a new sample in the recent and usual latencies
+RECENT_WEIGHT = 0.2
+USUAL_WEIGHT = 0.01
+# Per congested sample upward drift of the usual latency,
+# so that it follows views becoming slower for good
+USUAL_DRIFT = 0.001
+
+
+def rule_matches(rule, view_name, method, authenticated, is_owner):
+    return (
+        ('views' not in rule or view_name in rule['views'])
+        and ('methods' not in rule or method in rule['methods'])
+        and ('authenticated' not in rule or rule['authenticated'] == authenticated)
+        # Checked last, it may cost a query
+        and ('owner' not in rule or rule['owner'] == (is_owner is not None and is_owner())))
+
+
+def request_priority(view_name, method, authenticated, is_owner=None):
+    """
+    Priority class of the first CONCURRENCY_PRIORITY_RULES entry matching.
+    is_owner() tells whether the authenticated user owns the requested
+    object, None when the view cannot tell.
+    """
+    for rule in getattr(settings, 'CONCURRENCY_PRIORITY_RULES', DEFAULT_PRIORITY_RULES):
+        if rule_matches(rule, view_name, method, authenticated, is_owner):
+            return rule['priority']
+    return 'browse'
+
+
+class Ticket:
+    __slots__ = ('view_name', 'priority', 'started')
+
+    def __init__(self, view_name, priority):
+        self.view_name = view_name
+        self.priority = priority
+        self.started = time.monotonic()
+
+
+class ConcurrencyLimiter:
+    def __init__(self, initial_limit=None, min_limit=None, max_limit=None,
+                 tolerance=None, backoff=None, shares=None):
+        self.min_limit = min_limit or getattr(settings, 'CONCURRENCY_MIN_LIMIT', 2)
+        self.max_limit = max_limit or getattr(settings, 'CONCURRENCY_MAX_LIMIT', 200)
+        self.limit = float(initial_limit or getattr(settings, 'CONCURRENCY_INITIAL_LIMIT', 20))
+        self.tolerance = tolerance or getattr(settings, 'CONCURRENCY_LATENCY_TOLERANCE', 2.0)
+        self.backoff = backoff or getattr(settings, 'CONCURRENCY_BACKOFF', 0.9)
+        self.shares = shares or getattr(settings, 'CONCURRENCY_PRIORITY_SHARES', DEFAULT_PRIORITY_SHARES)
+        self.in_flight = 0
+        self.latencies = {}
+        self.last_decrease = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self, view_name, priority):
+        """
+        Return a ticket to release once the request is answered,
+        None when the request must be shed
+        """
+        share = self.shares.get(priority, min(self.shares.values()))
+        with self.lock:
+            if self.in_flight >= max(1, int(self.limit * share)):
+                return None
+            self.in_flight += 1
+        return Ticket(view_name, priority)
+
+    def release(self, ticket):
+        now = time.monotonic()
+        latency = now - ticket.started
+        with self.lock:
+            busy = self.in_flight
+            self.in_flight -= 1
+            recent, usual = self.latencies.get(ticket.view_name, (latency, latency))
+            recent += RECENT_WEIGHT * (latency - recent)
+            congested = recent > usual * self.tolerance
+            if congested:
+                usual *= 1 + USUAL_DRIFT
+            else:
+                usual += USUAL_WEIGHT * (latency - usual)
+            self.latencies[ticket.view_name] = (recent, usual)
+            if congested:
+                # One decrease per round trip, the other slow answers
+                # of the same round trip report the same congestion
+                if now - self.last_decrease > latency:
+                    self.limit = max(self.min_limit, self.limit * self.backoff)
+                    self.last_decrease = now
+            elif busy * 2 >= self.limit:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = ConcurrencyLimiter()
+    return _limiter
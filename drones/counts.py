@@ -0,0 +1,108 @@
+"""
+Row counts for paginated lists: planner estimates on PostgreSQL
+and exact counts cached until one of the counted tables changes.
+
+Both live in the default cache. With the local-memory backend every
+process keeps its own: they are only as fresh as the invalidation bus
+keeps them (INVALIDATION_TRANSPORT), a shared backend avoids that.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+from drones import cacheversions, dbrouter
+
+
+def counted_tables(queryset):
+    query = queryset.query
+    tables = set(join.table_name for join in query.alias_map.values())
+    tables.add(query.get_meta().db_table)
+    return sorted(tables)
+
+
+def table_estimate(connection, table):
+    """
+    Rows of a table according to its last ANALYZE, summed over
+    its partitions when it is partitioned
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT sum(greatest(reltuples, 0)) FROM pg_class '
+            'WHERE oid = %s::regclass '
+            'OR oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = %s::regclass)',
+            [table, table])
+        row = cursor.fetchone()
+    return int(row[0] or 0)
+
+
+def plan_estimate(connection, queryset):
+    """
+    Rows the planner expects the query to return
+    """
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) {0}'.format(sql), params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def cached_plan_estimate(connection, queryset):
+    """
+    plan_estimate(), cached for COUNT_ESTIMATE_CACHE_TIMEOUT seconds
+    per filter: the planner's statistics change slower than the pages
+    are requested
+    """
+    sql, params = queryset.query.sql_with_params()
+    signature = repr((queryset.db, sql, params))
+    key = 'drones:count-estimate:{0}'.format(hashlib.sha1(signature.encode('utf-8')).hexdigest())
+    estimate = cache.get(key)
+    if estimate is None:
+        estimate = plan_estimate(connection, queryset)
+        cache.set(key, estimate, getattr(settings, 'COUNT_ESTIMATE_CACHE_TIMEOUT', 60))
+    return estimate
+
+
+def estimate_count(queryset):
+    """
+    Estimated number of rows of the queryset, None
+    when the database cannot estimate it cheaply
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    # The joins of select_related() do not change the number of rows
+    counted = queryset.select_related(None).order_by().values('pk')
+    query = counted.query
+    if not query.where and not query.distinct and len(query.alias_map) <= 1:
+        return table_estimate(connection, query.get_meta().db_table)
+    return cached_plan_estimate(connection, counted)
+
+
+def count_cache_key(queryset):
+    counted = queryset.order_by().values('pk')
+    sql, params = counted.query.sql_with_params()
+    versions = cacheversions.get_versions(counted_tables(queryset))
+    signature = repr((queryset.db, sql, params, sorted(versions.items())))
+    return 'drones:count:{0}'.format(hashlib.sha1(signature.encode('utf-8')).hexdigest())
+
+
+def cached_count(queryset, count):
+    """
+    count(queryset), cached for COUNT_CACHE_TIMEOUT seconds
+    or until a write to one of the tables it reads. Not cached when it
+    may be read from a replica: a lagging one would have it served
+    under the current versions after the primary moved on.
+    """
+    if dbrouter.replica_reads_allowed():
+        return count(queryset)
+    key = count_cache_key(queryset)
+    result = cache.get(key)
+    if result is None:
+        result = count(queryset)
+        cache.set(key, result, getattr(settings, 'COUNT_CACHE_TIMEOUT', 300))
+    return result
@@ -1,5 +1,63 @@
-from rest_framework.pagination import LimitOffsetPagination
+from collections import OrderedDict
+
+from django.conf import settings
+from rest_framework.pagination import CursorPagination, LimitOffsetPagination
+from rest_framework.response import Response
+
+from drones import counts
 
 class LimitOffsetPaginationWithUpperBound(LimitOffsetPagination):
     # Set the maximum limit value to 8
-    max_limit = 8
\ No newline at end of file
+    max_limit = 8
+
+    def get_count(self, queryset):
+        # Per row annotations (nested collection counts)
+        # are not needed to count the rows
+        try:
+            return queryset.values('pk').count()
+        except (AttributeError, TypeError):
+            return len(queryset)
+
+class ApproximateCountPagination(LimitOffsetPaginationWithUpperBound):
+    """
+    For big tables: when the planner expects at least
+    APPROXIMATE_COUNT_THRESHOLD rows its estimate is returned
+    instead of running COUNT(*), smaller counts are exact and cached
+    until a write to the counted tables.
+    count_is_exact tells clients which one they got.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count_is_exact = True
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_count(self, queryset):
+        estimate = counts.estimate_count(queryset)
+        if estimate is not None and estimate >= getattr(settings, 'APPROXIMATE_COUNT_THRESHOLD', 10000):
+            self.count_is_exact = False
+            return estimate
+        return counts.cached_count(queryset, super().get_count)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('count_is_exact', self.count_is_exact),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        schema = super().get_paginated_response_schema(schema)
+        schema['properties']['count_is_exact'] = {'type': 'boolean'}
+        return schema
+
+class BoundedCursorPagination(CursorPagination):
+    """
+    For collections too big for offsets: every page costs the same
+    however deep it is and nothing is counted. Ordered by pk unless
+    the view's OrderingFilter is given ?ordering=
+    """
+    ordering = 'pk'
+    page_size_query_param = 'page_size'
+    max_page_size = 100
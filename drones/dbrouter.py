@@ -0,0 +1,156 @@
+import contextvars
+import random
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import DEFAULT_DB_ALIAS, InterfaceError, OperationalError, connections
+
+# Set by reading_from_replica(), ReplicaRoutingMiddleware uses it for
+# the duration of a request. Outside of it (shell, management commands,
+# workers) every read goes to the primary.
+_read_from_replica = contextvars.ContextVar('drones_read_from_replica', default=False)
+# Replicas chosen within the current reading_from_replica() block
+_used_replicas = contextvars.ContextVar('drones_used_replicas', default=None)
+
+# alias -> (healthy, checked_at)
+_replica_health = {}
+
+
+def get_replica_aliases():
+    return [alias for alias in getattr(settings, 'DATABASE_REPLICAS', ())
+            if alias != DEFAULT_DB_ALIAS]
+
+
+def get_pin_cache():
+    """
+    The cache holding the primary pins of token clients
+    """
+    return caches[getattr(settings, 'REPLICA_PIN_CACHE', 'default')]
+
+
+def check_pin_cache(app_configs, **kwargs):
+    # A pin only the worker that took the write knows of does not
+    # keep the client's next reads, served by other workers, on the primary
+    if get_replica_aliases() and isinstance(get_pin_cache(), LocMemCache):
+        return [checks.Error(
+            'REPLICA_PIN_CACHE is a per-process cache.',
+            hint='Point it to a cache alias shared by every worker (database, memcached, redis).',
+            id='drones.E001')]
+    return []
+
+
+def check_replica(alias):
+    """
+    Run a trivial query against the replica, closing the
+    connection if it fails so the next check reconnects
+    """
+    if alias not in connections.databases:
+        return False
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+        return True
+    except Exception:
+        connections[alias].close()
+        return False
+
+
+def replica_is_healthy(alias):
+    interval = getattr(settings, 'REPLICA_HEALTH_CHECK_INTERVAL', 30)
+    now = time.monotonic()
+    state = _replica_health.get(alias)
+    if state is not None and now - state[1] < interval:
+        return state[0]
+    healthy = check_replica(alias)
+    _replica_health[alias] = (healthy, now)
+    return healthy
+
+
+def mark_replica_unhealthy(alias):
+    _replica_health[alias] = (False, time.monotonic())
+
+
+def choose_read_alias():
+    if not _read_from_replica.get():
+        return DEFAULT_DB_ALIAS
+    healthy = [alias for alias in get_replica_aliases() if replica_is_healthy(alias)]
+    if not healthy:
+        # Every replica is down (or none is configured), fall back to the primary
+        return DEFAULT_DB_ALIAS
+    alias = random.choice(healthy)
+    used = _used_replicas.get()
+    if used is not None:
+        used.add(alias)
+    return alias
+
+
+def replica_reads_allowed():
+    """
+    Whether the reads of the current request may go to a replica
+    """
+    return _read_from_replica.get()
+
+
+def replica_error_wrapper(alias):
+    def wrapper(execute, sql, params, many, context):
+        try:
+            return execute(sql, params, many, context)
+        except (OperationalError, InterfaceError):
+            mark_replica_unhealthy(alias)
+            raise
+    return wrapper
+
+
+@contextmanager
+def reading_from_replica(allowed=True):
+    """
+    Let the reads made within the block go to a healthy replica when
+    allowed. A replica failing with a connection error, on a query or
+    on connecting, is marked unhealthy so the next reads skip it until
+    its next health check.
+    """
+    token = _read_from_replica.set(allowed)
+    used_token = _used_replicas.set(set())
+    try:
+        with ExitStack() as stack:
+            if allowed:
+                for alias in get_replica_aliases():
+                    if alias in connections.databases:
+                        stack.enter_context(connections[alias].execute_wrapper(replica_error_wrapper(alias)))
+            yield
+    except (OperationalError, InterfaceError):
+        for alias in _used_replicas.get():
+            # Never connected: connecting is what failed
+            if alias not in connections.databases or connections[alias].connection is None:
+                mark_replica_unhealthy(alias)
+        raise
+    finally:
+        _used_replicas.reset(used_token)
+        _read_from_replica.reset(token)
+
+
+class PrimaryReplicaRouter:
+    """
+    Sends reads to a healthy replica while the current request allows it
+    (see ReplicaRoutingMiddleware) and everything else to the primary
+    """
+
+    def db_for_read(self, model, **hints):
+        return choose_read_alias()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in get_replica_aliases():
+            return False
+        return None
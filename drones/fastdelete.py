@@ -0,0 +1,160 @@
+"""
+Cascading deletes without Django's collector, which loads every
+dependent row (and sends a signal per row) before deleting anything.
+Dependents are deleted leaves first, in chunks of FAST_DELETE_CHUNK_SIZE
+rows, each chunk in its own transaction with a single DELETE ... WHERE
+pk IN (...). rows_deleted is sent once per chunk so the tombstones and
+caches kept by drones.signals stay consistent.
+"""
+import logging
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.db import close_old_connections, models, transaction
+from django.db.models import F, Q
+from django.db.models.deletion import get_candidate_relations_to_delete
+from django.utils import timezone
+
+from drones.importjobs import get_executor
+from drones.models import DeleteJob
+from drones.signals import rows_deleted
+
+logger = logging.getLogger(__name__)
+
+
+class FastDeleteError(Exception):
+    pass
+
+
+def chunk_size():
+    return getattr(settings, 'FAST_DELETE_CHUNK_SIZE', 1000)
+
+
+def dependents(model, lookup, path=()):
+    """
+    (related model, lookup, on_delete) of the rows referencing the rows
+    matching lookup, recursively through cascades, leaves first
+    """
+    found = []
+    # Includes the hidden foreign keys of many to many tables
+    for relation in get_candidate_relations_to_delete(model._meta):
+        related_model = relation.related_model
+        on_delete = relation.on_delete
+        related_lookup = '{0}__{1}'.format(relation.field.name, lookup)
+        if on_delete is models.DO_NOTHING:
+            continue
+        if on_delete is models.CASCADE:
+            if related_model in path:
+                raise FastDeleteError('Cannot fast delete the cycle through {0}.'.format(
+                    related_model._meta.label))
+            found.extend(dependents(related_model, related_lookup, path + (model,)))
+        elif on_delete is not models.SET_NULL:
+            raise FastDeleteError('{0}.{1} does not cascade or set null on delete.'.format(
+                related_model._meta.label, relation.field.name))
+        found.append((related_model, related_lookup, on_delete))
+    return found
+
+
+def delete_chunks(queryset, on_chunk=None):
+    """
+    Delete the rows of queryset chunk by chunk, return how many.
+    on_chunk(rows) is called with the number of rows of each chunk,
+    in the chunk's transaction.
+    """
+    model = queryset.model
+    deleted = 0
+    while True:
+        with transaction.atomic(using=queryset.db):
+            rows = list(queryset.order_by().values()[:chunk_size()])
+            if not rows:
+                return deleted
+            pks = [row[model._meta.pk.attname] for row in rows]
+            # Bypasses the collector, the dependents are already gone
+            model._base_manager.using(queryset.db).filter(pk__in=pks)._raw_delete(queryset.db)
+            rows_deleted.send(sender=model, rows=rows)
+            if on_chunk is not None:
+                on_chunk(len(rows))
+            deleted += len(rows)
+
+
+def fast_delete(instance, on_chunk=None):
+    """
+    Delete instance and every row cascading from it,
+    return the number of rows deleted
+    """
+    return fast_delete_pks(type(instance), [instance.pk], on_chunk)
+
+
+def fast_delete_pks(model, pks, on_chunk=None):
+    """
+    Delete the rows of model with the given pks and every row
+    cascading from them, return the number of rows deleted
+    """
+    root = '{0}__in'.format(model._meta.pk.name)
+    deleted = 0
+    for related_model, lookup, on_delete in dependents(model, root):
+        related = related_model._base_manager.filter(**{lookup: pks})
+        if on_delete is models.SET_NULL:
+            field = lookup.split('__', 1)[0]
+            related.update(**{field: None})
+        else:
+            deleted += delete_chunks(related, on_chunk)
+    return deleted + delete_chunks(model._base_manager.filter(pk__in=pks), on_chunk)
+
+
+def claim_job(job_pk):
+    """
+    Atomically move a pending or stale running job to running,
+    return it or None when another worker owns it
+    """
+    stale = timezone.now() - timedelta(seconds=getattr(settings, 'IMPORT_JOB_STALE_SECONDS', 300))
+    claimed = DeleteJob.objects.filter(
+        Q(status=DeleteJob.PENDING) | Q(status=DeleteJob.RUNNING, updated_timestamp__lt=stale),
+        pk=job_pk,
+        ).update(status=DeleteJob.RUNNING, updated_timestamp=timezone.now())
+    if not claimed:
+        return None
+    return DeleteJob.objects.get(pk=job_pk)
+
+
+def run_delete_job(job_pk):
+    """
+    Run a delete job. Each chunk is committed with the job's progress,
+    which also keeps the job from looking stale, so an interrupted job
+    resumes with the rows that are left and its count carries on.
+    """
+    job = claim_job(job_pk)
+    if job is None:
+        return None
+    model = apps.get_model(job.model_label)
+    instance = model._base_manager.filter(pk=job.object_pk).first()
+
+    def record_progress(rows):
+        DeleteJob.objects.filter(pk=job.pk).update(
+            deleted_rows=F('deleted_rows') + rows, updated_timestamp=timezone.now())
+
+    try:
+        if instance is not None:
+            fast_delete(instance, record_progress)
+        DeleteJob.objects.filter(pk=job.pk).update(status=DeleteJob.DONE, updated_timestamp=timezone.now())
+    except FastDeleteError as error:
+        DeleteJob.objects.filter(pk=job.pk).update(
+            status=DeleteJob.FAILED, error=str(error), updated_timestamp=timezone.now())
+    job.refresh_from_db()
+    return job
+
+
+def _run_in_worker(job_pk):
+    try:
+        run_delete_job(job_pk)
+    except Exception:
+        logger.exception('Delete job %s failed', job_pk)
+        DeleteJob.objects.filter(pk=job_pk).update(status=DeleteJob.FAILED, updated_timestamp=timezone.now())
+    finally:
+        close_old_connections()
+
+
+def submit_delete_job(job_pk):
+    # Shares the import job workers
+    return get_executor().submit(_run_in_worker, job_pk)
@@ -0,0 +1,202 @@
+"""
+Group commit of competition POSTs. With COMPETITION_GROUP_COMMIT, the
+validated competitions of concurrent requests in a worker are inserted
+together. The first request of a batch inserts it at once when no other
+batch is being inserted. Otherwise it waits for that batch, for at most
+COMPETITION_GROUP_COMMIT_DELAY_MS or until COMPETITION_GROUP_COMMIT_MAX_ROWS
+rows have joined. Then it inserts them with one multi-row INSERT in one
+transaction and wakes the others. Every client is answered after its
+batch committed, a row the database rejects only fails its own request
+(400) and a batch that could not be saved at all is answered with a 503.
+"""
+import threading
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from drones.broadcast import competition_event, get_broadcaster
+from drones.models import Competition, Pilot
+from drones.signals import rows_updated
+
+
+class QueueFull(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many results waiting to be saved, retry later.'
+    default_code = 'group_commit_queue_full'
+
+    @property
+    def wait(self):
+        # Sent as Retry-After by the exception handler
+        return getattr(settings, 'CONCURRENCY_RETRY_AFTER', 1)
+
+
+class BatchFailed(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'The results could not be saved, retry later.'
+    default_code = 'group_commit_failed'
+
+    @property
+    def wait(self):
+        return getattr(settings, 'CONCURRENCY_RETRY_AFTER', 1)
+
+
+def enabled():
+    """
+    Whether to group the insert of the current request: never inside a
+    transaction, it would be acknowledged before committing
+    """
+    return getattr(settings, 'COMPETITION_GROUP_COMMIT', False) and not in_transaction()
+
+
+def in_transaction():
+    return transaction.get_connection().in_atomic_block
+
+
+def max_rows():
+    return getattr(settings, 'COMPETITION_GROUP_COMMIT_MAX_ROWS', 100)
+
+
+def max_delay():
+    return getattr(settings, 'COMPETITION_GROUP_COMMIT_DELAY_MS', 5) / 1000
+
+
+def max_queued():
+    return getattr(settings, 'COMPETITION_GROUP_COMMIT_MAX_QUEUED', 1000)
+
+
+def created(competitions):
+    """
+    What the post_save receivers do for a created competition,
+    for rows inserted by bulk_create()
+    """
+    rows_updated.send(sender=Competition, pks=[competition.pk for competition in competitions])
+    # Pilots embed their competitions
+    rows_updated.send(sender=Pilot, pks=sorted(set(competition.pilot_id for competition in competitions)))
+    broadcaster = get_broadcaster()
+    if broadcaster.has_subscribers():
+        events = [competition_event(competition, True) for competition in competitions]
+        transaction.on_commit(lambda: [broadcaster.publish(event) for event in events])
+
+
+def insert(competitions):
+    """
+    Insert competitions in one transaction, return the error of each
+    row, None for the inserted ones
+    """
+    if connection.features.can_return_rows_from_bulk_insert:
+        try:
+            with transaction.atomic():
+                Competition.objects.bulk_create(competitions)
+                created(competitions)
+            return [None] * len(competitions)
+        except DatabaseError:
+            for competition in competitions:
+                competition.pk = None
+    # One INSERT per row, each in a savepoint so that a rejected row
+    # does not take the others with it. Still a single commit. The
+    # foreign keys are deferred, they are checked within the savepoint
+    # or a deleted pilot or drone would fail the commit of every row.
+    errors = []
+    with transaction.atomic():
+        for competition in competitions:
+            try:
+                with transaction.atomic():
+                    competition.save(force_insert=True)
+                    connection.check_constraints(table_names=[Competition._meta.db_table])
+                errors.append(None)
+            except DatabaseError as error:
+                competition.pk = None
+                errors.append(error)
+    return errors
+
+
+class Batch:
+    def __init__(self):
+        self.competitions = []
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.errors = None
+        self.failure = None
+
+
+class GroupCommitter:
+    """
+    The batches of a worker. At most max_queued() competitions wait
+    at a time, the next ones are turned away with QueueFull.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._open = None
+        self._queued = 0
+        self._flushing = 0
+
+    def commit(self, competition):
+        """
+        Insert competition with the others of its batch, return once
+        they are committed. Raises the database error of its row, or
+        BatchFailed when the batch could not be saved at all.
+        """
+        with self._lock:
+            if self._queued >= max_queued():
+                raise QueueFull()
+            self._queued += 1
+            batch = self._open
+            leader = batch is None
+            if leader:
+                batch = self._open = Batch()
+            index = len(batch.competitions)
+            batch.competitions.append(competition)
+            if len(batch.competitions) >= max_rows():
+                self._open = None
+                batch.full.set()
+        try:
+            if leader:
+                self.flush(batch)
+            else:
+                batch.done.wait()
+        finally:
+            with self._lock:
+                self._queued -= 1
+        if batch.failure is not None:
+            raise BatchFailed() from batch.failure
+        if batch.errors[index] is not None:
+            raise batch.errors[index]
+        return competition
+
+    def flush(self, batch):
+        # While no batch is being inserted, nothing is gained by waiting.
+        # Otherwise the rows arriving meanwhile join until it is done.
+        with self._lock:
+            busy = self._flushing > 0
+        if busy:
+            batch.full.wait(max_delay())
+        with self._lock:
+            # Rows arriving from now on start the next batch
+            if self._open is batch:
+                self._open = None
+            self._flushing += 1
+        try:
+            batch.errors = insert(batch.competitions)
+        except BaseException as error:
+            batch.failure = error
+        finally:
+            batch.done.set()
+            with self._lock:
+                self._flushing -= 1
+                if self._open is not None:
+                    self._open.full.set()
+
+
+_committer = None
+_committer_lock = threading.Lock()
+
+
+def get_committer():
+    global _committer
+    with _committer_lock:
+        if _committer is None:
+            _committer = GroupCommitter()
+        return _committer
@@ -0,0 +1,238 @@
+import csv
+import io
+import itertools
+import json
+import logging
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from rest_framework import serializers
+
+from drones.models import DroneCategory,Drone,Pilot,Competition,ImportJob
+from drones.relatedfields import resolve_slugs
+from drones.signals import rows_updated
+
+logger = logging.getLogger(__name__)
+
+# Row errors kept on the job, the rest are only counted
+MAX_STORED_ERRORS = 100
+
+
+def save_upload(uploaded_file):
+    """
+    Copy an uploaded file into IMPORT_JOBS_DIR and return its path
+    """
+    directory = settings.IMPORT_JOBS_DIR
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, uuid.uuid4().hex)
+    with open(path, 'wb') as destination:
+        for chunk in uploaded_file.chunks():
+            destination.write(chunk)
+    return path
+
+
+def remove_upload(path):
+    """
+    Delete a job's file once the job is done or failed
+    """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def read_rows(job):
+    """
+    Yield each data row of the job's file as a dict
+    """
+    with io.open(job.file_path, encoding='utf-8', newline='') as source:
+        if job.file_format == ImportJob.CSV:
+            for row in csv.DictReader(source):
+                yield row
+        else:
+            for line in source:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def chunked(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def clean(field, row, name):
+    return field.run_validation(row.get(name))
+
+
+def import_competitions(job, rows):
+    pilots = resolve_slugs(Pilot, 'name', [row.get('pilot') for number, row in rows])
+    drones = resolve_slugs(Drone, 'name', [row.get('drone') for number, row in rows])
+    competitions, errors = [], []
+    distance_field = serializers.IntegerField()
+    date_field = serializers.DateTimeField()
+    for number, row in rows:
+        try:
+            pilot_id = pilots.get(row.get('pilot'))
+            drone_id = drones.get(row.get('drone'))
+            if pilot_id is None:
+                raise serializers.ValidationError({'pilot': ['Unknown pilot.']})
+            if drone_id is None:
+                raise serializers.ValidationError({'drone': ['Unknown drone.']})
+            competitions.append(Competition(
+                pilot_id=pilot_id,
+                drone_id=drone_id,
+                distance_in_feet=clean(distance_field, row, 'distance_in_feet'),
+                distance_achievement_date=clean(date_field, row, 'distance_achievement_date')))
+        except serializers.ValidationError as error:
+            errors.append({'row': number, 'errors': error.detail})
+    if competitions:
+        Competition.objects.bulk_create(competitions)
+        # bulk_create sends no post_save. Backends that cannot return the ids
+        # of a bulk insert leave them unknown, new rows have nothing cached.
+        rows_updated.send(sender=Competition, pks=[
+            competition.pk for competition in competitions if competition.pk is not None])
+        # Pilots embed their competitions
+        rows_updated.send(sender=Pilot, pks=sorted(set(competition.pilot_id for competition in competitions)))
+    return len(competitions), errors
+
+
+def import_drones(job, rows):
+    categories = resolve_slugs(DroneCategory, 'name', [row.get('drone_category') for number, row in rows])
+    taken = set(Drone.objects.filter(
+        name__in=[row.get('name') for number, row in rows]).values_list('name', flat=True))
+    drones, errors = [], []
+    name_field = serializers.CharField(max_length=250)
+    date_field = serializers.DateTimeField()
+    competed_field = serializers.BooleanField(default=False)
+    for number, row in rows:
+        try:
+            name = clean(name_field, row, 'name')
+            if name in taken:
+                raise serializers.ValidationError({'name': ['drone with this name already exists.']})
+            drone_category_id = categories.get(row.get('drone_category'))
+            if drone_category_id is None:
+                raise serializers.ValidationError({'drone_category': ['Unknown drone category.']})
+            drones.append(Drone(
+                name=name,
+                drone_category_id=drone_category_id,
+                manufacturing_date=clean(date_field, row, 'manufacturing_date'),
+                has_it_competed=competed_field.run_validation(row.get('has_it_competed', False)),
+                owner_id=job.owner_id))
+            taken.add(name)
+        except serializers.ValidationError as error:
+            errors.append({'row': number, 'errors': error.detail})
+    if drones:
+        Drone.objects.bulk_create(drones)
+        if drones[0].pk is None:
+            # Backends that cannot return the ids of a bulk insert
+            pks = dict(Drone.objects.filter(name__in=[drone.name for drone in drones]).values_list('name', 'pk'))
+            for drone in drones:
+                drone.pk = pks[drone.name]
+        # bulk_create sends no post_save
+        rows_updated.send(sender=Drone, pks=[drone.pk for drone in drones])
+    return len(drones), errors
+
+
+# Importers take a chunk of (row number, row) pairs and
+# return the number of rows inserted and the row errors
+IMPORTERS = {
+    ImportJob.COMPETITIONS: import_competitions,
+    ImportJob.DRONES: import_drones,
+    }
+
+
+def claim_job(job_pk):
+    """
+    Atomically move a pending or stale running job to running,
+    return it or None when another worker owns it
+    """
+    stale = timezone.now() - timedelta(seconds=getattr(settings, 'IMPORT_JOB_STALE_SECONDS', 300))
+    claimed = ImportJob.objects.filter(
+        Q(status=ImportJob.PENDING) | Q(status=ImportJob.RUNNING, updated_timestamp__lt=stale),
+        pk=job_pk,
+        ).update(status=ImportJob.RUNNING, updated_timestamp=timezone.now())
+    if not claimed:
+        return None
+    return ImportJob.objects.get(pk=job_pk)
+
+
+def run_import_job(job_pk):
+    """
+    Import the job's file chunk by chunk. Each chunk and the job's
+    progress are committed together, so a job interrupted by a crash
+    resumes after its last committed chunk.
+    """
+    job = claim_job(job_pk)
+    if job is None:
+        return None
+    importer = IMPORTERS[job.kind]
+    chunk_size = getattr(settings, 'IMPORT_JOB_CHUNK_SIZE', 1000)
+    stored_errors = json.loads(job.errors or '[]')
+    try:
+        if job.total_rows is None:
+            job.total_rows = sum(1 for row in read_rows(job))
+            ImportJob.objects.filter(pk=job.pk).update(total_rows=job.total_rows)
+        rows = itertools.islice(enumerate(read_rows(job), start=1), job.processed_rows, None)
+        for chunk in chunked(rows, chunk_size):
+            with transaction.atomic():
+                imported, errors = importer(job, [(number, row) for number, row in chunk if isinstance(row, dict)])
+                # NDJSON lines holding something else than an object
+                errors = sorted(errors + [
+                    {'row': number, 'errors': {'non_field_errors': [
+                        'Invalid data. Expected a dictionary, but got {0}.'.format(type(row).__name__)]}}
+                    for number, row in chunk if not isinstance(row, dict)], key=lambda error: error['row'])
+                stored_errors = (stored_errors + errors)[:MAX_STORED_ERRORS]
+                ImportJob.objects.filter(pk=job.pk).update(
+                    processed_rows=F('processed_rows') + len(chunk),
+                    imported_rows=F('imported_rows') + imported,
+                    error_count=F('error_count') + len(errors),
+                    errors=json.dumps(stored_errors),
+                    updated_timestamp=timezone.now())
+        status = ImportJob.DONE
+    except (OSError, ValueError) as error:
+        # Unreadable file or malformed line, nothing later can succeed
+        stored_errors = (stored_errors + [{'row': None, 'errors': str(error)}])[:MAX_STORED_ERRORS]
+        ImportJob.objects.filter(pk=job.pk).update(errors=json.dumps(stored_errors))
+        status = ImportJob.FAILED
+    ImportJob.objects.filter(pk=job.pk).update(status=status, updated_timestamp=timezone.now())
+    remove_upload(job.file_path)
+    job.refresh_from_db()
+    return job
+
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'IMPORT_JOB_WORKERS', 2),
+            thread_name_prefix='import-job')
+    return _executor
+
+
+def _run_in_worker(job_pk):
+    try:
+        run_import_job(job_pk)
+    except Exception:
+        logger.exception('Import job %s failed', job_pk)
+        ImportJob.objects.filter(pk=job_pk).update(status=ImportJob.FAILED, updated_timestamp=timezone.now())
+        for path in ImportJob.objects.filter(pk=job_pk).values_list('file_path', flat=True):
+            remove_upload(path)
+    finally:
+        close_old_connections()
+
+
+def submit_import_job(job_pk):
+    return get_executor().submit(_run_in_worker, job_pk)
@@ -0,0 +1,382 @@
+"""
+Invalidation bus between the processes of a deployment. Caches held
+in process memory (the local-memory cache backend, or anything given
+to register()) go stale when another worker writes. Every commit
+changing categories, drones, pilots, competitions or users publishes
+the changed pks on INVALIDATION_TRANSPORT, and every other process
+applies them to its own caches. A process that may have missed
+messages (a dropped connection, a gap in a publisher's sequence, a
+truncated file) flushes its caches instead.
+"""
+import json
+import logging
+import os
+import queue
+import select
+import threading
+import uuid
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connections, transaction
+from django.utils.module_loading import import_string
+
+from drones import cacheversions
+from drones.relatedfields import CACHED_SLUG_FIELDS, forget_slug_pks
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'drones_invalidation'
+# Postgres NOTIFY payloads must stay under 8000 bytes
+MAX_PKS_PER_MESSAGE = 500
+
+
+class TransportError(Exception):
+    pass
+
+
+class BaseTransport:
+    """
+    Carries text messages between processes. send() is called by the
+    writers, connect(), receive() and close() by the listener thread.
+    receive() waits at most timeout seconds and raises TransportError
+    when messages may have been lost.
+    """
+
+    def connect(self):
+        pass
+
+    def close(self):
+        pass
+
+    def send(self, message):
+        raise NotImplementedError('send() must be implemented.')
+
+    def receive(self, timeout):
+        raise NotImplementedError('receive() must be implemented.')
+
+
+class PostgresTransport(BaseTransport):
+    """
+    NOTIFY on the writer's connection, LISTEN on a connection of the
+    listener's own, outside of Django's connection handling
+    """
+
+    def __init__(self, alias='default', channel=CHANNEL):
+        self.alias = alias
+        self.channel = channel
+        self.listener = None
+
+    def connect(self):
+        wrapper = connections[self.alias]
+        try:
+            self.listener = wrapper.Database.connect(**wrapper.get_connection_params())
+            self.listener.set_session(autocommit=True)
+            with self.listener.cursor() as cursor:
+                cursor.execute('LISTEN {0}'.format(self.channel))
+        except wrapper.Database.Error as error:
+            raise TransportError(error)
+
+    def close(self):
+        if self.listener is not None:
+            try:
+                self.listener.close()
+            except Exception:
+                pass
+            self.listener = None
+
+    def send(self, message):
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [self.channel, message])
+
+    def receive(self, timeout):
+        if self.listener is None:
+            raise TransportError('Not connected.')
+        try:
+            if select.select([self.listener], [], [], timeout)[0]:
+                self.listener.poll()
+        except (connections[self.alias].Database.Error, OSError, ValueError) as error:
+            raise TransportError(error)
+        messages = [notify.payload for notify in self.listener.notifies]
+        del self.listener.notifies[:]
+        return messages
+
+
+class FileTransport(BaseTransport):
+    """
+    Messages appended as lines to INVALIDATION_FILE, for tests and
+    processes sharing a host. The file is never rotated by the bus,
+    listeners treat a truncated or replaced file as lost messages.
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            path = getattr(settings, 'INVALIDATION_FILE', os.path.join(settings.BASE_DIR, 'invalidation.log'))
+        self.path = path
+        self.file = None
+
+    def connect(self):
+        # Append mode creates the file, reads start at its end
+        self.file = open(self.path, 'a+b')
+        self.file.seek(0, os.SEEK_END)
+        self.pending = b''
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def send(self, message):
+        descriptor = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            # One write() per line, so lines of concurrent writers do not interleave
+            os.write(descriptor, message.encode('utf-8') + b'\n')
+        finally:
+            os.close(descriptor)
+
+    def receive(self, timeout):
+        if self.file is None:
+            raise TransportError('Not connected.')
+        try:
+            current = os.stat(self.path)
+        except FileNotFoundError:
+            raise TransportError('{0} was removed.'.format(self.path))
+        opened = os.fstat(self.file.fileno())
+        if current.st_ino != opened.st_ino or current.st_size < self.file.tell():
+            raise TransportError('{0} was truncated or replaced.'.format(self.path))
+        data = self.file.read()
+        if not data:
+            threading.Event().wait(min(timeout, 0.1))
+            return []
+        lines = (self.pending + data).split(b'\n')
+        # An unfinished last line waits for the next call
+        self.pending = lines.pop()
+        return [line.decode('utf-8') for line in lines if line]
+
+
+class LocalTransport(BaseTransport):
+    """
+    Between the buses of one process, for tests
+    """
+
+    _queues = set()
+    _lock = threading.Lock()
+
+    def __init__(self):
+        self.queue = None
+
+    def connect(self):
+        self.queue = queue.Queue()
+        with self._lock:
+            self._queues.add(self.queue)
+
+    def close(self):
+        with self._lock:
+            self._queues.discard(self.queue)
+        self.queue = None
+
+    def send(self, message):
+        with self._lock:
+            queues = list(self._queues)
+        for receiver in queues:
+            receiver.put(message)
+
+    def receive(self, timeout):
+        if self.queue is None:
+            raise TransportError('Not connected.')
+        try:
+            messages = [self.queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                messages.append(self.queue.get_nowait())
+            except queue.Empty:
+                return messages
+
+
+# (on_change(model, pks), on_flush()) of the per-process caches
+_handlers = []
+
+
+def register(on_change, on_flush):
+    """
+    Have a per-process cache told of the rows changed by the other
+    processes, and flushed when some changes may have been missed
+    """
+    _handlers.append((on_change, on_flush))
+
+
+def unregister(on_change, on_flush):
+    _handlers.remove((on_change, on_flush))
+
+
+def forget_local_rows(model, pks):
+    # Already committed, no need for the on_commit bump of cacheversions.changed()
+    cacheversions.bump_version(model._meta.db_table)
+    for pk in pks:
+        cacheversions.bump_version(cacheversions.object_name(model, pk))
+    if model in CACHED_SLUG_FIELDS:
+        forget_slug_pks(model, pks)
+
+
+# Keys of the per-process values the bus keeps fresh
+FLUSHED_PREFIXES = ('drones:version:', 'drones:slug:', 'drones:slug-pk:')
+
+
+def flush_local_cache():
+    """
+    Drop the version stamps and slugs of this process' memory, every
+    value built with them is computed again. The other entries (throttle
+    history, cached representations, counts) are left alone.
+    """
+    local = caches['default']
+    prefixes = tuple(local.make_key(prefix) for prefix in FLUSHED_PREFIXES)
+    # LocMemCache cannot delete by prefix, its keys are walked under its lock
+    with local._lock:
+        for key in [key for key in local._cache if key.startswith(prefixes)]:
+            local._delete(key)
+
+
+if isinstance(caches['default'], LocMemCache):
+    # Shared backends already see the writer's version bumps
+    register(forget_local_rows, flush_local_cache)
+
+
+class Bus:
+    """
+    Publishes this process' changes and applies the others'. Messages
+    carry the publisher's origin and sequence number, so a listener
+    notices when it missed some.
+    """
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.origin = uuid.uuid4().hex
+        self.sequence = 0
+        self.last_sequences = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self.thread = None
+
+    def publish(self, model, pks):
+        pks = sorted(set(pks))
+        # When the change was committed, in ms like the version stamps
+        version = cacheversions.initial_version()
+        # At least one message, a change of unknown rows still changes the table
+        for start in range(0, max(len(pks), 1), MAX_PKS_PER_MESSAGE):
+            # Sent under the lock, so the messages of the threads of
+            # this process go out in the order of their sequence
+            with self._lock:
+                self.sequence += 1
+                message = json.dumps({
+                    'origin': self.origin,
+                    'sequence': self.sequence,
+                    'model': model._meta.label_lower,
+                    'pks': pks[start:start + MAX_PKS_PER_MESSAGE],
+                    'version': version,
+                    })
+                try:
+                    self.transport.send(message)
+                except Exception:
+                    # Listeners see the gap in the sequence and flush
+                    logger.exception('Could not publish the invalidation of %s', model._meta.label)
+
+    def handle(self, message):
+        try:
+            event = json.loads(message)
+            model = apps.get_model(event['model'])
+            origin, sequence = event['origin'], event['sequence']
+        except (ValueError, KeyError, LookupError, TypeError):
+            logger.warning('Ignored invalidation message %r', message)
+            return
+        if origin == self.origin:
+            return
+        last = self.last_sequences.get(origin)
+        self.last_sequences[origin] = sequence
+        if last is not None and sequence != last + 1:
+            self.flush()
+            return
+        for on_change, on_flush in list(_handlers):
+            on_change(model, event['pks'])
+
+    def flush(self):
+        for on_change, on_flush in list(_handlers):
+            on_flush()
+
+    def listen(self):
+        """
+        Apply the messages of the other processes until stop(),
+        reconnecting with backoff and flushing after every reconnect
+        """
+        connected_before = False
+        delay = getattr(settings, 'INVALIDATION_RECONNECT_DELAY', 0.5)
+        while not self._stopping.is_set():
+            try:
+                self.transport.connect()
+                if connected_before:
+                    self.flush()
+                connected_before = True
+                delay = getattr(settings, 'INVALIDATION_RECONNECT_DELAY', 0.5)
+                while not self._stopping.is_set():
+                    for message in self.transport.receive(timeout=1):
+                        self.handle(message)
+            except TransportError as error:
+                logger.warning('Invalidation listener disconnected: %s', error)
+            except Exception:
+                logger.exception('Invalidation listener failed')
+            finally:
+                self.transport.close()
+            self._stopping.wait(delay)
+            delay = min(delay * 2, getattr(settings, 'INVALIDATION_MAX_RECONNECT_DELAY', 30))
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self._stopping.clear()
+            self.thread = threading.Thread(target=self.listen, name='drones-invalidation', daemon=True)
+            self.thread.start()
+
+    def stop(self, wait=True):
+        self._stopping.set()
+        if wait and self.thread is not None:
+            self.thread.join()
+
+
+_bus = None
+
+
+def get_bus():
+    """
+    The bus of this process, None without INVALIDATION_TRANSPORT
+    """
+    global _bus
+    transport_class = getattr(settings, 'INVALIDATION_TRANSPORT', None)
+    if transport_class is None:
+        return None
+    # A bus built before a fork belongs to the parent, it has its origin.
+    # One built for another transport (settings overridden) is replaced.
+    key = (os.getpid(), transport_class)
+    if _bus is None or _bus[0] != key:
+        if _bus is not None and _bus[0][0] == os.getpid():
+            _bus[1].stop(wait=False)
+        _bus = (key, Bus(import_string(transport_class)()))
+    return _bus[1]
+
+
+def changed(model, pks):
+    """
+    Publish the rows changed by the current transaction once it commits
+    """
+    bus = get_bus()
+    if bus is not None:
+        pks = list(pks)
+        transaction.on_commit(lambda: bus.publish(model, pks))
+
+
+def start_listening(**kwargs):
+    # request_started receiver, workers listen from their first request
+    bus = get_bus()
+    if bus is not None:
+        bus.start()
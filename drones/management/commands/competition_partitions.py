@@ -0,0 +1,85 @@
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils import timezone
+
+from drones import partitions
+from drones.models import Competition
+
+
+def parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+
+
+class Command(BaseCommand):
+    help = (
+        'Manage the monthly partitions of the competition table on PostgreSQL: '
+        'convert the existing table, create upcoming partitions (run it from cron), '
+        'archive old ones and check that date filters prune partitions.'
+        )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+        actions = parser.add_subparsers(dest='action')
+        actions.required = True
+        convert = actions.add_parser('convert', help='Move the existing table to a partitioned one')
+        convert.add_argument('--months-ahead', type=int, default=3)
+        future = actions.add_parser('create-future', help='Create the partitions of the coming months')
+        future.add_argument('--months-ahead', type=int, default=3)
+        archive = actions.add_parser('archive', help='Detach the partitions ending before a date')
+        archive.add_argument('before', type=parse_date, help='YYYY-MM-DD')
+        archive.add_argument('--drop', action='store_true', help='Drop the detached partitions')
+        actions.add_parser('list', help='List the attached partitions')
+        benchmark = actions.add_parser(
+            'benchmark',
+            help='EXPLAIN ANALYZE a from/to_achievement_date filter and report the partitions it reads')
+        benchmark.add_argument('from_date', type=parse_date, help='YYYY-MM-DD')
+        benchmark.add_argument('to_date', type=parse_date, help='YYYY-MM-DD')
+        benchmark.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        try:
+            partitions.check_backend(connection)
+            getattr(self, options['action'].replace('-', '_'))(connection, options)
+        except partitions.PartitioningError as error:
+            raise CommandError(str(error))
+
+    def convert(self, connection, options):
+        partitions.convert_to_partitioned(connection, options['months_ahead'])
+        self.stdout.write('{0} is now partitioned by month'.format(partitions.PARENT))
+        self.list(connection, options)
+
+    def create_future(self, connection, options):
+        if not partitions.is_partitioned(connection):
+            raise CommandError('Run "convert" first.')
+        for name in partitions.ensure_future_partitions(connection, options['months_ahead']):
+            self.stdout.write('Created {0}'.format(name))
+
+    def archive(self, connection, options):
+        for name in partitions.archive_partitions(connection, options['before'], options['drop']):
+            self.stdout.write('{0} {1}'.format('Dropped' if options['drop'] else 'Detached', name))
+
+    def list(self, connection, options):
+        for name, bound in partitions.list_partitions(connection):
+            self.stdout.write('{0}: {1}'.format(name, bound))
+
+    def benchmark(self, connection, options):
+        # Same lookups CompetitionFilter builds for from/to_achievement_date
+        queryset = Competition.objects.using(connection.alias).filter(
+            distance_achievement_date__gte=options['from_date'],
+            distance_achievement_date__lte=options['to_date'])
+        total = len(partitions.list_partitions(connection)) or 1
+        timings = []
+        for i in range(options['repeat']):
+            started = time.perf_counter()
+            scanned, execution_ms = partitions.explain(connection, queryset)
+            timings.append((time.perf_counter() - started) * 1000)
+        scanned = sorted(set(scanned))
+        self.stdout.write('Partitions read: {0} of {1}'.format(len(scanned), total))
+        for name in scanned:
+            self.stdout.write('  {0}'.format(name))
+        self.stdout.write('Last execution time: {0} ms'.format(execution_ms))
+        self.stdout.write('Best round trip over {0} runs: {1:.2f} ms'.format(len(timings), min(timings)))
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from drones import columnar
+
+
+class Command(BaseCommand):
+    help = (
+        'Write the columnar competition snapshot served by competitions/stats/, '
+        'or bring it up to date with the competitions created, updated and '
+        'deleted since its last export. Run it from cron.'
+        )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Write it from scratch')
+        parser.add_argument('--dir', help='Snapshot directory, COMPETITION_SNAPSHOT_DIR by default')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        try:
+            manifest = columnar.export(full=options['full'], directory=options['dir'])
+        except columnar.SnapshotError as error:
+            raise CommandError(str(error))
+        self.stdout.write('{0} competitions up to id {1} exported in {2:.2f}s'.format(
+            manifest['rows'], manifest['last_id'], time.monotonic() - started))
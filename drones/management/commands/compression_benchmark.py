@@ -0,0 +1,77 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.http import HttpResponse
+from django.test import RequestFactory
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from drones import compression
+from drones.models import Pilot
+from drones.serializers import PilotSerializer, UserSerializer
+
+SOURCES = {
+    'pilot-list': (Pilot, PilotSerializer),
+    'user-list': (User, UserSerializer),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure the CPU time a response costs to compress on every request '
+        'against serving it precompressed from the cache, for a page of the '
+        'pilot or user list rendered from the database.'
+        )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--view', choices=sorted(SOURCES), default='pilot-list')
+        parser.add_argument('--rows', type=int, default=100, help='Rows in the page')
+        parser.add_argument('--requests', type=int, default=200, help='Requests timed per strategy')
+
+    def handle(self, *args, **options):
+        model, serializer_class = SOURCES[options['view']]
+        # A host allowed with the default ALLOWED_HOSTS
+        request = Request(RequestFactory().get('/', SERVER_NAME='localhost'))
+        rows = list(model.objects.order_by('pk')[:options['rows']])
+        if not rows:
+            raise CommandError('No rows to render, load some {0} first.'.format(model._meta.verbose_name_plural))
+        body = JSONRenderer().render(serializer_class(rows, many=True, context={'request': request}).data)
+        self.stdout.write('{0} rows, {1} bytes of JSON'.format(len(rows), len(body)))
+        self.stdout.write('{0:<28} {1:>12} {2:>10}'.format('strategy', 'cpu ms/req', 'bytes'))
+
+        for encoding in compression.available_encodings():
+            def compress_every_time():
+                return b''.join(compression.stream_compress(compression.chunked(body), encoding))
+
+            cpu = self.cpu_ms(compress_every_time, options['requests'])
+            size = len(compress_every_time())
+            self.stdout.write('{0:<28} {1:>12.3f} {2:>10}'.format('{0} per request'.format(encoding), cpu, size))
+
+        started = time.process_time()
+        bodies = compression.compressed_bodies(body)
+        precompressing = (time.process_time() - started) * 1000
+        key = 'drones:compression-benchmark'
+        cache.set(key, {'content_type': 'application/json', 'bodies': bodies})
+        factory = RequestFactory()
+        for encoding in compression.available_encodings():
+            client_request = factory.get('/', HTTP_ACCEPT_ENCODING=encoding)
+
+            def serve_precompressed():
+                entry = cache.get(key)
+                return compression.encoded_response(
+                    HttpResponse(content_type=entry['content_type']), entry['bodies'], client_request)
+
+            cpu = self.cpu_ms(serve_precompressed, options['requests'])
+            self.stdout.write('{0:<28} {1:>12.3f} {2:>10}'.format(
+                '{0} precompressed'.format(encoding), cpu, len(bodies.get(encoding, body))))
+        cache.delete(key)
+        self.stdout.write('Precompressing once: {0:.3f} ms CPU'.format(precompressing))
+
+    def cpu_ms(self, function, requests):
+        # Mean, single requests are below the clock's resolution
+        started = time.process_time()
+        for request in range(requests):
+            function()
+        return (time.process_time() - started) * 1000 / requests
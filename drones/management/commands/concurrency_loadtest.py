@@ -0,0 +1,161 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.utils import timezone
+
+from drones import views
+from drones.concurrency import ConcurrencyLimiter
+from drones.middleware import AdaptiveConcurrencyMiddleware
+from drones.models import Drone, DroneCategory
+
+# Share of the offered requests per kind of request
+TRAFFIC_MIX = (
+    ('anonymous GET', 0.6),
+    ('authenticated GET', 0.25),
+    ('authenticated POST', 0.1),
+    ('owner PATCH', 0.05),
+    )
+
+
+class LoadTestServer:
+    """
+    Worker threads passing requests through AdaptiveConcurrencyMiddleware,
+    as Django's handler does, to views that each hold one of a few
+    database connections for service_time seconds. The middleware
+    classifies the requests for real: it authenticates them and asks
+    the drone detail view whether the user owns the drone.
+    """
+
+    def __init__(self, workers, connections, service_time, limiter=None):
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.pool = threading.BoundedSemaphore(connections)
+        self.service_time = service_time
+        self.middleware = None
+        if limiter is not None:
+            self.middleware = AdaptiveConcurrencyMiddleware(self.respond, limiter)
+        self.results = []
+        self.results_lock = threading.Lock()
+
+    def respond(self, request):
+        if self.middleware is not None:
+            response = self.middleware.process_view(request, request.loadtest_view, (), request.loadtest_kwargs)
+            if response is not None:
+                return response
+        with self.pool:
+            # Some jitter, real queries do not all take as long
+            time.sleep(self.service_time * random.uniform(0.5, 1.5))
+        return HttpResponse()
+
+    def handle(self, kind, request, arrived):
+        if self.middleware is not None:
+            response = self.middleware(request)
+        else:
+            response = self.respond(request)
+        with self.results_lock:
+            self.results.append((kind, response.status_code, time.monotonic() - arrived))
+
+    def submit(self, kind, request):
+        self.executor.submit(self.handle, kind, request, time.monotonic())
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+def pick_kind():
+    value = random.random()
+    for kind, share in TRAFFIC_MIX:
+        value -= share
+        if value < 0:
+            return kind
+    return TRAFFIC_MIX[-1][0]
+
+
+class Command(BaseCommand):
+    help = (
+        'Offer increasing request rates to views answering in a fixed service '
+        'time, through the adaptive concurrency middleware or not, and report '
+        'goodput: requests answered successfully within the client timeout. '
+        'Without the limiter goodput collapses past saturation, with it the '
+        'excess is shed and goodput stays near capacity. A user, a category '
+        'and a drone are created for the run and deleted afterwards.'
+        )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rates', type=int, nargs='+', default=[100, 200, 400, 800],
+                            help='Offered requests per second')
+        parser.add_argument('--duration', type=float, default=2.0, help='Seconds per rate')
+        parser.add_argument('--workers', type=int, default=64, help='Server worker threads')
+        parser.add_argument('--connections', type=int, default=10, help='Database connections')
+        parser.add_argument('--service-time', type=float, default=0.04, help='Seconds per query')
+        parser.add_argument('--timeout', type=float, default=0.5, help='Client timeout in seconds')
+
+    def handle(self, *args, **options):
+        user = User.objects.create_user('concurrency-loadtest-{0}'.format(time.time_ns()))
+        category = DroneCategory.objects.create(name=user.username)
+        drone = Drone.objects.create(
+            name=user.username, drone_category=category, manufacturing_date=timezone.now(), owner=user)
+        try:
+            capacity = options['connections'] / options['service_time']
+            self.stdout.write('Capacity about {0:.0f} requests/s, client timeout {1}s'.format(
+                capacity, options['timeout']))
+            self.stdout.write('{0:>8} {1:>10} {2:>10} {3:>8} {4:>6}  {5}'.format(
+                'rate', 'limiter', 'goodput/s', 'shed', 'limit', 'goodput/s per request kind'))
+            for rate in options['rates']:
+                for limited in (False, True):
+                    self.run(rate, limited, options, user, drone)
+        finally:
+            category.delete()
+            user.delete()
+
+    def build_request(self, kind, user, drone):
+        factory = RequestFactory()
+        if kind == 'owner PATCH':
+            request = factory.patch('/drones/{0}'.format(drone.pk))
+            view, kwargs = views.DroneDetail, {'pk': drone.pk}
+        elif kind == 'authenticated POST':
+            request = factory.post('/competitions/')
+            view, kwargs = views.CompetitionList, {}
+        else:
+            request = factory.get('/competitions/')
+            view, kwargs = views.CompetitionList, {}
+        # Logged in through the session, as AuthenticationMiddleware
+        # and CsrfViewMiddleware would have left it
+        request.user = user if kind != 'anonymous GET' else AnonymousUser()
+        request._dont_enforce_csrf_checks = True
+        request.loadtest_view = view.as_view()
+        request.loadtest_kwargs = kwargs
+        return request
+
+    def run(self, rate, limited, options, user, drone):
+        limiter = ConcurrencyLimiter() if limited else None
+        server = LoadTestServer(
+            options['workers'], options['connections'], options['service_time'], limiter)
+        started = time.monotonic()
+        while time.monotonic() - started < options['duration']:
+            # Poisson arrivals
+            time.sleep(random.expovariate(rate))
+            kind = pick_kind()
+            server.submit(kind, self.build_request(kind, user, drone))
+        server.shutdown()
+
+        good = dict((kind, 0) for kind, share in TRAFFIC_MIX)
+        shed = 0
+        for kind, status, latency in server.results:
+            if status == 503:
+                shed += 1
+            elif latency <= options['timeout']:
+                good[kind] += 1
+        duration = options['duration']
+        self.stdout.write('{0:>8} {1:>10} {2:>10.0f} {3:>8} {4:>6}  {5}'.format(
+            rate,
+            'on' if limited else 'off',
+            sum(good.values()) / duration,
+            shed,
+            '{0:.1f}'.format(limiter.limit) if limited else '-',
+            ' '.join('{0}={1:.0f}'.format(kind, count / duration) for kind, count in good.items())))
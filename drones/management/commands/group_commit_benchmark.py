@@ -0,0 +1,75 @@
+import statistics
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from drones import groupcommit
+from drones.models import Competition, Drone, Pilot
+
+
+class Command(BaseCommand):
+    help = (
+        'Insert competitions from concurrent threads, as timing devices '
+        'POSTing results would, once committing each row on its own and '
+        'once through the group commit, and report rows per second and '
+        'latency percentiles. The rows are deleted afterwards.'
+        )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--rows', type=int, default=200, help='Rows inserted by each thread')
+
+    def handle(self, *args, **options):
+        pilot = Pilot.objects.order_by('pk').first()
+        drone = Drone.objects.order_by('pk').first()
+        if pilot is None or drone is None:
+            raise CommandError('Needs at least one pilot and one drone.')
+        committer = groupcommit.GroupCommitter()
+        strategies = (
+            ('commit per row', lambda competition: competition.save()),
+            ('group commit', committer.commit),
+            )
+        self.stdout.write('{0:<16} {1:>10} {2:>10} {3:>10}'.format('strategy', 'rows/s', 'p50 ms', 'p99 ms'))
+        for label, save in strategies:
+            latencies, elapsed, created = self.run(save, pilot, drone, options['threads'], options['rows'])
+            Competition.objects.filter(pk__in=created).delete()
+            latencies.sort()
+            self.stdout.write('{0:<16} {1:>10.0f} {2:>10.2f} {3:>10.2f}'.format(
+                label, len(latencies) / elapsed,
+                statistics.median(latencies),
+                latencies[int(len(latencies) * 0.99) - 1]))
+
+    def run(self, save, pilot, drone, threads, rows):
+        latencies, created, failures = [], [], []
+        lock = threading.Lock()
+
+        def insert_rows():
+            try:
+                for row in range(rows):
+                    competition = Competition(
+                        pilot=pilot, drone=drone, distance_in_feet=row,
+                        distance_achievement_date=timezone.now())
+                    started = time.perf_counter()
+                    save(competition)
+                    with lock:
+                        latencies.append((time.perf_counter() - started) * 1000)
+                        created.append(competition.pk)
+            except Exception as error:
+                failures.append(error)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=insert_rows) for thread in range(threads)]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+        if failures:
+            Competition.objects.filter(pk__in=created).delete()
+            raise CommandError('Insert failed: {0}'.format(failures[0]))
+        return latencies, elapsed, created
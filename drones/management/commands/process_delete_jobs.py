@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from drones.fastdelete import run_delete_job
+from drones.models import DeleteJob
+
+
+class Command(BaseCommand):
+    help = (
+        'Run pending delete jobs and resume the ones interrupted by a crash '
+        '(running but untouched for IMPORT_JOB_STALE_SECONDS).'
+        )
+
+    def add_arguments(self, parser):
+        parser.add_argument('job_ids', nargs='*', type=int, help='Only run these jobs')
+
+    def handle(self, *args, **options):
+        jobs = DeleteJob.objects.filter(status__in=(DeleteJob.PENDING, DeleteJob.RUNNING))
+        if options['job_ids']:
+            jobs = jobs.filter(pk__in=options['job_ids'])
+        for job_pk in jobs.order_by('id').values_list('pk', flat=True):
+            job = run_delete_job(job_pk)
+            if job is None:
+                self.stdout.write('Job {0} is owned by another worker, skipped'.format(job_pk))
+                continue
+            self.stdout.write('Job {0}: {1}, {2} rows deleted'.format(job.pk, job.status, job.deleted_rows))
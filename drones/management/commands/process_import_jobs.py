@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from drones.importjobs import run_import_job
+from drones.models import ImportJob
+
+
+class Command(BaseCommand):
+    help = (
+        'Run pending import jobs and resume the ones interrupted by a crash '
+        '(running but untouched for IMPORT_JOB_STALE_SECONDS).'
+        )
+
+    def add_arguments(self, parser):
+        parser.add_argument('job_ids', nargs='*', type=int, help='Only run these jobs')
+
+    def handle(self, *args, **options):
+        jobs = ImportJob.objects.filter(status__in=(ImportJob.PENDING, ImportJob.RUNNING))
+        if options['job_ids']:
+            jobs = jobs.filter(pk__in=options['job_ids'])
+        for job_pk in jobs.order_by('id').values_list('pk', flat=True):
+            job = run_import_job(job_pk)
+            if job is None:
+                self.stdout.write('Job {0} is owned by another worker, skipped'.format(job_pk))
+                continue
+            self.stdout.write('Job {0}: {1}, {2} of {3} rows imported, {4} errors'.format(
+                job.pk, job.status, job.imported_rows, job.total_rows, job.error_count))
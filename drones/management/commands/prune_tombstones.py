@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from drones.fastdelete import delete_chunks
+from drones.models import Tombstone
+from drones.sync import tombstone_retention
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete the tombstones older than SYNC_TOMBSTONE_RETENTION_DAYS. '
+        'Sync clients whose cursor predates them are told to start over.'
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - tombstone_retention()
+        deleted = delete_chunks(Tombstone.objects.filter(deleted_timestamp__lt=cutoff))
+        self.stdout.write('{0} tombstones older than {1} deleted'.format(deleted, cutoff.isoformat()))
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from drones import slowqueries
+
+
+class Command(BaseCommand):
+    help = (
+        'Summarize the slow-query log by view and filter signature, worst '
+        'total time first, with the slowest query of each and its plan.'
+        )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--log', help='Log file, SLOW_QUERY_LOG by default')
+        parser.add_argument('--top', type=int, default=10, help='Signatures to report')
+        parser.add_argument('--view', help='Only the queries of this view name')
+
+    def handle(self, *args, **options):
+        path = options['log'] or slowqueries.log_path()
+        if not path:
+            raise CommandError('Set SLOW_QUERY_LOG or pass --log.')
+        groups = {}
+        for record in slowqueries.read_records(path):
+            if options['view'] and record['view'] != options['view']:
+                continue
+            group = groups.setdefault((record['view'], record['signature']), {
+                'count': 0, 'total': 0.0, 'worst': record})
+            group['count'] += 1
+            group['total'] += record['duration_ms']
+            if record['duration_ms'] > group['worst']['duration_ms']:
+                group['worst'] = record
+        if not groups:
+            self.stdout.write('No slow queries logged')
+            return
+        ranked = sorted(groups.items(), key=lambda item: item[1]['total'], reverse=True)
+        for (view, signature), group in ranked[:options['top']]:
+            worst = group['worst']
+            self.stdout.write('{0} ?{1}'.format(view or '-', signature))
+            self.stdout.write('  {0} queries, {1:.1f} ms total, {2:.1f} ms mean, {3:.1f} ms max'.format(
+                group['count'], group['total'], group['total'] / group['count'], worst['duration_ms']))
+            self.stdout.write('  slowest: {0}'.format(worst['sql']))
+            self.stdout.write('  params: {0}  query string: {1}'.format(worst['params'], worst['query_string']))
+            summary = slowqueries.plan_summary(worst['plan'])
+            if summary:
+                self.stdout.write('  plan: {0}'.format(summary))
@@ -0,0 +1,85 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Run in a fresh interpreter: import config.wsgi as a preloading server
+# would, fork a worker and time the worker's first two responses
+WORKER_SCRIPT = '''
+import io, json, os, sys, time
+
+started = time.perf_counter()
+from config.wsgi import application
+imported = time.perf_counter()
+
+
+def get(path):
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '',
+        'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'HTTP_HOST': 'localhost',
+        'HTTP_ACCEPT': 'application/json', 'wsgi.input': io.BytesIO(), 'wsgi.url_scheme': 'http',
+        'wsgi.errors': sys.stderr,
+    }
+    status = []
+    began = time.perf_counter()
+    body = b''.join(application(environ, lambda code, headers, exc_info=None: status.append(code)))
+    return (time.perf_counter() - began) * 1000, status[0]
+
+
+def serve():
+    first, status = get(sys.argv[1])
+    second, status = get(sys.argv[1])
+    print(json.dumps({
+        'import_ms': (imported - started) * 1000, 'first_ms': first, 'second_ms': second, 'status': status}))
+    sys.stdout.flush()
+
+
+if hasattr(os, 'fork'):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            serve()
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+else:
+    serve()
+'''
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure worker cold start: the time to import config.wsgi in a fresh '
+        'interpreter and the time a worker forked from it takes to answer its '
+        'first and second requests, with and without DRONES_WARM_UP.'
+        )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('--path', default='/', help='Path requested by the workers')
+
+    def handle(self, *args, **options):
+        self.stdout.write('{0:>8} {1:>10} {2:>10} {3:>10}'.format(
+            'warm-up', 'import ms', 'first ms', 'second ms'))
+        for warm_up in (False, True):
+            samples = [self.run(options['path'], warm_up) for run in range(options['runs'])]
+            self.stdout.write('{0:>8} {1:>10.1f} {2:>10.1f} {3:>10.1f}'.format(
+                'on' if warm_up else 'off',
+                statistics.median(sample['import_ms'] for sample in samples),
+                statistics.median(sample['first_ms'] for sample in samples),
+                statistics.median(sample['second_ms'] for sample in samples)))
+
+    def run(self, path, warm_up):
+        environment = dict(os.environ, DRONES_WARM_UP='1' if warm_up else '0')
+        environment.setdefault('DJANGO_SETTINGS_MODULE', os.environ.get('DJANGO_SETTINGS_MODULE', 'config.settings'))
+        result = subprocess.run(
+            [sys.executable, '-c', WORKER_SCRIPT, path],
+            cwd=settings.BASE_DIR, env=environment, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        lines = result.stdout.decode('utf-8').strip().splitlines()
+        if result.returncode or not lines:
+            raise CommandError(result.stderr.decode('utf-8'))
+        return json.loads(lines[-1])
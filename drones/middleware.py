@@ -0,0 +1,268 @@
+import hashlib
+import random
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.http import JsonResponse
+from django.utils.cache import patch_vary_headers
+from django.urls import reverse
+from rest_framework import exceptions, permissions
+from rest_framework.request import Request
+from rest_framework.views import APIView
+
+from drones import compression, concurrency, dbrouter, slowqueries
+
+
+def view_name(view_func):
+    view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+    name = getattr(view_class, 'name', None)
+    return name if isinstance(name, str) else getattr(view_func, '__name__', '')
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Lets safe-method requests read from the replicas configured in
+    DATABASE_REPLICAS. Once a client has written, its reads stay on
+    the primary for REPLICA_STICKY_SECONDS so it always sees its own
+    writes. The pin is kept both in a cookie and, under a fingerprint
+    of the client's credentials, in the REPLICA_PIN_CACHE shared by the
+    workers, so token clients that ignore cookies are covered too
+    whichever worker serves them.
+    """
+
+    cookie_name = 'drones_pin_primary'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not dbrouter.get_replica_aliases():
+            return self.get_response(request)
+
+        read_from_replica = (
+            request.method in permissions.SAFE_METHODS
+            and not self.is_pinned(request))
+        with dbrouter.reading_from_replica(read_from_replica):
+            response = self.get_response(request)
+
+        if request.method not in permissions.SAFE_METHODS:
+            self.pin(request, response)
+        return response
+
+    def sticky_seconds(self):
+        return getattr(settings, 'REPLICA_STICKY_SECONDS', 5)
+
+    def client_key(self, request):
+        credentials = (
+            request.META.get('HTTP_AUTHORIZATION')
+            or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+            or request.META.get('REMOTE_ADDR', ''))
+        digest = hashlib.sha1(credentials.encode('utf-8')).hexdigest()
+        return 'drones:pin-primary:{0}'.format(digest)
+
+    def is_pinned(self, request):
+        try:
+            pinned_until = float(request.COOKIES.get(self.cookie_name, 0))
+        except ValueError:
+            pinned_until = 0
+        if pinned_until > time.time():
+            return True
+        return dbrouter.get_pin_cache().get(self.client_key(request)) is not None
+
+    def pin(self, request, response):
+        seconds = self.sticky_seconds()
+        if seconds <= 0:
+            return
+        response.set_cookie(
+            self.cookie_name,
+            str(time.time() + seconds),
+            max_age=seconds,
+            httponly=True)
+        dbrouter.get_pin_cache().set(self.client_key(request), 1, seconds)
+
+
+class AdaptiveConcurrencyMiddleware:
+    """
+    Caps the requests in flight at an adaptive limit and answers the
+    requests over their priority's share of it with a 503 and a
+    Retry-After header, instead of letting them queue for database
+    connections. Requests to API views are classified once authenticated
+    with the view's own authentication classes, the view is then handed
+    that user instead of authenticating again. Other views are
+    classified by the user of AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response, limiter=None):
+        self.get_response = get_response
+        # The worker's limiter unless given one (concurrency_loadtest)
+        self.limiter = limiter
+
+    def __call__(self, request):
+        try:
+            return self.get_response(request)
+        finally:
+            ticket = getattr(request, '_concurrency_ticket', None)
+            if ticket is not None:
+                request._concurrency_ticket = None
+                self.get_limiter().release(ticket)
+
+    def get_limiter(self):
+        return self.limiter if self.limiter is not None else concurrency.get_limiter()
+
+    def view_name(self, view_func):
+        return view_name(view_func)
+
+    def authenticate(self, request, view_func):
+        """
+        The user the view will see, None when its credentials are
+        rejected: the view answers that itself
+        """
+        view_class = getattr(view_func, 'cls', None)
+        if view_class is None or not issubclass(view_class, APIView):
+            return getattr(request, 'user', None)
+        view = view_class(**getattr(view_func, 'initkwargs', {}))
+        api_request = Request(request, authenticators=view.get_authenticators())
+        try:
+            user, auth = api_request.user, api_request.auth
+        except exceptions.APIException:
+            return None
+        if user is not None and user.is_authenticated:
+            # Anonymous requests authenticate again, for the view
+            # to tell 401 from 403
+            request._force_auth_user = user
+            request._force_auth_token = auth
+        return user
+
+    def priority(self, request, view_func, view_kwargs):
+        user = self.authenticate(request, view_func)
+        authenticated = bool(user and user.is_authenticated)
+        # Views telling whether the user owns the requested object,
+        # only asked when a rule depends on it
+        owned_by = getattr(getattr(view_func, 'cls', None), 'owned_by', None)
+        is_owner = None
+        if owned_by is not None and authenticated:
+            is_owner = lambda: owned_by(user, view_kwargs)
+        return concurrency.request_priority(self.view_name(view_func), request.method, authenticated, is_owner)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        name = self.view_name(view_func)
+        priority = self.priority(request, view_func, view_kwargs)
+        ticket = self.get_limiter().acquire(name, priority)
+        if ticket is None:
+            response = JsonResponse({'detail': 'Server overloaded, retry later.'}, status=503)
+            response['Retry-After'] = str(getattr(settings, 'CONCURRENCY_RETRY_AFTER', 1))
+            return response
+        request._concurrency_ticket = ticket
+        return None
+
+
+class SlowQueryMiddleware:
+    """
+    Logs the slow queries of a sample of the requests when SLOW_QUERY_LOG
+    is set, see drones/slowqueries.py. The plans are captured once the
+    response is ready, so their queries are not timed themselves.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not slowqueries.log_path() or random.random() >= slowqueries.sample_rate():
+            return self.get_response(request)
+        threshold = slowqueries.threshold_ms()
+        recorders = []
+        with ExitStack() as stack:
+            for connection in connections.all():
+                recorder = slowqueries.QueryRecorder(connection.alias, threshold)
+                stack.enter_context(connection.execute_wrapper(recorder))
+                recorders.append(recorder)
+            response = self.get_response(request)
+        self.log(request, response, recorders)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._slow_query_view = view_name(view_func)
+        return None
+
+    def log(self, request, response, recorders):
+        records = []
+        for recorder in recorders:
+            connection = connections[recorder.alias]
+            for sql, params, many, duration in recorder.slow:
+                records.append({
+                    'time': time.time(),
+                    'view': getattr(request, '_slow_query_view', ''),
+                    'method': request.method,
+                    'path': request.path,
+                    'query_string': request.META.get('QUERY_STRING', ''),
+                    'signature': slowqueries.filter_signature(request.GET),
+                    'status': response.status_code,
+                    'database': recorder.alias,
+                    'duration_ms': round(duration, 3),
+                    'sql': sql,
+                    'params': None if many else slowqueries.redact(sql, params),
+                    'plan': None if many else slowqueries.explain(connection, sql, params),
+                    })
+        if records:
+            slowqueries.write_records(records)
+
+
+class ProfilingMiddleware:
+    """
+    Profiles the requests of staff users asking for it with the
+    X-Drones-Profile header or ?profile=1, see drones/profiling.py.
+    The response's X-Drones-Profile header links to the profile.
+    Other requests only pay for looking for the header.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    header = 'HTTP_X_DRONES_PROFILE'
+    parameter = 'profile'
+
+    def asks_for_profile(self, request):
+        if self.header in request.META:
+            return True
+        # Not ?myprofile=1 nor ?profile=0
+        return request.GET.get(self.parameter, '') not in ('', '0')
+
+    def __call__(self, request):
+        if not self.asks_for_profile(request):
+            return self.get_response(request)
+        # Not imported by workers until someone profiles
+        from drones import profiling
+        if not profiling.is_staff(request):
+            return self.get_response(request)
+        response, profile_id = profiling.run_profiled(request, self.get_response)
+        if profile_id is None:
+            response['X-Drones-Profile'] = 'busy'
+        else:
+            response['X-Drones-Profile'] = request.build_absolute_uri(
+                reverse('profile-detail', args=(profile_id,)))
+        return response
+
+
+class CompressionMiddleware:
+    """
+    Compresses large responses of COMPRESSIBLE_CONTENT_TYPES in the
+    encoding the client prefers, chunk by chunk as they are sent.
+    Bodies served precompressed by the views are left alone. HTML is
+    never compressed, it holds CSRF tokens (BREACH).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if not compression.compressible(response):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = compression.choose_encoding(
+            request.META.get('HTTP_ACCEPT_ENCODING'), compression.available_encodings())
+        if encoding == compression.IDENTITY:
+            return response
+        return compression.compressed_response(response, encoding)
@@ -0,0 +1,65 @@
+# Generated by Django 3.0.7 on 2026-10-19 16:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drones', '0004_auto_20200401_2337'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_name', models.CharField(max_length=100)),
+                ('object_pk', models.IntegerField()),
+                ('deleted_timestamp', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ('id',),
+            },
+        ),
+        migrations.AddField(
+            model_name='competition',
+            name='updated_timestamp',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='drone',
+            name='updated_timestamp',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='dronecategory',
+            name='updated_timestamp',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='pilot',
+            name='updated_timestamp',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='competition',
+            index=models.Index(fields=['updated_timestamp', 'id'], name='drones_comp_updated_5682c4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='drone',
+            index=models.Index(fields=['updated_timestamp', 'id'], name='drones_dron_updated_58e947_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dronecategory',
+            index=models.Index(fields=['updated_timestamp', 'id'], name='drones_dron_updated_38daa0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pilot',
+            index=models.Index(fields=['updated_timestamp', 'id'], name='drones_pilo_updated_1b1671_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['model_name', 'id'], name='drones_tomb_model_n_3f8ba5_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.0.7 on 2026-10-19 17:10
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('drones', '0006_importjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeleteJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_label', models.CharField(max_length=100)),
+                ('object_pk', models.IntegerField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('deleted_rows', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+                ('inserted_timestamp', models.DateTimeField(auto_now_add=True)),
+                ('updated_timestamp', models.DateTimeField(auto_now=True)),
+                ('owner', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='delete_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ('-id',),
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.0.7 on 2026-10-19 17:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drones', '0007_deletejob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='drone',
+            index=models.Index(fields=['drone_category', 'id'], name='drones_dron_drone_c_b6be16_idx'),
+        ),
+    ]
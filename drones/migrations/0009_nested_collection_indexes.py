@@ -0,0 +1,25 @@
+# Generated by Django 3.0.7 on 2026-10-19 17:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drones', '0008_drone_category_id_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='competition',
+            index=models.Index(fields=['pilot', 'distance_in_feet'], name='drones_comp_pilot_i_e57e83_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='drone',
+            index=models.Index(fields=['drone_category', 'name'], name='drones_dron_drone_c_d62baa_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='drone',
+            index=models.Index(fields=['owner', 'name'], name='drones_dron_owner_i_9a9be9_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+import secrets
+
+from django.db import migrations, models
+
+import drones.models
+
+
+def fill_tokens(apps, schema_editor):
+    DeleteJob = apps.get_model('drones', 'DeleteJob')
+    for job in DeleteJob.objects.filter(token__isnull=True).only('pk'):
+        DeleteJob.objects.filter(pk=job.pk).update(token=secrets.token_hex(16))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drones', '0009_nested_collection_indexes'),
+    ]
+
+    operations = [
+        # Nullable first, existing jobs each get their own token
+        migrations.AddField(
+            model_name='deletejob',
+            name='token',
+            field=models.CharField(max_length=32, null=True),
+        ),
+        migrations.RunPython(fill_tokens, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='deletejob',
+            name='token',
+            field=models.CharField(default=drones.models.new_job_token, max_length=32, unique=True),
+        ),
+    ]
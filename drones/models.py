@@ -1,11 +1,18 @@
+import secrets
+
 from django.db import models
 from django.conf import settings
 
 class DroneCategory(models.Model):
     name = models.CharField(max_length=250,unique=True)
+    updated_timestamp = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ('name',)
+        indexes = [
+            # Change feed: rows updated after a sync cursor
+            models.Index(fields=['updated_timestamp', 'id']),
+        ]
     
     def __str__(self):
         return self.name
@@ -17,9 +24,18 @@ class Drone(models.Model):
     has_it_competed = models.BooleanField(default=False)
     inserted_timestamp = models.DateTimeField(auto_now_add=True)
     owner = models.ForeignKey(to=settings.AUTH_USER_MODEL, related_name="drones", on_delete=models.CASCADE)
+    updated_timestamp = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ('name',)
+        indexes = [
+            models.Index(fields=['updated_timestamp', 'id']),
+            # Pages of a category's drones (drone-categories2/<pk>/drones/)
+            models.Index(fields=['drone_category', 'id']),
+            # First drones of each category and owner, by name (nested collections)
+            models.Index(fields=['drone_category', 'name']),
+            models.Index(fields=['owner', 'name']),
+        ]
     
     def __str__(self):
         return self.name + "-" + self.owner.username 
@@ -35,9 +51,13 @@ class Pilot(models.Model):
     gender = models.CharField(max_length=2, choices=GENDER_CHOICES, default=MALE)
     races_count = models.IntegerField()
     inserted_timestamp = models.DateTimeField(auto_now_add=True)
+    updated_timestamp = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ('name',)
+        indexes = [
+            models.Index(fields=['updated_timestamp', 'id']),
+        ]
     
     def __str__(self):
         return self.name
@@ -47,7 +67,122 @@ class Competition(models.Model):
     drone = models.ForeignKey(Drone, on_delete=models.CASCADE)
     distance_in_feet = models.IntegerField()
     distance_achievement_date = models.DateTimeField()
+    updated_timestamp = models.DateTimeField(auto_now=True)
     
     class Meta:
         # Order by distance in descending order
-        ordering = ('-distance_in_feet',)
\ No newline at end of file
+        ordering = ('-distance_in_feet',)
+        indexes = [
+            models.Index(fields=['updated_timestamp', 'id']),
+            # Best competitions of each pilot (nested collections)
+            models.Index(fields=['pilot', 'distance_in_feet']),
+        ]
+
+class Tombstone(models.Model):
+    """
+    Left behind when a synced row is deleted so that
+    sync clients know to drop their copy
+    """
+    model_name = models.CharField(max_length=100)
+    object_pk = models.IntegerField()
+    deleted_timestamp = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ('id',)
+        indexes = [
+            models.Index(fields=['model_name', 'id']),
+        ]
+    
+    def __str__(self):
+        return self.model_name + "-" + str(self.object_pk)
+
+
+class ImportJob(models.Model):
+    """
+    A CSV or NDJSON file of drones or competitions imported
+    in chunks by a background worker
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+                    (PENDING, 'Pending'),
+                    (RUNNING, 'Running'),
+                    (DONE, 'Done'),
+                    (FAILED, 'Failed'),
+                )
+    DRONES = 'drones'
+    COMPETITIONS = 'competitions'
+    KIND_CHOICES = (
+                    (DRONES, 'Drones'),
+                    (COMPETITIONS, 'Competitions'),
+                )
+    CSV = 'csv'
+    NDJSON = 'ndjson'
+    FORMAT_CHOICES = (
+                    (CSV, 'CSV'),
+                    (NDJSON, 'NDJSON'),
+                )
+    owner = models.ForeignKey(to=settings.AUTH_USER_MODEL, related_name='import_jobs', on_delete=models.CASCADE)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    file_format = models.CharField(max_length=10, choices=FORMAT_CHOICES)
+    file_path = models.CharField(max_length=500)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    total_rows = models.IntegerField(null=True, blank=True)
+    # Rows committed so far, a restarted job resumes after them
+    processed_rows = models.IntegerField(default=0)
+    imported_rows = models.IntegerField(default=0)
+    error_count = models.IntegerField(default=0)
+    # JSON list of the first row errors
+    errors = models.TextField(blank=True, default='[]')
+    inserted_timestamp = models.DateTimeField(auto_now_add=True)
+    updated_timestamp = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ('-id',)
+        indexes = [
+            models.Index(fields=['status', 'updated_timestamp']),
+        ]
+    
+    def __str__(self):
+        return self.kind + "-" + str(self.pk)
+
+
+def new_job_token():
+    return secrets.token_hex(16)
+
+
+class DeleteJob(models.Model):
+    """
+    Background deletion of a row and of everything cascading
+    from it, in chunks (drones.fastdelete)
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+                    (PENDING, 'Pending'),
+                    (RUNNING, 'Running'),
+                    (DONE, 'Done'),
+                    (FAILED, 'Failed'),
+                )
+    # Kept when the job deletes its own owner
+    owner = models.ForeignKey(to=settings.AUTH_USER_MODEL, related_name='delete_jobs', null=True, on_delete=models.SET_NULL)
+    # Part of the job's status URL, knowing it grants access to the job
+    token = models.CharField(max_length=32, unique=True, default=new_job_token)
+    # app_label.model_name of the deleted row
+    model_label = models.CharField(max_length=100)
+    object_pk = models.IntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    deleted_rows = models.IntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    inserted_timestamp = models.DateTimeField(auto_now_add=True)
+    updated_timestamp = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ('-id',)
+
+    def __str__(self):
+        return self.model_label + "-" + str(self.object_pk)
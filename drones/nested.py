@@ -0,0 +1,158 @@
+"""
+Bounded nested collections: a representation embeds at most
+NESTED_COLLECTION_LIMIT related rows, next to their total count and
+a link to the list endpoint filtered on the parent
+"""
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.db import connections, models, router
+from django.db.models import Count, F, OuterRef, Subquery, Window
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce, RowNumber
+from rest_framework import serializers
+from rest_framework.relations import ManyRelatedField
+from rest_framework.reverse import reverse
+
+
+def nested_collection_limit():
+    return getattr(settings, 'NESTED_COLLECTION_LIMIT', 10)
+
+
+def ordering_expressions(ordering):
+    return [F(name[1:]).desc() if name.startswith('-') else F(name).asc() for name in ordering]
+
+
+class TopRelatedQuerySet(models.QuerySet):
+    """
+    Rows of a model filtered on their parents the way prefetching
+    does (fk__in=parents), keeping the first limit rows of each parent.
+    The rows are ranked with row_number() over a partition per parent,
+    reading the (fk, ordering) index of each parent once.
+    """
+
+    top_related = None
+
+    def _clone(self):
+        clone = super()._clone()
+        clone.top_related = self.top_related
+        return clone
+
+    def filter(self, *args, **kwargs):
+        if self.top_related is None:
+            return super().filter(*args, **kwargs)
+        fk_name, limit = self.top_related
+        lookup = '{0}__in'.format(fk_name)
+        if args or list(kwargs) != [lookup]:
+            return super().filter(*args, **kwargs)
+        model = self.model
+        ranked = model._default_manager.filter(**kwargs).annotate(row_number=Window(
+            expression=RowNumber(),
+            partition_by=[F(model._meta.get_field(fk_name).attname)],
+            order_by=ordering_expressions(list(model._meta.ordering) + ['pk']),
+            )).order_by().values('pk', 'row_number')
+        sql, params = ranked.query.get_compiler(using=ranked.db).as_sql()
+        quote_name = connections[ranked.db].ops.quote_name
+        first_rows = RawSQL(
+            'SELECT ranked.{0} FROM ({1}) ranked WHERE ranked.{2} <= %s'.format(
+                quote_name(model._meta.pk.column), sql, quote_name('row_number')),
+            tuple(params) + (limit,))
+        queryset = super().filter(**kwargs).filter(pk__in=first_rows)
+        queryset.top_related = None
+        return queryset
+
+
+def top_related(model, fk_name, limit):
+    """
+    Queryset of the first limit rows (in the model's ordering) of
+    every parent, to prefetch. Prefetching it fetches the rows of a
+    whole page of parents in one query instead of one query per parent.
+    """
+    if not connections[router.db_for_read(model)].features.supports_over_clause:
+        ordering = list(model._meta.ordering) + ['pk']
+        window = model._default_manager.filter(
+            **{fk_name: OuterRef(fk_name)}).order_by(*ordering).values('pk')[:limit]
+        return model._default_manager.filter(pk__in=Subquery(window))
+    queryset = TopRelatedQuerySet(model)
+    queryset.top_related = (fk_name, limit)
+    return queryset
+
+
+def related_count(model, relation):
+    """
+    Expression counting the rows of a reverse foreign key
+    without grouping the parent query
+    """
+    remote_field = model._meta.get_field(relation).field
+    counted = remote_field.model._default_manager.filter(
+        **{remote_field.name: OuterRef('pk')}).order_by().values(remote_field.name)
+    return Coalesce(Subquery(counted.annotate(count=Count('pk')).values('count')), 0)
+
+
+class BoundedCollectionMixin:
+    """
+    Serializes at most NESTED_COLLECTION_LIMIT related rows
+    """
+
+    def get_attribute(self, instance):
+        related = super().get_attribute(instance)
+        if isinstance(related, models.Manager):
+            related = related.all()
+        # Prefetched querysets are sliced in memory
+        return related[:nested_collection_limit()]
+
+    def prefetch_queryset(self, model, fk_name):
+        return top_related(model, fk_name, nested_collection_limit())
+
+
+class BoundedListSerializer(BoundedCollectionMixin, serializers.ListSerializer):
+    pass
+
+
+class BoundedManyRelatedField(BoundedCollectionMixin, ManyRelatedField):
+    pass
+
+
+class RelatedCountField(serializers.ReadOnlyField):
+    """
+    Total number of rows of a reverse foreign key. Views planning
+    their queryset annotate it, otherwise it costs a COUNT query.
+    """
+
+    def __init__(self, relation, **kwargs):
+        self.relation = relation
+        kwargs['source'] = '*'
+        super().__init__(**kwargs)
+
+    def annotation(self):
+        return '{0}_total'.format(self.relation)
+
+    def plan_query(self, model, plan):
+        plan.annotations[self.annotation()] = related_count(model, self.relation)
+
+    def to_representation(self, instance):
+        count = getattr(instance, self.annotation(), None)
+        if count is None:
+            count = getattr(instance, self.relation).count()
+        return count
+
+
+class RelatedCollectionField(serializers.ReadOnlyField):
+    """
+    URL of a list endpoint filtered on the serialized instance,
+    ie /competitions/?pilot=1
+    """
+
+    def __init__(self, view_name, lookup, lookup_field='pk', **kwargs):
+        self.view_name = view_name
+        self.lookup = lookup
+        self.lookup_field = lookup_field
+        kwargs['source'] = '*'
+        super().__init__(**kwargs)
+
+    def plan_query(self, model, plan):
+        plan.restrict(model._meta.pk.name if self.lookup_field == 'pk' else self.lookup_field)
+
+    def to_representation(self, instance):
+        url = reverse(self.view_name, request=self.context.get('request'))
+        return '{0}?{1}'.format(url, urlencode({self.lookup: getattr(instance, self.lookup_field)}))
@@ -0,0 +1,48 @@
+"""
+Cache of serialized representations for detail views
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.response import Response
+
+from drones import cacheversions, dbrouter
+
+
+class CachedRepresentationMixin:
+    """
+    Serves GETs of a detail view from a cached representation while
+    none of the rows it was built from has changed. Views list those
+    rows in cache_dependencies(instance) as (model, pk) pairs.
+    Object permissions are only checked when the representation is
+    built, so the view's object permissions must allow every read.
+    Representations read from a replica are not cached: it may lag
+    behind a write whose version bump is already visible.
+    """
+
+    def cache_dependencies(self, instance):
+        return [(type(instance), instance.pk)]
+
+    def representation_key(self):
+        request = self.request
+        # Hyperlinks hold the host, ?fields= and ?omit= change the fields
+        variant = '{0}://{1}?{2}'.format(
+            request.scheme, request.get_host(), '&'.join(sorted(request.GET.urlencode().split('&'))))
+        return 'drones:object:{0}:{1}:{2}'.format(
+            self.name, self.kwargs[self.lookup_url_kwarg or self.lookup_field],
+            hashlib.sha1(variant.encode('utf-8')).hexdigest())
+
+    def retrieve(self, request, *args, **kwargs):
+        key = self.representation_key()
+        entry = cache.get(key)
+        if entry is not None and cacheversions.get_versions(entry['versions']) == entry['versions']:
+            return Response(entry['data'])
+        instance = self.get_object()
+        names = [cacheversions.object_name(model, pk) for model, pk in self.cache_dependencies(instance)]
+        # Read before serializing, a concurrent write bumps them past these
+        versions = cacheversions.get_versions(names)
+        data = self.get_serializer(instance).data
+        if instance._state.db not in dbrouter.get_replica_aliases():
+            cache.set(key, {'data': data, 'versions': versions}, getattr(settings, 'OBJECT_CACHE_TIMEOUT', 600))
+        return Response(data)
@@ -0,0 +1,213 @@
+"""
+Monthly range partitioning of the competition table by
+distance_achievement_date (PostgreSQL 11 or later)
+"""
+import json
+from datetime import datetime
+
+from django.db import transaction
+from django.utils import timezone
+
+from drones.models import Competition
+
+PARENT = Competition._meta.db_table
+PARTITION_KEY = 'distance_achievement_date'
+DEFAULT_PARTITION = PARENT + '_default'
+
+
+class PartitioningError(Exception):
+    pass
+
+
+def check_backend(connection):
+    if connection.vendor != 'postgresql':
+        raise PartitioningError('Competition partitioning requires PostgreSQL.')
+
+
+def month_start(value):
+    return datetime(value.year, value.month, 1, tzinfo=timezone.utc)
+
+
+def add_months(value, months):
+    month = value.month - 1 + months
+    return value.replace(year=value.year + month // 12, month=month % 12 + 1, day=1)
+
+
+def partition_name(start):
+    return '{0}_p{1:04d}_{2:02d}'.format(PARENT, start.year, start.month)
+
+
+def monthly_bounds(first, last):
+    """
+    (name, from, to) for every month from the month of first
+    through the month of last
+    """
+    bounds = []
+    start = month_start(first)
+    while start <= last:
+        end = add_months(start, 1)
+        bounds.append((partition_name(start), start, end))
+        start = end
+    return bounds
+
+
+def is_partitioned(connection):
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT relkind FROM pg_class WHERE relname = %s', [PARENT])
+        row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def list_partitions(connection):
+    """
+    (name, bound expression) of the attached partitions
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT child.relname, pg_get_expr(child.relpartbound, child.oid) '
+            'FROM pg_inherits '
+            'JOIN pg_class parent ON parent.oid = pg_inherits.inhparent '
+            'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+            'WHERE parent.relname = %s ORDER BY child.relname',
+            [PARENT])
+        return cursor.fetchall()
+
+
+def create_partition(cursor, name, start, end):
+    """
+    Create and attach the partition for [start, end), moving the
+    rows the default partition already holds for that range
+    """
+    qn = cursor.db.ops.quote_name
+    cursor.execute('CREATE TABLE {0} (LIKE {1} INCLUDING DEFAULTS)'.format(qn(name), qn(PARENT)))
+    cursor.execute(
+        'WITH moved AS (DELETE FROM {0} WHERE {2} >= %s AND {2} < %s RETURNING *) '
+        'INSERT INTO {1} SELECT * FROM moved'.format(qn(DEFAULT_PARTITION), qn(name), qn(PARTITION_KEY)),
+        [start, end])
+    cursor.execute(
+        'ALTER TABLE {0} ATTACH PARTITION {1} FOR VALUES FROM (%s) TO (%s)'.format(qn(PARENT), qn(name)),
+        [start, end])
+
+
+def ensure_future_partitions(connection, months_ahead=3):
+    """
+    Create the missing partitions from the current month through
+    months_ahead months from now, returning their names. Meant to run
+    periodically; rows falling past the last partition land in the
+    default partition until then.
+    """
+    check_backend(connection)
+    existing = set(name for name, bound in list_partitions(connection))
+    now = timezone.now()
+    created = []
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        for name, start, end in monthly_bounds(now, add_months(month_start(now), months_ahead)):
+            if name not in existing:
+                create_partition(cursor, name, start, end)
+                created.append(name)
+    return created
+
+
+def convert_to_partitioned(connection, months_ahead=3):
+    """
+    Replace the plain competition table by a partitioned one holding
+    the same rows, indexes, foreign keys and id sequence. Runs in one
+    transaction and locks the table while rows are copied.
+    """
+    check_backend(connection)
+    if is_partitioned(connection):
+        raise PartitioningError('{0} is already partitioned.'.format(PARENT))
+    qn = connection.ops.quote_name
+    old = PARENT + '_unpartitioned'
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute('LOCK TABLE {0} IN ACCESS EXCLUSIVE MODE'.format(qn(PARENT)))
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [PARENT])
+        sequence = cursor.fetchone()[0]
+        cursor.execute('SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s', [PARENT])
+        indexes = cursor.fetchall()
+        primary_key = PARENT + '_pkey'
+        cursor.execute(
+            'SELECT min({0}), max({0}) FROM {1}'.format(qn(PARTITION_KEY), qn(PARENT)))
+        first, last = cursor.fetchone()
+
+        cursor.execute('ALTER TABLE {0} RENAME TO {1}'.format(qn(PARENT), qn(old)))
+        for index_name, definition in indexes:
+            # Free the names so the partitioned table keeps the ones Django knows
+            cursor.execute('ALTER INDEX {0} RENAME TO {1}'.format(
+                qn(index_name), qn(index_name[:59] + '_old')))
+        cursor.execute(
+            'CREATE TABLE {0} (LIKE {1} INCLUDING DEFAULTS) PARTITION BY RANGE ({2})'.format(
+                qn(PARENT), qn(old), qn(PARTITION_KEY)))
+        # Unique constraints on a partitioned table must include the partition key
+        cursor.execute('ALTER TABLE {0} ADD CONSTRAINT {1} PRIMARY KEY (id, {2})'.format(
+            qn(PARENT), qn(primary_key), qn(PARTITION_KEY)))
+        for column, target in (('pilot_id', 'drones_pilot'), ('drone_id', 'drones_drone')):
+            cursor.execute(
+                'ALTER TABLE {0} ADD FOREIGN KEY ({1}) REFERENCES {2} (id) '
+                'DEFERRABLE INITIALLY DEFERRED'.format(qn(PARENT), qn(column), qn(target)))
+        for index_name, definition in indexes:
+            if index_name == primary_key:
+                continue
+            cursor.execute('CREATE INDEX {0} ON {1} {2}'.format(
+                qn(index_name), qn(PARENT), definition[definition.index(' USING '):]))
+        cursor.execute('CREATE TABLE {0} PARTITION OF {1} DEFAULT'.format(qn(DEFAULT_PARTITION), qn(PARENT)))
+
+        now = timezone.now()
+        last = max(last or now, add_months(month_start(now), months_ahead))
+        for name, start, end in monthly_bounds(first or now, last):
+            create_partition(cursor, name, start, end)
+        cursor.execute('INSERT INTO {0} SELECT * FROM {1}'.format(qn(PARENT), qn(old)))
+        if sequence:
+            cursor.execute('ALTER SEQUENCE {0} OWNED BY {1}.id'.format(sequence, qn(PARENT)))
+        cursor.execute('DROP TABLE {0}'.format(qn(old)))
+
+
+def archive_partitions(connection, before, drop=False):
+    """
+    Detach the monthly partitions ending on or before the given date.
+    Detached partitions stay as standalone tables to be dumped
+    and dropped later unless drop is set.
+    """
+    check_backend(connection)
+    qn = connection.ops.quote_name
+    archived = []
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        for name, bound in list_partitions(connection):
+            if name == DEFAULT_PARTITION:
+                continue
+            start = datetime.strptime(name[-7:], '%Y_%m').replace(tzinfo=timezone.utc)
+            if add_months(start, 1) > before:
+                continue
+            cursor.execute('ALTER TABLE {0} DETACH PARTITION {1}'.format(qn(PARENT), qn(name)))
+            if drop:
+                cursor.execute('DROP TABLE {0}'.format(qn(name)))
+            archived.append(name)
+    return archived
+
+
+def scanned_relations(plan):
+    """
+    Names of the tables a JSON EXPLAIN plan reads
+    """
+    relations = []
+    nodes = [plan[0]['Plan']] if isinstance(plan, list) else [plan['Plan']]
+    while nodes:
+        node = nodes.pop()
+        if 'Relation Name' in node:
+            relations.append(node['Relation Name'])
+        nodes.extend(node.get('Plans', ()))
+    return relations
+
+
+def explain(connection, queryset, analyze=True):
+    """
+    Return (tables scanned, execution time in ms) for a queryset
+    """
+    sql, params = queryset.query.sql_with_params()
+    options = 'ANALYZE, FORMAT JSON' if analyze else 'FORMAT JSON'
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN ({0}) {1}'.format(options, sql), params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return scanned_relations(plan), plan[0].get('Execution Time')
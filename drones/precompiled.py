@@ -0,0 +1,230 @@
+"""
+Compiled SQL reuse. Compiling a query (select list, joins, ordering)
+costs more than running it for cheap lookups such as a drone by pk.
+The first query of each shape is compiled as usual and its SQL kept
+as a template, later queries of the same shape only compile their
+WHERE clause and bind its parameters into the template.
+
+The shape of a query is the view it comes from, its joins, ordering,
+deferred fields, select_related and annotation names. Annotations
+are assumed to be the same for a view, views annotating values from
+the request must not use precompile(). The WHERE clause of a query is
+compared with the template's before binding, any difference compiles
+the query in full again.
+
+With PRECOMPILED_SQL_PREPARE on PostgreSQL the templates also become
+server-side prepared statements (not usable behind a transaction
+pooler, and parameters whose type PostgreSQL cannot infer fail).
+"""
+import hashlib
+import re
+import threading
+
+from django.conf import settings
+from django.db import connections
+from django.db.models.sql.query import Query
+
+# shape key -> Template, bounded because the keys come from query strings
+_templates = {}
+_templates_lock = threading.Lock()
+MAX_TEMPLATES = 256
+MAX_PREPARED_STATEMENTS = 256
+
+PLACEHOLDER = re.compile(r'%%|%s')
+
+
+class WhereParam:
+    """
+    Marks the parameters of the WHERE clause while a template is compiled
+    """
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class Template:
+    __slots__ = ('sql', 'params', 'where_sql', 'where_positions',
+                 'select', 'klass_info', 'annotation_col_map', 'col_count', 'has_extra_select')
+
+    def __init__(self, compiler, sql, params, where_sql):
+        self.sql = sql
+        self.where_positions = [
+            index for index, param in enumerate(params) if isinstance(param, WhereParam)]
+        self.params = [param.value if isinstance(param, WhereParam) else param for param in params]
+        self.where_sql = where_sql
+        self.select = compiler.select
+        self.klass_info = compiler.klass_info
+        self.annotation_col_map = compiler.annotation_col_map
+        self.col_count = compiler.col_count
+        self.has_extra_select = compiler.has_extra_select
+
+    def bind(self, where_params):
+        params = list(self.params)
+        for position, value in zip(self.where_positions, where_params):
+            params[position] = value
+        return params
+
+
+def enabled():
+    return getattr(settings, 'PRECOMPILED_SQL', True)
+
+
+def shape_key(query, using):
+    # Unreferenced aliases are left behind by earlier compilations
+    # (select_related joins) and reused as they were
+    joins = tuple(
+        (alias, join.table_name, getattr(join, 'join_type', None))
+        for alias, join in query.alias_map.items() if query.alias_refcount[alias])
+    deferred, defer = query.deferred_loading
+    return repr((
+        query.precompile_name,
+        using,
+        query.model._meta.label,
+        joins,
+        query.order_by,
+        query.extra_order_by,
+        query.default_ordering,
+        query.standard_ordering,
+        query.distinct,
+        query.distinct_fields,
+        query.select_related,
+        tuple(sorted(deferred)),
+        defer,
+        query.default_cols,
+        query.select,
+        tuple(query.annotation_select),
+        tuple(query.extra_select),
+        query.values_select,
+        query.group_by,
+        ))
+
+
+def eligible(query, with_col_aliases):
+    return (
+        enabled()
+        and not with_col_aliases
+        and not query.subquery
+        and not query.combinator
+        and not query.select_for_update
+        and not query.explain_query
+        and not query.where.contains_aggregate)
+
+
+def prepare(connection, sql, params):
+    """
+    EXECUTE statement for the sql of a template, prepared on
+    the connection's current database session if needed
+    """
+    prepared = getattr(connection, '_prepared_statements', None)
+    if prepared is None or prepared[0] is not connection.connection:
+        prepared = connection._prepared_statements = (connection.connection, set())
+    name = 'drones_{0}'.format(hashlib.sha1(sql.encode('utf-8')).hexdigest()[:16])
+    if name not in prepared[1]:
+        counter = iter(range(1, len(params) + 1))
+        statement = PLACEHOLDER.sub(
+            lambda match: '%' if match.group() == '%%' else '${0}'.format(next(counter)), sql)
+        with connection.cursor() as cursor:
+            if len(prepared[1]) >= MAX_PREPARED_STATEMENTS:
+                cursor.execute('DEALLOCATE ALL')
+                prepared[1].clear()
+            cursor.execute('PREPARE {0} AS {1}'.format(name, statement))
+        prepared[1].add(name)
+    if not params:
+        return 'EXECUTE {0}'.format(name)
+    return 'EXECUTE {0} ({1})'.format(name, ', '.join(['%s'] * len(params)))
+
+
+class PrecompilingMixin:
+    """
+    Mixed into the SQLCompiler of the backend by PrecompiledQuery
+    """
+
+    def compile(self, node):
+        sql, params = super().compile(node)
+        if getattr(self, 'recording', False) and node is self.where:
+            params = [WhereParam(param) for param in params]
+        return sql, params
+
+    def as_sql(self, with_limits=True, with_col_aliases=False):
+        query = self.query
+        if not eligible(query, with_col_aliases):
+            return super().as_sql(with_limits, with_col_aliases)
+        key = shape_key(query, self.using)
+        template = _templates.get(key)
+        self.where, self.having = query.where, None
+        where_sql, where_params = self.compile(self.where)
+        if template is None or template.where_sql != where_sql:
+            template = self.record(key, where_sql)
+        else:
+            self.select = template.select
+            self.klass_info = template.klass_info
+            self.annotation_col_map = template.annotation_col_map
+            self.col_count = template.col_count
+            self.has_extra_select = template.has_extra_select
+        sql, params = template.sql, template.bind(where_params)
+        if with_limits and (query.high_mark is not None or query.low_mark):
+            sql = '{0} {1}'.format(sql, self.connection.ops.limit_offset_sql(query.low_mark, query.high_mark))
+        if getattr(settings, 'PRECOMPILED_SQL_PREPARE', False) and self.connection.vendor == 'postgresql':
+            sql = prepare(self.connection, sql, params)
+        return sql, tuple(params)
+
+    def record(self, key, where_sql):
+        self.recording = True
+        try:
+            sql, params = super().as_sql(with_limits=False)
+        finally:
+            self.recording = False
+        template = Template(self, sql, params, where_sql)
+        with _templates_lock:
+            if len(_templates) >= MAX_TEMPLATES:
+                _templates.clear()
+            _templates[key] = template
+        return template
+
+
+_compiler_classes = {}
+
+
+def compiler_class(connection):
+    base = connection.ops.compiler('SQLCompiler')
+    cls = _compiler_classes.get(base)
+    if cls is None:
+        cls = _compiler_classes[base] = type(
+            'Precompiling' + base.__name__, (PrecompilingMixin, base), {})
+    return cls
+
+
+class PrecompiledQuery(Query):
+    """
+    Query compiled through precompiled templates, clones keep the class
+    """
+    precompile_name = None
+
+    def get_compiler(self, using=None, connection=None):
+        if self.compiler != 'SQLCompiler':
+            return super().get_compiler(using, connection)
+        if using is None and connection is None:
+            raise ValueError("Need either using or connection")
+        if using:
+            connection = connections[using]
+        return compiler_class(connection)(self, connection, using)
+
+
+def precompile(queryset, name):
+    """
+    Clone of queryset whose queries reuse the templates of name
+    """
+    queryset = queryset.all()
+    queryset.query.__class__ = PrecompiledQuery
+    queryset.query.precompile_name = name
+    return queryset
+
+
+class PrecompiledQueryMixin:
+    """
+    Generic view mixin reusing the compiled SQL of its queries
+    """
+
+    def get_queryset(self):
+        return precompile(super().get_queryset(), self.name)
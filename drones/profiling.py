@@ -0,0 +1,192 @@
+"""
+On-demand profiling of single requests. A staff user sending the
+X-Drones-Profile header (or ?profile=1) gets that request run under
+cProfile and tracemalloc. The stats are kept in PROFILE_DIR, the
+newest PROFILE_KEEP of them, with a summary attributing the time to
+the DRF phases of the request, and are served to staff by the
+profile-list and profile-detail views. tracemalloc traces the whole
+process: the peak memory and allocation sites of a profile include
+those of the requests other threads served meanwhile, as its
+memory_scope says.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+import uuid
+
+from django.conf import settings
+from django.db.backends.utils import CursorWrapper
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.generics import GenericAPIView
+from rest_framework.pagination import BasePagination
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.serializers import BaseSerializer
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
+
+# Functions whose cumulative time makes each phase, none calls another
+PHASES = (
+    ('auth', (APIView.perform_authentication,)),
+    ('permissions', (APIView.check_permissions, APIView.check_object_permissions)),
+    ('throttle', (APIView.check_throttles,)),
+    ('filter', (GenericAPIView.filter_queryset,)),
+    ('paginate', (GenericAPIView.paginate_queryset, BasePagination.get_paginated_response)),
+    ('validate', (BaseSerializer.is_valid,)),
+    ('save', (BaseSerializer.save,)),
+    ('serialize', (BaseSerializer.data.fget,)),
+    ('render', (Response.rendered_content.fget,)),
+    )
+# Time in the database, whatever the phase
+SQL_FUNCTIONS = (CursorWrapper._execute, CursorWrapper._executemany)
+
+# tracemalloc is process wide, one request is profiled at a time
+_profile_lock = threading.Lock()
+
+
+def profile_dir():
+    return getattr(settings, 'PROFILE_DIR', os.path.join(settings.BASE_DIR, 'profiles'))
+
+
+def profile_path(profile_id, extension):
+    return os.path.join(profile_dir(), '{0}.{1}'.format(profile_id, extension))
+
+
+def is_valid_id(profile_id):
+    return len(profile_id) == 32 and all(char in '0123456789abcdef' for char in profile_id)
+
+
+def is_staff(request):
+    """
+    Whether the session user or the credentials of the request
+    belong to a staff user, authenticated as the API would
+    """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user.is_staff
+    drf_request = Request(request)
+    for authentication_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        if issubclass(authentication_class, SessionAuthentication):
+            continue
+        try:
+            result = authentication_class().authenticate(drf_request)
+        except Exception:
+            return False
+        if result is not None:
+            return result[0].is_staff
+    return False
+
+
+def function_key(function):
+    code = function.__code__
+    return (code.co_filename, code.co_firstlineno, code.co_name)
+
+
+def cumulative_ms(stats, functions):
+    total = 0.0
+    for function in functions:
+        entry = stats.stats.get(function_key(function))
+        if entry is not None:
+            total += entry[3]
+    return round(total * 1000, 3)
+
+
+def summarize(stats, snapshot, peak, request, response, wall):
+    phases = dict((name, cumulative_ms(stats, functions)) for name, functions in PHASES)
+    listing = io.StringIO()
+    stats.stream = listing
+    stats.sort_stats('cumulative').print_stats(30)
+    allocations = [
+        {
+            'location': '{0}:{1}'.format(stat.traceback[0].filename, stat.traceback[0].lineno),
+            'size': stat.size,
+            'count': stat.count,
+        }
+        for stat in snapshot.statistics('lineno')[:getattr(settings, 'PROFILE_TOP_ALLOCATIONS', 25)]]
+    return {
+        'method': request.method,
+        'path': request.get_full_path(),
+        'status': response.status_code,
+        'time': time.time(),
+        'wall_ms': round(wall * 1000, 3),
+        'phases_ms': phases,
+        'sql_ms': cumulative_ms(stats, SQL_FUNCTIONS),
+        # tracemalloc cannot tell the threads apart
+        'memory_scope': 'process',
+        'peak_memory': peak,
+        'allocations': allocations,
+        'functions': listing.getvalue(),
+    }
+
+
+def save(stats, summary):
+    """
+    Store a profile, drop the oldest past PROFILE_KEEP, return its id
+    """
+    directory = profile_dir()
+    os.makedirs(directory, exist_ok=True)
+    profile_id = uuid.uuid4().hex
+    stats.dump_stats(profile_path(profile_id, 'prof'))
+    with open(profile_path(profile_id, 'json'), 'w', encoding='utf-8') as summary_file:
+        json.dump(summary, summary_file)
+    for stale in list_profiles()[getattr(settings, 'PROFILE_KEEP', 50):]:
+        for extension in ('json', 'prof'):
+            try:
+                os.remove(profile_path(stale, extension))
+            except FileNotFoundError:
+                pass
+    return profile_id
+
+
+def list_profiles():
+    """
+    Ids of the stored profiles, newest first
+    """
+    directory = profile_dir()
+    if not os.path.isdir(directory):
+        return []
+    names = [name for name in os.listdir(directory) if name.endswith('.json')]
+    names.sort(key=lambda name: os.path.getmtime(os.path.join(directory, name)), reverse=True)
+    return [name[:-len('.json')] for name in names]
+
+
+def load_summary(profile_id):
+    with open(profile_path(profile_id, 'json'), encoding='utf-8') as summary_file:
+        return json.load(summary_file)
+
+
+def run_profiled(request, get_response):
+    """
+    Return the response and the id of its stored profile, None as the
+    id when another request is being profiled
+    """
+    if not _profile_lock.acquire(blocking=False):
+        return get_response(request), None
+    try:
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(getattr(settings, 'PROFILE_TRACEMALLOC_FRAMES', 1))
+        elif hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            # Rendered by the handler, render time included
+            response = get_response(request)
+        finally:
+            profiler.disable()
+            wall = time.perf_counter() - started
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            if started_tracing:
+                tracemalloc.stop()
+        stats = pstats.Stats(profiler)
+        return response, save(stats, summarize(stats, snapshot, peak, request, response, wall))
+    finally:
+        _profile_lock.release()
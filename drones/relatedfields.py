@@ -0,0 +1,144 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.utils.encoding import smart_str
+from rest_framework import serializers
+
+from drones.models import DroneCategory,Drone,Pilot
+
+# Slug fields whose slug -> pk maps are cached, drones.signals
+# forgets the entries of saved and deleted rows
+CACHED_SLUG_FIELDS = {
+    DroneCategory: 'name',
+    Pilot: 'name',
+    Drone: 'name',
+    }
+
+
+def slug_key(model, slug_field, value):
+    # Hashed, slugs may hold spaces that memcached keys cannot
+    digest = hashlib.sha1(value.encode('utf-8')).hexdigest()
+    return 'drones:slug:{0}:{1}:{2}'.format(model._meta.db_table, slug_field, digest)
+
+
+def slug_pk_key(model, slug_field, pk):
+    # Reverse entry, so a renamed row can forget its old slug
+    return 'drones:slug-pk:{0}:{1}:{2}'.format(model._meta.db_table, slug_field, pk)
+
+
+def slug_cache_enabled():
+    """
+    Whether slugs are cached: only when every process sees the entries
+    other processes forget, in a shared cache or through the
+    invalidation bus. Otherwise a row deleted or renamed by another
+    process would leave a dead or wrong pk in this one for hours.
+    """
+    shared = not isinstance(caches['default'], LocMemCache)
+    return shared or getattr(settings, 'INVALIDATION_TRANSPORT', None) is not None
+
+
+def resolve_slugs(model, slug_field, values, queryset=None):
+    """
+    Map the slugs found among values to their pks with at most
+    one query, cached slugs cost no query at all
+    """
+    values = set(value for value in values if isinstance(value, str))
+    if queryset is None:
+        queryset = model._default_manager.all()
+    if CACHED_SLUG_FIELDS.get(model) != slug_field or not slug_cache_enabled():
+        return dict(queryset.filter(**{slug_field + '__in': values}).order_by().values_list(slug_field, 'pk'))
+    keys = dict((slug_key(model, slug_field, value), value) for value in values)
+    resolved = dict((keys[key], pk) for key, pk in cache.get_many(list(keys)).items())
+    missing = values.difference(resolved)
+    if missing:
+        found = dict(queryset.filter(**{slug_field + '__in': missing}).order_by().values_list(slug_field, 'pk'))
+        timeout = getattr(settings, 'SLUG_CACHE_TIMEOUT', 3600)
+        entries = {}
+        for value, pk in found.items():
+            entries[slug_key(model, slug_field, value)] = pk
+            entries[slug_pk_key(model, slug_field, pk)] = value
+        cache.set_many(entries, timeout)
+        resolved.update(found)
+    return resolved
+
+
+def forget_slugs(model, rows):
+    """
+    Drop the cached entries of saved or deleted rows, given as (pk, slug)
+    pairs, now and again on commit in case another request cached the
+    old slugs in between
+    """
+    slug_field = CACHED_SLUG_FIELDS[model]
+    pk_keys = [slug_pk_key(model, slug_field, pk) for pk, value in rows]
+
+    def forget():
+        keys = pk_keys + [slug_key(model, slug_field, value) for pk, value in rows]
+        for previous in cache.get_many(pk_keys).values():
+            keys.append(slug_key(model, slug_field, previous))
+        cache.delete_many(keys)
+
+    forget()
+    transaction.on_commit(forget)
+
+
+def forget_slug_pks(model, pks):
+    """
+    Drop the cached entries of rows known only by their pks, through
+    the reverse entries
+    """
+    slug_field = CACHED_SLUG_FIELDS[model]
+    pk_keys = [slug_pk_key(model, slug_field, pk) for pk in pks]
+    keys = list(pk_keys)
+    for previous in cache.get_many(pk_keys).values():
+        keys.append(slug_key(model, slug_field, previous))
+    cache.delete_many(keys)
+
+
+def forget_slug(instance):
+    model = type(instance)
+    forget_slugs(model, [(instance.pk, getattr(instance, CACHED_SLUG_FIELDS[model]))])
+
+
+class AutocompleteSlugRelatedField(serializers.SlugRelatedField):
+    """
+    Rendered by the browsable API as a text input suggesting at most
+    html_cutoff slugs instead of a <select> of the whole table.
+    With autocomplete_view, the name of a list view searchable on the
+    slug field, the suggestions follow what the user types.
+    """
+
+    def __init__(self, autocomplete_view=None, **kwargs):
+        kwargs.setdefault('html_cutoff', getattr(settings, 'AUTOCOMPLETE_CHOICES', 25))
+        style = kwargs.setdefault('style', {})
+        style.setdefault('template', 'drones/autocomplete.html')
+        style.setdefault('autocomplete_view', autocomplete_view)
+        super().__init__(**kwargs)
+
+    def display_value(self, instance):
+        # str() may follow relations, ie Drone.__str__ reads its owner
+        return self.to_representation(instance)
+
+
+class CachedSlugRelatedField(AutocompleteSlugRelatedField):
+    """
+    Resolves slugs through the slug cache and returns an instance
+    holding only the pk and the slug, enough to be assigned to a
+    foreign key. Meant for querysets covering the whole table.
+    A cached pk may still belong to a row deleted meanwhile, saving
+    it then fails the foreign key (see PilotCompetitionSerializer).
+    """
+
+    def to_internal_value(self, data):
+        queryset = self.get_queryset()
+        model = queryset.model
+        if not isinstance(data, str):
+            self.fail('invalid')
+        pk = resolve_slugs(model, self.slug_field, [data], queryset).get(data)
+        if pk is None:
+            self.fail('does_not_exist', slug_name=self.slug_field, value=smart_str(data))
+        values = {model._meta.pk.attname: pk, self.slug_field: data}
+        names = [field.attname for field in model._meta.concrete_fields if field.attname in values]
+        return model.from_db(queryset.db, names, [values[name] for name in names])
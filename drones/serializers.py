@@ -1,6 +1,13 @@
 from rest_framework import serializers
-from drones.models import DroneCategory,Drone,Pilot,Competition
-import drones.views
+import json
+from collections import Counter
+from functools import partial
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from drones.models import DroneCategory,Drone,Pilot,Competition,ImportJob,DeleteJob
+from drones.relatedfields import CachedSlugRelatedField, forget_slug_pks
+from drones.signals import rows_updated
+from drones.nested import BoundedListSerializer,BoundedManyRelatedField,RelatedCountField,RelatedCollectionField
 from django.contrib.auth.models import User
 
 class UserDroneSerializer(serializers.HyperlinkedModelSerializer):
@@ -13,7 +20,10 @@ class UserDroneSerializer(serializers.HyperlinkedModelSerializer):
 			)
 
 class UserSerializer(serializers.HyperlinkedModelSerializer):
-	drones = UserDroneSerializer(many=True, read_only=True)
+	# The first NESTED_COLLECTION_LIMIT drones, the rest are listed at drones_url
+	drones = BoundedListSerializer(child=UserDroneSerializer(), read_only=True)
+	drones_count = RelatedCountField('drones')
+	drones_url = RelatedCollectionField('drone-list', 'owner')
 	
 	class Meta:
 		model = User
@@ -21,11 +31,17 @@ class UserSerializer(serializers.HyperlinkedModelSerializer):
 			'url',
 			'pk',
 			'username',
-			'drones'
+			'drones',
+			'drones_count',
+			'drones_url'
 			)
 
 class DroneCategorySerializer(serializers.HyperlinkedModelSerializer):
-    drones = serializers.HyperlinkedRelatedField(many=True, read_only=True, view_name='drone-detail')
+    drones = BoundedManyRelatedField(
+        child_relation=serializers.HyperlinkedRelatedField(read_only=True, view_name='drone-detail'),
+        read_only=True)
+    drones_count = RelatedCountField('drones')
+    drones_url = RelatedCollectionField('drone-list', 'drone_category')
     
     class Meta:
         model = DroneCategory
@@ -33,14 +49,82 @@ class DroneCategorySerializer(serializers.HyperlinkedModelSerializer):
             'url',
             'pk',
             'name',
-            'drones'
+            'drones',
+            'drones_count',
+            'drones_url'
             )
 
-class DroneSerializer(serializers.HyperlinkedModelSerializer):
-	# Display the category name
-	drone_category = serializers.SlugRelatedField(queryset=DroneCategory.objects.all(),
-		slug_field='name')
+class CheckedRelationsMixin:
+	"""
+	Saves with the foreign keys of Meta.model checked at once, so that a
+	row of checked_relations (field name, model) resolved from the slug
+	cache but deleted since is reported like the field would
+	"""
+
+	checked_relations = ()
+
+	def save_checked(self, save, validated_data):
+		# The row resolved from the slug cache may have been
+		# deleted since, its foreign key then fails
+		connection = transaction.get_connection()
+		try:
+			if not connection.in_atomic_block:
+				# Committed, and the foreign keys checked, as it is saved
+				return save(validated_data)
+			with transaction.atomic():
+				saved = save(validated_data)
+				# Deferred to the outer commit otherwise
+				connection.check_constraints(table_names=[self.Meta.model._meta.db_table])
+			return saved
+		except IntegrityError as error:
+			raise self.integrity_error(validated_data, error)
+
+	def integrity_error(self, validated_data, error):
+		"""
+		The ValidationError of a related row deleted after it was
+		resolved, error itself for any other integrity error
+		"""
+		errors = {}
+		for name, model in self.checked_relations:
+			related = validated_data.get(name)
+			if related is not None and not model.objects.filter(pk=related.pk).exists():
+				forget_slug_pks(model, [related.pk])
+				field = self.fields[name]
+				errors[name] = [field.error_messages['does_not_exist'].format(
+					slug_name=field.slug_field, value=getattr(related, field.slug_field))]
+		if not errors:
+			return error
+		return serializers.ValidationError(errors)
+
+class UniqueNameMixin(CheckedRelationsMixin):
+	"""
+	Leaves the uniqueness of name to the database constraint rather
+	than a query per write, a violation is reported like the validator would
+	"""
+
+	def integrity_error(self, validated_data, error):
+		model = self.Meta.model
+		name = validated_data.get('name', getattr(self.instance, 'name', None))
+		taken = model._default_manager.filter(name=name)
+		if self.instance is not None:
+			taken = taken.exclude(pk=self.instance.pk)
+		if taken.exists():
+			return serializers.ValidationError(
+				{'name': ['{0} with this name already exists.'.format(model._meta.verbose_name)]})
+		return super().integrity_error(validated_data, error)
+
+	def create(self, validated_data):
+		return self.save_checked(super().create, validated_data)
+
+	def update(self, instance, validated_data):
+		return self.save_checked(partial(super().update, instance), validated_data)
+
+class DroneSerializer(UniqueNameMixin, serializers.HyperlinkedModelSerializer):
+	# Display the category name, resolved through the slug cache
+	drone_category = CachedSlugRelatedField(queryset=DroneCategory.objects.all(),
+		slug_field='name', autocomplete_view='dronecategory-list')
 	owner = serializers.ReadOnlyField(source='owner.username')
+	checked_relations = (('drone_category', DroneCategory),)
     
 	class Meta:
 		model = Drone
@@ -52,6 +136,31 @@ class DroneSerializer(serializers.HyperlinkedModelSerializer):
 			'manufacturing_date',
 			'has_it_competed',
 			'inserted_timestamp')
+		extra_kwargs = {
+			# Checked by UniqueNameMixin
+			'name': {'validators': []},
+			}
+
+class DroneBulkUpdateSerializer(CheckedRelationsMixin, serializers.Serializer):
+	# The fields a bulk PATCH on the drone list may change, names are unique
+	drone_category = CachedSlugRelatedField(queryset=DroneCategory.objects.all(),
+		slug_field='name', required=False)
+	manufacturing_date = serializers.DateTimeField(required=False)
+	has_it_competed = serializers.BooleanField(required=False)
+	checked_relations = (('drone_category', DroneCategory),)
+
+	class Meta:
+		# Whose foreign keys save_checked() checks
+		model = Drone
+
+	def validate(self, attrs):
+		unknown = set(self.initial_data) - set(self.fields)
+		if unknown:
+			raise serializers.ValidationError(
+				'Only {0} can be changed in bulk.'.format(', '.join(self.fields)))
+		if not attrs:
+			raise serializers.ValidationError('No changes given.')
+		return attrs
 
 class CompetitionSerializer(serializers.HyperlinkedModelSerializer):
 	# Display all the details for the related drone
@@ -67,7 +176,10 @@ class CompetitionSerializer(serializers.HyperlinkedModelSerializer):
 			'drone')
 
 class PilotSerializer(serializers.HyperlinkedModelSerializer):
-	competitions = CompetitionSerializer(many=True, read_only=True)
+	# The best NESTED_COLLECTION_LIMIT competitions, all of them at competitions_url
+	competitions = BoundedListSerializer(child=CompetitionSerializer(), read_only=True)
+	competitions_count = RelatedCountField('competitions')
+	competitions_url = RelatedCollectionField('competition-list', 'pilot')
 	gender = serializers.ChoiceField(
 	choices=Pilot.GENDER_CHOICES)
 	gender_description = serializers.CharField(
@@ -83,14 +195,19 @@ class PilotSerializer(serializers.HyperlinkedModelSerializer):
 			'gender_description',
 			'races_count',
 			'inserted_timestamp',
-			'competitions')
+			'competitions',
+			'competitions_count',
+			'competitions_url')
 
 
-class PilotCompetitionSerializer(serializers.ModelSerializer):
+class PilotCompetitionSerializer(CheckedRelationsMixin, serializers.ModelSerializer):
 	# Display the pilot's name
-	pilot = serializers.SlugRelatedField(queryset=Pilot.objects.all(), slug_field='name')
+	# (the pilot list requires a token, no autocomplete from the browsable API)
+	pilot = CachedSlugRelatedField(queryset=Pilot.objects.all(), slug_field='name')
 	# Display the drone's name
-	drone = serializers.SlugRelatedField(queryset=Drone.objects.all(), slug_field='name')
+	drone = CachedSlugRelatedField(queryset=Drone.objects.all(), slug_field='name',
+		autocomplete_view='drone-list')
+	checked_relations = (('pilot', Pilot), ('drone', Drone))
 	
 	class Meta:
 		model = Competition
@@ -102,6 +219,12 @@ class PilotCompetitionSerializer(serializers.ModelSerializer):
 			'pilot',
 			'drone')
 
+	def create(self, validated_data):
+		return self.save_checked(super().create, validated_data)
+
+	def update(self, instance, validated_data):
+		return self.save_checked(partial(super().update, instance), validated_data)
+
 class DroneSerializer2(serializers.ModelSerializer):
 	# Display the category name    
 	class Meta:
@@ -112,4 +235,171 @@ class DroneSerializer2(serializers.ModelSerializer):
 			'drone_category',
 			'manufacturing_date',
 			'has_it_competed',
-			'inserted_timestamp')
\ No newline at end of file
+			'inserted_timestamp')
+
+class DroneBatchListSerializer(serializers.ListSerializer):
+	"""
+	Creates the drones of a batch with batched INSERTs in one
+	transaction, names checked with one query for the whole batch
+	"""
+
+	def validate(self, attrs):
+		names = [item['name'] for item in attrs]
+		repeated = sorted(name for name, count in Counter(names).items() if count > 1)
+		if repeated:
+			raise serializers.ValidationError({'name': ['Repeated in the batch: {0}.'.format(', '.join(repeated))]})
+		taken = sorted(Drone.objects.filter(name__in=names).values_list('name', flat=True))
+		if taken:
+			raise serializers.ValidationError({'name': ['drone with this name already exists: {0}.'.format(', '.join(taken))]})
+		return attrs
+
+	def create(self, validated_data):
+		drones = [Drone(**attrs) for attrs in validated_data]
+		try:
+			with transaction.atomic():
+				Drone.objects.bulk_create(drones, batch_size=getattr(settings, 'DRONE_BATCH_INSERT_SIZE', 500))
+				if drones and drones[0].pk is None:
+					# Backends that cannot return the ids of a bulk insert
+					pks = dict(Drone.objects.filter(name__in=[drone.name for drone in drones]).values_list('name', 'pk'))
+					for drone in drones:
+						drone.pk = pks[drone.name]
+				# bulk_create() sends no post_save
+				rows_updated.send(sender=Drone, pks=[drone.pk for drone in drones])
+		except IntegrityError:
+			# Names taken since validate()
+			raise serializers.ValidationError({'name': ['drone with this name already exists.']})
+		return drones
+
+class DroneBatchSerializer(UniqueNameMixin, DroneSerializer2):
+	# The category and the owner are given by the view
+
+	class Meta(DroneSerializer2.Meta):
+		read_only_fields = ('owner', 'drone_category')
+		extra_kwargs = {
+			# Checked by UniqueNameMixin or DroneBatchListSerializer
+			'name': {'validators': []},
+			}
+		list_serializer_class = DroneBatchListSerializer
+
+# Flat representations used by the sync change feeds,
+# nested collections are synced through their own feed
+
+class DroneCategorySyncSerializer(DroneCategorySerializer):
+
+	class Meta:
+		model = DroneCategory
+		fields = (
+			'url',
+			'pk',
+			'name',
+			'updated_timestamp')
+
+class DroneSyncSerializer(DroneSerializer):
+
+	class Meta:
+		model = Drone
+		fields = (
+			'url',
+			'pk',
+			'owner',
+			'name',
+			'drone_category',
+			'manufacturing_date',
+			'has_it_competed',
+			'inserted_timestamp',
+			'updated_timestamp')
+
+class PilotSyncSerializer(PilotSerializer):
+
+	class Meta:
+		model = Pilot
+		fields = (
+			'url',
+			'pk',
+			'name',
+			'gender',
+			'gender_description',
+			'races_count',
+			'inserted_timestamp',
+			'updated_timestamp')
+
+class CompetitionSyncSerializer(PilotCompetitionSerializer):
+
+	class Meta:
+		model = Competition
+		fields = (
+			'url',
+			'pk',
+			'distance_in_feet',
+			'distance_achievement_date',
+			'pilot',
+			'drone',
+			'updated_timestamp')
+
+
+class ImportJobSerializer(serializers.HyperlinkedModelSerializer):
+	# The uploaded CSV or NDJSON file, stored on disk for the workers
+	file = serializers.FileField(write_only=True)
+	file_format = serializers.ChoiceField(choices=ImportJob.FORMAT_CHOICES, required=False)
+	errors = serializers.SerializerMethodField()
+	progress = serializers.SerializerMethodField()
+
+	class Meta:
+		model = ImportJob
+		fields = (
+			'url',
+			'pk',
+			'kind',
+			'file',
+			'file_format',
+			'status',
+			'total_rows',
+			'processed_rows',
+			'imported_rows',
+			'error_count',
+			'errors',
+			'progress',
+			'inserted_timestamp',
+			'updated_timestamp')
+		read_only_fields = (
+			'status',
+			'total_rows',
+			'processed_rows',
+			'imported_rows',
+			'error_count')
+
+	def get_errors(self, obj):
+		return json.loads(obj.errors or '[]')
+
+	def get_progress(self, obj):
+		# Percentage of the file's rows committed so far
+		if not obj.total_rows:
+			return 100.0 if obj.status == ImportJob.DONE else 0.0
+		return round(100.0 * obj.processed_rows / obj.total_rows, 1)
+
+	def validate(self, data):
+		if 'file_format' not in data:
+			extension = data['file'].name.rsplit('.', 1)[-1].lower()
+			if extension in ('ndjson', 'jsonl'):
+				data['file_format'] = ImportJob.NDJSON
+			elif extension == 'csv':
+				data['file_format'] = ImportJob.CSV
+			else:
+				raise serializers.ValidationError({'file_format': ['Cannot tell the format from the file name.']})
+		return data
+
+class DeleteJobSerializer(serializers.HyperlinkedModelSerializer):
+
+	class Meta:
+		model = DeleteJob
+		fields = (
+			'url',
+			'pk',
+			'model_label',
+			'object_pk',
+			'status',
+			'deleted_rows',
+			'error',
+			'inserted_timestamp',
+			'updated_timestamp')
+		extra_kwargs = {'url': {'lookup_field': 'token'}}
@@ -0,0 +1,151 @@
+from django.contrib.auth.models import User
+from django.core.signals import request_started
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal
+from drones.models import DroneCategory,Drone,Pilot,Competition,Tombstone,ImportJob
+from drones.broadcast import competition_event, get_broadcaster
+from drones import cacheversions, invalidation
+from drones.relatedfields import CACHED_SLUG_FIELDS, forget_slug, forget_slugs
+
+# Models exposed through the sync change feeds
+SYNCED_MODELS = (DroneCategory, Drone, Pilot, Competition)
+
+# Sent by drones.fastdelete for every chunk of rows deleted without
+# post_delete signals, rows holds their values() dicts
+rows_deleted = Signal(providing_args=['rows'])
+# Sent after a set-based update() or a bulk_create(), which send no post_save
+rows_updated = Signal(providing_args=['pks'])
+
+
+def record_tombstone(sender, instance, **kwargs):
+    Tombstone.objects.create(
+        model_name=sender._meta.model_name,
+        object_pk=instance.pk)
+
+
+for model in SYNCED_MODELS:
+    post_delete.connect(record_tombstone, sender=model)
+
+
+def publish_competition(sender, instance, created, **kwargs):
+    broadcaster = get_broadcaster()
+    if not broadcaster.has_subscribers():
+        return
+    event = competition_event(instance, created)
+    transaction.on_commit(lambda: broadcaster.publish(event))
+
+
+post_save.connect(publish_competition, sender=Competition)
+
+
+def bump_table_version(sender, **kwargs):
+    cacheversions.table_changed(sender._meta.db_table)
+
+
+# Users for the cached user and pilot lists (drones/compression.py)
+for model in SYNCED_MODELS + (User,):
+    post_save.connect(bump_table_version, sender=model)
+    post_delete.connect(bump_table_version, sender=model)
+
+
+def forget_cached_slug(sender, instance, **kwargs):
+    forget_slug(instance)
+
+
+for model in CACHED_SLUG_FIELDS:
+    post_save.connect(forget_cached_slug, sender=model)
+    post_delete.connect(forget_cached_slug, sender=model)
+
+
+def bump_object_version(sender, instance, **kwargs):
+    cacheversions.object_changed(sender, instance.pk)
+    if sender is Competition:
+        # Pilots embed their competitions
+        cacheversions.object_changed(Pilot, instance.pilot_id)
+
+
+for model in SYNCED_MODELS + (User,):
+    post_save.connect(bump_object_version, sender=model)
+    post_delete.connect(bump_object_version, sender=model)
+
+
+def forget_deleted_rows(sender, rows, **kwargs):
+    """
+    Everything the post_delete receivers above do, for a chunk of rows
+    """
+    pks = [row[sender._meta.pk.attname] for row in rows]
+    if sender in SYNCED_MODELS:
+        Tombstone.objects.bulk_create([
+            Tombstone(model_name=sender._meta.model_name, object_pk=pk) for pk in pks])
+    cacheversions.table_changed(sender._meta.db_table)
+    cacheversions.objects_changed(sender, pks)
+    if sender is Competition:
+        cacheversions.objects_changed(Pilot, set(row['pilot_id'] for row in rows))
+    if sender in CACHED_SLUG_FIELDS:
+        slug_field = CACHED_SLUG_FIELDS[sender]
+        forget_slugs(sender, [(row[sender._meta.pk.attname], row[slug_field]) for row in rows])
+
+
+rows_deleted.connect(forget_deleted_rows)
+
+
+def forget_updated_rows(sender, pks, **kwargs):
+    """
+    Everything the post_save receivers above do, for rows changed
+    by update() or created by bulk_create()
+    """
+    cacheversions.table_changed(sender._meta.db_table)
+    cacheversions.objects_changed(sender, pks)
+
+
+rows_updated.connect(forget_updated_rows)
+
+
+def publish_invalidation(sender, instance, **kwargs):
+    invalidation.changed(sender, [instance.pk])
+    if sender is Competition:
+        invalidation.changed(Pilot, [instance.pilot_id])
+
+
+for model in SYNCED_MODELS + (User,):
+    post_save.connect(publish_invalidation, sender=model)
+    post_delete.connect(publish_invalidation, sender=model)
+
+
+def publish_deleted_rows(sender, rows, **kwargs):
+    invalidation.changed(sender, [row[sender._meta.pk.attname] for row in rows])
+    if sender is Competition:
+        invalidation.changed(Pilot, set(row['pilot_id'] for row in rows))
+
+
+def publish_updated_rows(sender, pks, **kwargs):
+    invalidation.changed(sender, pks)
+
+
+def remove_uploads(paths):
+    # Not imported by workers until a job is deleted
+    from drones.importjobs import remove_upload
+    for path in paths:
+        remove_upload(path)
+
+
+def remove_deleted_upload(sender, instance, **kwargs):
+    # ie jobs deleted with their owner
+    paths = [instance.file_path]
+    transaction.on_commit(lambda: remove_uploads(paths))
+
+
+post_delete.connect(remove_deleted_upload, sender=ImportJob)
+
+
+def remove_deleted_uploads(sender, rows, **kwargs):
+    paths = [row['file_path'] for row in rows]
+    transaction.on_commit(lambda: remove_uploads(paths))
+
+
+rows_deleted.connect(remove_deleted_uploads, sender=ImportJob)
+rows_deleted.connect(publish_deleted_rows)
+rows_updated.connect(publish_updated_rows)
+# Workers listen to the other processes' changes from their first request
+request_started.connect(invalidation.start_listening)
@@ -0,0 +1,126 @@
+"""
+Single-flight coalescing: concurrent identical requests of a worker
+share one computation, and with SINGLE_FLIGHT_SHARED the workers
+sharing the cache elect one of them through a cache lock
+"""
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.response import Response
+
+from drones import cacheversions, dbrouter
+
+
+class Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.failed = False
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def wait_timeout():
+    return getattr(settings, 'SINGLE_FLIGHT_TIMEOUT', 10)
+
+
+def do(key, compute):
+    """
+    Return compute(), unless a call with the same key is already
+    running in this process: then wait for and return its result.
+    Waiters compute on their own if it fails or takes longer than
+    SINGLE_FLIGHT_TIMEOUT seconds.
+    """
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = Flight()
+    if not leader:
+        if flight.done.wait(wait_timeout()) and not flight.failed:
+            return flight.result
+        return compute()
+    try:
+        flight.result = compute_shared(key, compute)
+        return flight.result
+    except BaseException:
+        flight.failed = True
+        raise
+    finally:
+        with _flights_lock:
+            del _flights[key]
+        flight.done.set()
+
+
+def compute_shared(key, compute):
+    """
+    With SINGLE_FLIGHT_SHARED, one worker computes while the others
+    poll the cache for its result, kept SINGLE_FLIGHT_SHARED_TTL seconds
+    """
+    if not getattr(settings, 'SINGLE_FLIGHT_SHARED', False):
+        return compute()
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    lock_key = 'drones:flight-lock:{0}'.format(digest)
+    result_key = 'drones:flight-result:{0}'.format(digest)
+    result = cache.get(result_key)
+    if result is not None:
+        return result
+    timeout = wait_timeout()
+    if not cache.add(lock_key, 1, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            result = cache.get(result_key)
+            if result is not None:
+                return result
+            if cache.get(lock_key) is None:
+                # The other worker failed
+                break
+        return compute()
+    try:
+        result = compute()
+        cache.set(result_key, result, getattr(settings, 'SINGLE_FLIGHT_SHARED_TTL', 2))
+        return result
+    finally:
+        cache.delete(lock_key)
+
+
+class SingleFlightMixin:
+    """
+    Coalesces concurrent identical list GETs: same path, same query
+    parameters in any order and same flight_context(). Permissions
+    still run for every request. The default context only tells
+    anonymous, authenticated and staff users apart, views whose
+    queryset depends on the user must include it.
+    The key also holds whether the request may read from a replica and
+    the versions of the queryset's table and of flight_models, so a
+    request made after a write never gets a result computed before it.
+    """
+
+    # Models besides the queryset's that the representation reads
+    flight_models = ()
+
+    def flight_context(self):
+        user = self.request.user
+        return (user.is_authenticated, user.is_staff)
+
+    def flight_versions(self):
+        tables = [model._meta.db_table for model in (self.get_queryset().model,) + tuple(self.flight_models)]
+        return sorted(cacheversions.get_versions(tables).items())
+
+    def flight_key(self):
+        request = self.request
+        query = '&'.join(sorted(request.GET.urlencode().split('&')))
+        return '{0}:{1}?{2}:{3}:{4}:{5}:{6}'.format(
+            self.name, request.path, query, request.get_host(), self.flight_context(),
+            'replica' if dbrouter.replica_reads_allowed() else 'primary', self.flight_versions())
+
+    def list(self, request, *args, **kwargs):
+        parent = super()
+        data = do(self.flight_key(), lambda: parent.list(request, *args, **kwargs).data)
+        return Response(data)
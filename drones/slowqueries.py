@@ -0,0 +1,175 @@
+"""
+Sampled slow-query log. With SLOW_QUERY_LOG set, SlowQueryMiddleware
+times the queries of a SLOW_QUERY_SAMPLE_RATE share of the requests
+and appends those taking over SLOW_QUERY_THRESHOLD_MS to the log, one
+JSON object per line, with the view, its filter signature and, for
+SELECTs, their estimated plan (plain EXPLAIN, which does not run the
+query again in the request thread). The
+log rotates at SLOW_QUERY_LOG_MAX_BYTES, keeping SLOW_QUERY_LOG_BACKUPS
+old files. The slowqueries command summarizes it.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+
+from django.conf import settings
+from django.db import DatabaseError
+
+# Row locks: a plan is not worth another trip while holding them
+LOCKING_CLAUSE = re.compile(r'\bFOR\s+(NO\s+KEY\s+)?(UPDATE|SHARE|KEY\s+SHARE)\b', re.IGNORECASE)
+# Query parameters that page through a list rather than filter it
+PAGING_PARAMS = ('limit', 'offset', 'cursor', 'page', 'page_size', 'format')
+# Parameters of queries on these tables are credentials or personal data
+REDACTED_TABLES = ('authtoken_token', 'auth_user', 'django_session')
+
+
+def log_path():
+    return getattr(settings, 'SLOW_QUERY_LOG', None)
+
+
+def threshold_ms():
+    return getattr(settings, 'SLOW_QUERY_THRESHOLD_MS', 200)
+
+
+def sample_rate():
+    return getattr(settings, 'SLOW_QUERY_SAMPLE_RATE', 0.1)
+
+
+def filter_signature(query_params):
+    """
+    The filters, ordering and search of a query string, without their
+    values except for ordering, e.g. "drone_name&ordering=-distance_in_feet&search"
+    """
+    parts = []
+    for name in sorted(set(query_params)):
+        if name in PAGING_PARAMS:
+            continue
+        if name == 'ordering':
+            parts.append('ordering={0}'.format(','.join(query_params.getlist(name))))
+        else:
+            parts.append(name)
+    return '&'.join(parts)
+
+
+class QueryRecorder:
+    """
+    Database execute wrapper keeping the queries slower than the threshold
+    """
+
+    def __init__(self, alias, threshold):
+        self.alias = alias
+        self.threshold = threshold
+        self.slow = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = (time.perf_counter() - started) * 1000
+            if duration >= self.threshold:
+                self.slow.append((sql, params, many, duration))
+
+
+def redact(sql, params):
+    if any(table in sql for table in REDACTED_TABLES):
+        return ['?'] * len(params or ())
+    return params
+
+
+def explain(connection, sql, params):
+    """
+    Estimated plan of a SELECT, without running it: the JSON plan on
+    PostgreSQL, the plan rows as text elsewhere. None for other
+    statements and for SELECT ... FOR UPDATE.
+    """
+    if not sql.lstrip().upper().startswith('SELECT') or LOCKING_CLAUSE.search(sql):
+        return None
+    if connection.vendor == 'postgresql':
+        prefix = 'EXPLAIN (FORMAT JSON) '
+    elif connection.vendor == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    else:
+        prefix = 'EXPLAIN '
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + sql, params)
+            rows = cursor.fetchall()
+    except DatabaseError as error:
+        return {'error': str(error)}
+    if connection.vendor == 'postgresql':
+        plan = rows[0][0]
+        return json.loads(plan) if isinstance(plan, str) else plan
+    return [' '.join(str(column) for column in row) for row in rows]
+
+
+def plan_summary(plan):
+    """
+    One line description of a plan: the scans of a PostgreSQL plan
+    with its estimated cost and rows, the plan rows otherwise
+    """
+    if not plan:
+        return ''
+    if isinstance(plan, dict):
+        return plan.get('error', '')
+    if not isinstance(plan[0], dict):
+        return '; '.join(plan)
+    scans = []
+    nodes = [plan[0]['Plan']]
+    while nodes:
+        node = nodes.pop()
+        if 'Relation Name' in node:
+            scans.append('{0} on {1}'.format(node['Node Type'], node['Relation Name']))
+        nodes.extend(node.get('Plans', ()))
+    root = plan[0]['Plan']
+    return '{0}; cost {1}, rows {2}'.format(
+        ', '.join(scans) or root['Node Type'], root.get('Total Cost', 0), root.get('Plan Rows', 0))
+
+
+_handlers = {}
+_handlers_lock = threading.Lock()
+
+
+def get_handler(path):
+    with _handlers_lock:
+        handler = _handlers.get(path)
+        if handler is None:
+            handler = RotatingFileHandler(
+                path,
+                maxBytes=getattr(settings, 'SLOW_QUERY_LOG_MAX_BYTES', 10 * 1024 * 1024),
+                backupCount=getattr(settings, 'SLOW_QUERY_LOG_BACKUPS', 3),
+                encoding='utf-8',
+                delay=True)
+            _handlers[path] = handler
+    return handler
+
+
+def write_records(records, path=None):
+    handler = get_handler(path or log_path())
+    for record in records:
+        message = json.dumps(record, default=str, sort_keys=True)
+        handler.handle(logging.makeLogRecord({'msg': message}))
+
+
+def read_records(path=None):
+    """
+    The records of the log and of its rotated files, oldest first
+    """
+    path = path or log_path()
+    files = [path]
+    backup = 1
+    while os.path.exists('{0}.{1}'.format(path, backup)):
+        files.insert(0, '{0}.{1}'.format(path, backup))
+        backup += 1
+    for name in files:
+        if not os.path.exists(name):
+            continue
+        with open(name, encoding='utf-8') as log:
+            for line in log:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
@@ -0,0 +1,241 @@
+import re
+from functools import partial
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import permissions, serializers
+from rest_framework.relations import HyperlinkedIdentityField, ManyRelatedField, RelatedField, SlugRelatedField
+
+DISPLAY_METHOD = re.compile(r'^get_(\w+)_display$')
+
+# (serializer class, fields, omit) -> QueryPlan, bounded because the
+# keys come from query strings
+_plans = {}
+MAX_CACHED_PLANS = 256
+
+
+def parse_field_paths(value):
+    """
+    'name,competitions.drone.name' -> {'name': {}, 'competitions': {'drone': {'name': {}}}}
+    """
+    tree = {}
+    for path in value.split(','):
+        node = tree
+        for name in path.strip().split('.'):
+            if name:
+                node = node.setdefault(name, {})
+    return tree
+
+
+def nested_serializer(field):
+    if isinstance(field, serializers.ListSerializer):
+        return field.child
+    if isinstance(field, serializers.BaseSerializer):
+        return field
+    return None
+
+
+def prune_fields(serializer, include=None, exclude=None, param='fields'):
+    """
+    Remove the fields of serializer (and of its nested serializers)
+    not named in the include tree or named as leaves of the exclude tree
+    """
+    fields = serializer.fields
+    for name in list(include or ()) + list(exclude or ()):
+        if name not in fields:
+            raise serializers.ValidationError({param: ['Unknown field "{0}".'.format(name)]})
+    if include:
+        for name in list(fields):
+            if name not in include:
+                fields.pop(name)
+    for name, subtree in (exclude or {}).items():
+        if not subtree:
+            fields.pop(name)
+    for name, field in fields.items():
+        sub_include = include.get(name) if include else None
+        sub_exclude = exclude.get(name) if exclude else None
+        if sub_include or sub_exclude:
+            nested = nested_serializer(field)
+            if nested is None:
+                raise serializers.ValidationError({param: ['"{0}" has no nested fields.'.format(name)]})
+            prune_fields(nested, sub_include, sub_exclude, param)
+
+
+class QueryPlan:
+    """
+    Columns, joins and prefetches a serializer needs from its model.
+    only is None when a field reads something we cannot map to columns.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.only = {model._meta.pk.name}
+        self.select_related = {}
+        self.prefetch_related = {}
+        self.annotations = {}
+
+    def restrict(self, name):
+        if self.only is not None:
+            self.only.add(name)
+
+    def unrestricted(self):
+        self.only = None
+
+    def only_paths(self, prefix=''):
+        if self.only is None:
+            return None
+        paths = [prefix + name for name in self.only]
+        for name, plan in self.select_related.items():
+            related = plan.only_paths(prefix + name + '__')
+            if related is not None:
+                paths.extend(related)
+        return paths
+
+    def select_paths(self, prefix=''):
+        paths = []
+        for name, plan in self.select_related.items():
+            paths.append(prefix + name)
+            paths.extend(plan.select_paths(prefix + name + '__'))
+        return paths
+
+    def prefetches(self, prefix=''):
+        lookups = []
+        for name, (plan, related_queryset) in self.prefetch_related.items():
+            lookups.append(Prefetch(prefix + name, queryset=plan.apply(related_queryset())))
+        for name, plan in self.select_related.items():
+            lookups.extend(plan.prefetches(prefix + name + '__'))
+        return lookups
+
+    def apply(self, queryset):
+        select = self.select_paths()
+        if select:
+            queryset = queryset.select_related(*select)
+        prefetches = self.prefetches()
+        if prefetches:
+            queryset = queryset.prefetch_related(*prefetches)
+        only = self.only_paths()
+        if only is not None:
+            queryset = queryset.only(*only)
+        if self.annotations:
+            queryset = queryset.annotate(**self.annotations)
+        return queryset
+
+
+def plan_serializer(model, serializer, plan=None):
+    plan = plan or QueryPlan(model)
+    for field in serializer.fields.values():
+        if field.write_only:
+            continue
+        if hasattr(field, 'plan_query'):
+            # Fields computed from the instance declare what they read
+            field.plan_query(model, plan)
+        elif isinstance(field, HyperlinkedIdentityField):
+            plan.restrict(field.lookup_field if field.lookup_field != 'pk' else model._meta.pk.name)
+        elif field.source == '*':
+            plan.unrestricted()
+        else:
+            plan_source(model, field.source_attrs, field, plan)
+    return plan
+
+
+def plan_source(model, attrs, field, plan):
+    name = attrs[0]
+    if name == 'pk':
+        name = model._meta.pk.name
+    try:
+        model_field = model._meta.get_field(name)
+    except FieldDoesNotExist:
+        display = DISPLAY_METHOD.match(name)
+        if display is None or len(attrs) > 1:
+            # A property or method, it may read any column
+            plan.unrestricted()
+            return
+        model_field = model._meta.get_field(display.group(1))
+    if not model_field.is_relation:
+        plan.restrict(model_field.name)
+        return
+
+    related_model = model_field.related_model
+    if model_field.many_to_one or (model_field.one_to_one and model_field.concrete):
+        plan.restrict(model_field.name)
+        if len(attrs) == 1 and isinstance(field, RelatedField) and field.use_pk_only_optimization():
+            # The foreign key column is enough
+            return
+        related = plan.select_related.setdefault(model_field.name, QueryPlan(related_model))
+        plan_related(related_model, attrs[1:], field, related)
+        return
+
+    # Reverse foreign keys and many to many: one prefetch query
+    related = QueryPlan(related_model)
+    if not model_field.many_to_many:
+        # Needed to attach the prefetched rows to their parents
+        related.restrict(model_field.field.name)
+    child = field.child_relation if isinstance(field, ManyRelatedField) else field
+    plan_related(related_model, attrs[1:], child, related)
+    if hasattr(field, 'prefetch_queryset') and not model_field.many_to_many:
+        # Bounded collections only fetch their first rows per parent
+        queryset = partial(field.prefetch_queryset, related_model, model_field.field.name)
+    else:
+        queryset = related_model._default_manager.all
+    plan.prefetch_related[model_field.name] = (related, queryset)
+
+
+def plan_related(related_model, attrs, field, plan):
+    if attrs:
+        plan_source(related_model, attrs, field, plan)
+    elif isinstance(field, SlugRelatedField):
+        plan.restrict(field.slug_field)
+    elif nested_serializer(field) is not None:
+        plan_serializer(related_model, nested_serializer(field), plan)
+    elif isinstance(field, RelatedField) and field.use_pk_only_optimization():
+        pass
+    else:
+        # e.g. StringRelatedField, uses __str__
+        plan.unrestricted()
+
+
+class SparseFieldsetsMixin:
+    """
+    Lets clients ask for a subset of the representation:
+    ?fields=name,competitions.drone.name keeps only the listed fields
+    ?omit=competitions drops the listed fields
+    Nested fields are addressed with dots. On reads the queryset only
+    loads the columns, joins and prefetches the remaining fields need.
+    """
+
+    def sparse_fieldsets(self):
+        if self.request is None or self.request.method not in permissions.SAFE_METHODS:
+            return None, None
+        params = self.request.query_params
+        include = parse_field_paths(params['fields']) if params.get('fields') else None
+        exclude = parse_field_paths(params['omit']) if params.get('omit') else None
+        return include, exclude
+
+    def prune_serializer(self, serializer):
+        include, exclude = self.sparse_fieldsets()
+        if include or exclude:
+            target = nested_serializer(serializer)
+            prune_fields(target, include, None, 'fields')
+            prune_fields(target, None, exclude, 'omit')
+        return serializer
+
+    def get_serializer(self, *args, **kwargs):
+        return self.prune_serializer(super().get_serializer(*args, **kwargs))
+
+    def get_query_plan(self, model):
+        params = self.request.query_params
+        key = (self.get_serializer_class(), params.get('fields'), params.get('omit'))
+        plan = _plans.get(key)
+        if plan is None:
+            plan = plan_serializer(model, self.get_serializer())
+            if len(_plans) >= MAX_CACHED_PLANS:
+                _plans.clear()
+            _plans[key] = plan
+        return plan
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request is None or self.request.method not in permissions.SAFE_METHODS:
+            # Deferred columns would be skipped by save()
+            return queryset
+        return self.get_query_plan(queryset.model).apply(queryset)
@@ -0,0 +1,157 @@
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+from django.conf import settings
+
+from drones.broadcast import get_broadcaster
+
+
+def subscription_filters(scope):
+    """
+    Read the same filter names CompetitionFilter uses from the query string
+    """
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    filters = {}
+    for name in ('pilot_name', 'drone_name'):
+        if query.get(name):
+            filters[name] = query[name][0]
+    if query.get('min_distance_in_feet'):
+        filters['min_distance_in_feet'] = int(query['min_distance_in_feet'][0])
+    return filters
+
+
+async def wait_for_disconnect(receive, disconnect_type):
+    while True:
+        message = await receive()
+        if message['type'] == disconnect_type:
+            return
+
+
+async def next_messages(subscription, disconnected, timeout):
+    """
+    Wait for the next event, returning the messages to send (a lagged
+    notice first when events were dropped), [] on heartbeat timeout
+    or None once the client has gone
+    """
+    get = asyncio.ensure_future(subscription.get())
+    done, pending = await asyncio.wait(
+        {get, disconnected},
+        timeout=timeout,
+        return_when=asyncio.FIRST_COMPLETED)
+    if get not in done:
+        get.cancel()
+        return None if disconnected in done else []
+    messages = []
+    dropped = subscription.take_dropped()
+    if dropped:
+        messages.append(('lagged', {'dropped': dropped}))
+    messages.append(('competition', get.result()))
+    return messages
+
+
+class CompetitionStream:
+    """
+    Pushes new and updated competitions to clients, either as
+    server-sent events (GET) or over a WebSocket.
+    ?pilot_name=<name>&drone_name=<name>&min_distance_in_feet=<feet>
+    A 'lagged' event means the client fell behind and missed events,
+    it should catch up through competitions/sync/.
+    """
+
+    path = '/competitions/stream/'
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'websocket':
+            await self.websocket(scope, receive, send)
+        else:
+            await self.server_sent_events(scope, receive, send)
+
+    def heartbeat(self):
+        return getattr(settings, 'COMPETITION_STREAM_HEARTBEAT', 15)
+
+    async def server_sent_events(self, scope, receive, send):
+        if scope['method'] not in ('GET', 'HEAD'):
+            await send({'type': 'http.response.start', 'status': 405, 'headers': [(b'allow', b'GET, HEAD')]})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        try:
+            filters = subscription_filters(scope)
+        except ValueError:
+            await send({'type': 'http.response.start', 'status': 400, 'headers': []})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+                ],
+            })
+        await self.stream(
+            filters,
+            wait_for_disconnect(receive, 'http.disconnect'),
+            lambda event, data: send({
+                'type': 'http.response.body',
+                'body': 'event: {0}\ndata: {1}\n\n'.format(event, json.dumps(data)).encode('utf-8'),
+                'more_body': True,
+                }),
+            lambda: send({'type': 'http.response.body', 'body': b': keep-alive\n\n', 'more_body': True}))
+
+    async def websocket(self, scope, receive, send):
+        message = await receive()
+        if message['type'] != 'websocket.connect':
+            return
+        try:
+            filters = subscription_filters(scope)
+        except ValueError:
+            await send({'type': 'websocket.close', 'code': 1008})
+            return
+        await send({'type': 'websocket.accept'})
+        await self.stream(
+            filters,
+            wait_for_disconnect(receive, 'websocket.disconnect'),
+            lambda event, data: send({
+                'type': 'websocket.send',
+                'text': json.dumps({'event': event, 'data': data}),
+                }),
+            None)
+
+    async def stream(self, filters, disconnect, send_event, send_heartbeat):
+        broadcaster = get_broadcaster()
+        subscription = broadcaster.subscribe(**filters)
+        disconnected = asyncio.ensure_future(disconnect)
+        try:
+            while True:
+                messages = await next_messages(subscription, disconnected, self.heartbeat())
+                if messages is None:
+                    break
+                if not messages and send_heartbeat is not None:
+                    await send_heartbeat()
+                for event, data in messages:
+                    await send_event(event, data)
+        finally:
+            broadcaster.unsubscribe(subscription)
+            disconnected.cancel()
+
+
+def with_live_results(application):
+    """
+    Wrap the Django ASGI application, serving the competition
+    stream path ourselves and everything else through Django
+    """
+    stream = CompetitionStream()
+
+    async def app(scope, receive, send):
+        if scope['type'] in ('http', 'websocket') and scope['path'] == stream.path:
+            await stream(scope, receive, send)
+        elif scope['type'] == 'websocket':
+            # Django only speaks HTTP
+            await receive()
+            await send({'type': 'websocket.close'})
+        else:
+            await application(scope, receive, send)
+
+    return app
@@ -0,0 +1,157 @@
+import base64
+import binascii
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Max, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import serializers, status
+from rest_framework.exceptions import APIException
+
+from drones import dbrouter
+from drones.models import Tombstone
+
+# Position of a client in a change feed: the last (updated_timestamp, pk)
+# it has seen, the last tombstone id it has seen and the commit horizon
+# up to which it has seen every tombstone (None in the cursors issued
+# before it was recorded)
+SyncCursor = namedtuple('SyncCursor', ('updated', 'pk', 'tombstone_id', 'issued'))
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+class CursorExpired(APIException):
+    status_code = status.HTTP_410_GONE
+    default_detail = 'The deletions after this sync cursor were pruned, start over with an initial sync.'
+    default_code = 'sync_cursor_expired'
+
+
+def encode_cursor(cursor):
+    raw = '{0}|{1}|{2}'.format(cursor.updated.isoformat(), cursor.pk, cursor.tombstone_id)
+    if cursor.issued is not None:
+        raw += '|' + cursor.issued.isoformat()
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(value):
+    try:
+        padded = value + '=' * (-len(value) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8')
+        parts = raw.split('|')
+        if len(parts) == 3:
+            parts.append(None)
+        updated, pk, tombstone_id, issued = parts
+        updated = parse_datetime(updated)
+        if issued is not None:
+            issued = parse_datetime(issued)
+            if issued is None:
+                raise ValueError(raw)
+        if updated is None:
+            raise ValueError(raw)
+        return SyncCursor(updated, int(pk), int(tombstone_id), issued)
+    except (ValueError, UnicodeError, binascii.Error):
+        raise serializers.ValidationError({'since': ['Invalid sync cursor.']})
+
+
+def tombstone_retention():
+    return timedelta(days=getattr(settings, 'SYNC_TOMBSTONE_RETENTION_DAYS', 30))
+
+
+def oldest_transaction_start(using=DEFAULT_DB_ALIAS):
+    """
+    When the oldest transaction open on the database, other than ours,
+    started. None when there is none or the database cannot tell.
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT min(xact_start) FROM pg_stat_activity '
+            'WHERE datname = current_database() AND pid <> pg_backend_pid()')
+        return cursor.fetchone()[0]
+
+
+def commit_horizon(using=DEFAULT_DB_ALIAS):
+    """
+    Time up to which every row and tombstone stamped is committed.
+
+    A row is stamped after its transaction started, so on Postgres no
+    transaction still open can commit a row stamped before the oldest
+    one started, however long it runs (import chunks, cascades). Other
+    databases only get SYNC_COMMIT_LAG_SECONDS, which also covers the
+    clock skew between the application servers and the database.
+    """
+    lag = timedelta(seconds=getattr(settings, 'SYNC_COMMIT_LAG_SECONDS', 1))
+    horizon = timezone.now() - lag
+    oldest = oldest_transaction_start(using)
+    if oldest is not None:
+        horizon = min(horizon, oldest - lag)
+    return horizon
+
+
+def get_changes(queryset, cursor=None, page_size=None):
+    """
+    Return the rows of queryset changed after cursor and the pks
+    of the rows deleted after it, oldest first, as
+    (rows, deleted_pks, next_cursor, has_more).
+
+    Rows stamped after commit_horizon() are held back until the next
+    sync: a transaction still open may commit rows stamped before them,
+    and those would be skipped. Raises CursorExpired when tombstones the
+    client has not seen may have been pruned.
+
+    Reads from the primary, the horizon is only known there.
+    """
+    with dbrouter.reading_from_replica(False):
+        return _get_changes(queryset, cursor, page_size)
+
+
+def _get_changes(queryset, cursor, page_size):
+    if page_size is None:
+        page_size = getattr(settings, 'SYNC_PAGE_SIZE', 500)
+    horizon = commit_horizon()
+    if cursor is not None and cursor.issued is not None and cursor.issued < timezone.now() - tombstone_retention():
+        raise CursorExpired()
+    model_name = queryset.model._meta.model_name
+    tombstones = Tombstone.objects.filter(
+        model_name=model_name,
+        deleted_timestamp__lte=horizon)
+
+    if cursor is None:
+        # Initial sync: the client has nothing to delete yet, so
+        # start its tombstone position at the latest one
+        last_tombstone = tombstones.aggregate(Max('id'))['id__max'] or 0
+        cursor = SyncCursor(EPOCH, 0, last_tombstone, horizon)
+        changed = queryset
+        deleted = []
+    else:
+        changed = queryset.filter(
+            Q(updated_timestamp__gt=cursor.updated)
+            | Q(updated_timestamp=cursor.updated, pk__gt=cursor.pk))
+        deleted = list(
+            tombstones.filter(id__gt=cursor.tombstone_id)
+            .order_by('id')
+            .values_list('id', 'object_pk')[:page_size + 1])
+
+    rows = list(
+        changed.filter(updated_timestamp__lte=horizon)
+        .order_by('updated_timestamp', 'pk')[:page_size + 1])
+    more_deleted = len(deleted) > page_size
+    has_more = len(rows) > page_size or more_deleted
+    rows = rows[:page_size]
+    deleted = deleted[:page_size]
+
+    next_cursor = cursor
+    if rows:
+        next_cursor = next_cursor._replace(updated=rows[-1].updated_timestamp, pk=rows[-1].pk)
+    if deleted:
+        next_cursor = next_cursor._replace(tombstone_id=deleted[-1][0])
+    if not more_deleted:
+        # Every tombstone up to the horizon is seen, otherwise the
+        # client's position still dates from the previous one
+        next_cursor = next_cursor._replace(issued=horizon)
+    return rows, [object_pk for tombstone_id, object_pk in deleted], next_cursor, has_more
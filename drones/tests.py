@@ -1,9 +1,37 @@
+import asyncio
+import base64
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from unittest import mock
 from django.utils.http import urlencode
 from django.urls import reverse
+from django.core.cache import cache
+from django.db import IntegrityError, OperationalError, connection
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from rest_framework import status
-from rest_framework.test import APITestCase
-from drones import views
-from drones.models import DroneCategory,Pilot
+from rest_framework.test import APITestCase, APITransactionTestCase
+from drones import views, dbrouter
+from drones.middleware import ReplicaRoutingMiddleware, CompressionMiddleware, AdaptiveConcurrencyMiddleware
+from drones.broadcast import LocalBroadcaster, get_broadcaster
+from drones.streaming import with_live_results
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.utils import timezone
+from drones.models import DroneCategory,Drone,Pilot,Competition,ImportJob,DeleteJob,Tombstone
+from drones.importjobs import run_import_job
+from drones.signals import rows_deleted, rows_updated
+from drones import partitions, singleflight, concurrency, fastdelete, slowqueries, precompiled, columnar, warmup
+from drones import cacheversions, counts, invalidation, compression, groupcommit, profiling, relatedfields
 from django.contrib.auth.models import User
 from rest_framework.authtoken.models import Token
 
@@ -267,3 +295,1911 @@ class PilotTests(APITestCase):
         assert response.status_code == status.HTTP_200_OK
         # Make sure we receive only two element in the response
         assert response.data['count'] == 2
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], REPLICA_STICKY_SECONDS=5)
+class ReplicaRoutingTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        dbrouter._replica_health.clear()
+        self.router = dbrouter.PrimaryReplicaRouter()
+        self.factory = RequestFactory()
+
+    def route(self, request):
+        """
+        Run the request through the middleware and return the response
+        together with the alias a read made by the view would use
+        """
+        used = []
+
+        def view(request):
+            used.append(self.router.db_for_read(Drone))
+            return HttpResponse()
+
+        response = ReplicaRoutingMiddleware(view)(request)
+        return response, used[0]
+
+    @mock.patch('drones.dbrouter.check_replica', return_value=True)
+    def test_reads_go_to_replica_and_writes_to_primary(self, check_replica):
+        """
+        Ensure safe requests read from the replica, unsafe requests
+        read from the primary and all writes go to the primary
+        """
+        response, alias = self.route(self.factory.get('/drones/'))
+        assert alias == 'replica'
+        response, alias = self.route(self.factory.post('/drones/'))
+        assert alias == 'default'
+        assert self.router.db_for_write(Drone) == 'default'
+        # Outside a request reads stay on the primary
+        assert self.router.db_for_read(Drone) == 'default'
+
+    @mock.patch('drones.dbrouter.check_replica', return_value=True)
+    def test_reads_stick_to_primary_after_write(self, check_replica):
+        """
+        Ensure a client reads its own writes from the primary,
+        by cookie or by credentials
+        """
+        response, alias = self.route(
+            self.factory.post('/drones/', HTTP_AUTHORIZATION='Token abc'))
+        pin_cookie = response.cookies[ReplicaRoutingMiddleware.cookie_name]
+        # Same credentials, no cookie
+        response, alias = self.route(
+            self.factory.get('/drones/', HTTP_AUTHORIZATION='Token abc'))
+        assert alias == 'default'
+        # Same cookie, no credentials
+        request = self.factory.get('/drones/')
+        request.COOKIES[pin_cookie.key] = pin_cookie.value
+        response, alias = self.route(request)
+        assert alias == 'default'
+        # Another client is not pinned
+        response, alias = self.route(
+            self.factory.get('/drones/', HTTP_AUTHORIZATION='Token xyz'))
+        assert alias == 'replica'
+
+    def test_pins_shared_by_the_workers(self):
+        """
+        Ensure the pins of token clients are kept in the shared pin
+        cache and that a per-process one fails the system checks
+        """
+        request = self.factory.post('/drones/', HTTP_AUTHORIZATION='Token abc')
+        self.route(request)
+        key = ReplicaRoutingMiddleware(None).client_key(request)
+        assert dbrouter.get_pin_cache().get(key) == 1
+        assert cache.get(key) is None
+        assert dbrouter.check_pin_cache(None) == []
+        with override_settings(REPLICA_PIN_CACHE='default'):
+            assert [error.id for error in dbrouter.check_pin_cache(None)] == ['drones.E001']
+
+    @mock.patch('drones.dbrouter.check_replica', return_value=False)
+    def test_unhealthy_replica_falls_back_to_primary(self, check_replica):
+        """
+        Ensure reads go to the primary when no replica is healthy
+        and that the health check result is reused
+        """
+        response, alias = self.route(self.factory.get('/drones/'))
+        assert alias == 'default'
+        self.route(self.factory.get('/drones/'))
+        assert check_replica.call_count == 1
+
+    @mock.patch('drones.dbrouter.check_replica', return_value=True)
+    def test_failing_replica_marked_unhealthy(self, check_replica):
+        """
+        Ensure a replica that cannot be reached is skipped by the
+        next reads without waiting for its next health check
+        """
+        def view(request):
+            assert self.router.db_for_read(Drone) == 'replica'
+            raise OperationalError('could not connect to server')
+
+        with self.assertRaises(OperationalError):
+            ReplicaRoutingMiddleware(view)(self.factory.get('/drones/'))
+        response, alias = self.route(self.factory.get('/drones/'))
+        assert alias == 'default'
+        assert check_replica.call_count == 1
+
+
+@override_settings(SYNC_COMMIT_LAG_SECONDS=0)
+class DroneCategorySyncTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+
+    def sync(self, since=None):
+        url = reverse(views.DroneCategorySync.name)
+        if since is not None:
+            url = '{0}?{1}'.format(url, urlencode({'since': since}))
+        response = self.client.get(url, format='json')
+        assert response.status_code == status.HTTP_200_OK
+        return response.data
+
+    def test_sync_returns_only_changes_after_cursor(self):
+        """
+        Ensure a sync returns every row initially and afterwards
+        only the rows updated or deleted since the cursor
+        """
+        hexacopter = DroneCategory.objects.create(name='Hexacopter')
+        octocopter = DroneCategory.objects.create(name='Octocopter')
+        DroneCategory.objects.create(name='Quadcopter')
+        initial = self.sync()
+        assert len(initial['results']) == 3
+        assert initial['deleted'] == []
+        assert not initial['has_more']
+
+        quiet = self.sync(initial['next_since'])
+        assert quiet['results'] == []
+        assert quiet['deleted'] == []
+
+        hexacopter.name = 'Hexacopter X'
+        hexacopter.save()
+        octocopter_pk = octocopter.pk
+        octocopter.delete()
+        changes = self.sync(quiet['next_since'])
+        assert [row['name'] for row in changes['results']] == ['Hexacopter X']
+        assert changes['deleted'] == [octocopter_pk]
+
+        again = self.sync(changes['next_since'])
+        assert again['results'] == []
+        assert again['deleted'] == []
+
+    @override_settings(SYNC_PAGE_SIZE=2)
+    def test_sync_pages_through_changes(self):
+        """
+        Ensure a large change set is returned in pages
+        """
+        for name in ('A', 'B', 'C'):
+            DroneCategory.objects.create(name=name)
+        first = self.sync()
+        assert len(first['results']) == 2
+        assert first['has_more']
+        second = self.sync(first['next_since'])
+        assert len(second['results']) == 1
+        assert not second['has_more']
+        names = [row['name'] for row in first['results'] + second['results']]
+        assert sorted(names) == ['A', 'B', 'C']
+
+    def test_sync_rejects_invalid_cursor(self):
+        """
+        Ensure a malformed cursor is a bad request
+        """
+        url = '{0}?{1}'.format(
+            reverse(views.DroneCategorySync.name),
+            urlencode({'since': 'not-a-cursor'}))
+        response = self.client.get(url, format='json')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    @override_settings(SYNC_COMMIT_LAG_SECONDS=60)
+    @mock.patch('drones.sync.oldest_transaction_start')
+    def test_sync_holds_back_rows_of_open_transactions(self, oldest_transaction_start):
+        """
+        Ensure rows stamped after the oldest open transaction started
+        wait for it to finish, however long it runs
+        """
+        oldest_transaction_start.return_value = None
+        initial = self.sync()
+        DroneCategory.objects.filter(pk__in=[
+            DroneCategory.objects.create(name='Hexacopter').pk]).update(
+                updated_timestamp=timezone.now() - timedelta(minutes=10))
+        oldest_transaction_start.return_value = timezone.now() - timedelta(minutes=30)
+        held = self.sync(initial['next_since'])
+        assert held['results'] == []
+        oldest_transaction_start.return_value = None
+        released = self.sync(held['next_since'])
+        assert [row['name'] for row in released['results']] == ['Hexacopter']
+
+    def test_pruned_tombstones_expire_old_cursors(self):
+        """
+        Ensure prune_tombstones deletes the tombstones past the retention
+        and a cursor older than it is told to start over
+        """
+        initial = self.sync()
+        category = DroneCategory.objects.create(name='Hexacopter')
+        category.delete()
+        Tombstone.objects.update(deleted_timestamp=timezone.now() - timedelta(days=31))
+        recent = DroneCategory.objects.create(name='Octocopter')
+        recent_pk = recent.pk
+        recent.delete()
+        call_command('prune_tombstones', stdout=io.StringIO())
+        assert list(Tombstone.objects.values_list('object_pk', flat=True)) == [recent_pk]
+
+        with mock.patch('drones.sync.timezone.now', return_value=timezone.now() + timedelta(days=31)):
+            response = self.client.get('{0}?{1}'.format(
+                reverse(views.DroneCategorySync.name), urlencode({'since': initial['next_since']})))
+        assert response.status_code == status.HTTP_410_GONE
+        assert self.sync(initial['next_since'])['deleted'] == [recent_pk]
+
+
+class CompetitionStreamTests(APITestCase):
+    def competition_event(self, pilot, distance):
+        return {
+            'pk': 1,
+            'pilot': pilot,
+            'drone': 'WonderDrone',
+            'distance_in_feet': distance,
+            'distance_achievement_date': '2020-04-01T00:00:00+00:00',
+            'created': True,
+            }
+
+    def test_subscription_filters_and_drops_oldest(self):
+        """
+        Ensure subscribers only receive matching events and a slow
+        subscriber keeps the newest events, counting the dropped ones
+        """
+        async def scenario():
+            broadcaster = LocalBroadcaster(max_queued=2)
+            subscription = broadcaster.subscribe(pilot_name='Penelope', min_distance_in_feet=100)
+            broadcaster.publish(self.competition_event('Pitstop', 500))
+            broadcaster.publish(self.competition_event('Penelope', 50))
+            for distance in (100, 200, 300):
+                broadcaster.publish(self.competition_event('Penelope', distance))
+            await asyncio.sleep(0)
+            received = [(await subscription.get())['distance_in_feet'] for i in range(2)]
+            broadcaster.unsubscribe(subscription)
+            assert not broadcaster.has_subscribers()
+            return received, subscription.take_dropped()
+
+        received, dropped = asyncio.run(scenario())
+        assert received == [200, 300]
+        assert dropped == 1
+
+    def test_server_sent_events_stream(self):
+        """
+        Ensure the ASGI application streams matching competitions
+        as server-sent events and unsubscribes on disconnect
+        """
+        async def django_application(scope, receive, send):
+            raise AssertionError('The stream path must not reach Django')
+
+        application = with_live_results(django_application)
+        broadcaster = get_broadcaster()
+        scope = {
+            'type': 'http',
+            'method': 'GET',
+            'path': '/competitions/stream/',
+            'query_string': b'pilot_name=Penelope',
+            }
+
+        async def scenario():
+            sent = []
+            disconnected = asyncio.Event()
+
+            async def receive():
+                await disconnected.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                sent.append(message)
+                if message.get('body', b'').startswith(b'event: competition'):
+                    disconnected.set()
+
+            task = asyncio.ensure_future(application(scope, receive, send))
+            while not broadcaster.has_subscribers():
+                await asyncio.sleep(0)
+            broadcaster.publish(self.competition_event('Pitstop', 800))
+            broadcaster.publish(self.competition_event('Penelope', 900))
+            await asyncio.wait_for(task, 5)
+            return sent
+
+        sent = asyncio.run(scenario())
+        assert sent[0]['status'] == status.HTTP_200_OK
+        assert (b'content-type', b'text/event-stream') in sent[0]['headers']
+        events = [message['body'] for message in sent[1:]]
+        assert len(events) == 1
+        assert b'"pilot": "Penelope"' in events[0]
+        assert not broadcaster.has_subscribers()
+
+
+class ImportJobTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.jobs_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.jobs_dir)
+        self.user = User.objects.create_user('importer', 'importer@example.com', 'P4ssw0rD')
+        self.client.force_authenticate(self.user)
+        category = DroneCategory.objects.create(name='Quadcopter')
+        self.drone = Drone.objects.create(
+            name='WonderDrone',
+            drone_category=category,
+            manufacturing_date=timezone.now(),
+            owner=self.user)
+        self.pilot = Pilot.objects.create(name='Penelope', races_count=1)
+
+    def upload(self, name, content, kind=ImportJob.COMPETITIONS):
+        with self.settings(IMPORT_JOBS_DIR=self.jobs_dir):
+            return self.client.post(
+                reverse(views.ImportJobList.name),
+                {'kind': kind, 'file': SimpleUploadedFile(name, content.encode('utf-8'))},
+                format='multipart')
+
+    def test_import_competitions_csv(self):
+        """
+        Ensure an uploaded CSV is accepted as a job and imported
+        in chunks, reporting the rows that could not be imported
+        """
+        content = (
+            'pilot,drone,distance_in_feet,distance_achievement_date\n'
+            'Penelope,WonderDrone,800,2020-04-01T10:00:00Z\n'
+            'Nobody,WonderDrone,900,2020-04-01T10:00:00Z\n'
+            'Penelope,WonderDrone,950,2020-04-02T10:00:00Z\n')
+        response = self.upload('results.csv', content)
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        assert response.data['status'] == ImportJob.PENDING
+        assert response['Location'] == response.data['url']
+
+        with self.settings(IMPORT_JOB_CHUNK_SIZE=2):
+            run_import_job(response.data['pk'])
+        detail = self.client.get(response.data['url'], format='json')
+        assert detail.data['status'] == ImportJob.DONE
+        assert detail.data['total_rows'] == 3
+        assert detail.data['processed_rows'] == 3
+        assert detail.data['imported_rows'] == 2
+        assert detail.data['progress'] == 100.0
+        assert detail.data['errors'][0]['row'] == 2
+        assert Competition.objects.count() == 2
+
+    def test_import_resumes_after_last_committed_chunk(self):
+        """
+        Ensure an interrupted NDJSON drones import skips the rows
+        already committed
+        """
+        content = (
+            '{"name": "Drone A", "drone_category": "Quadcopter", "manufacturing_date": "2020-01-01T00:00:00Z"}\n'
+            '{"name": "Drone B", "drone_category": "Quadcopter", "manufacturing_date": "2020-01-01T00:00:00Z"}\n'
+            '{"name": "Drone C", "drone_category": "Quadcopter", "manufacturing_date": "2020-01-01T00:00:00Z"}\n')
+        response = self.upload('drones.ndjson', content, kind=ImportJob.DRONES)
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        # Simulate a worker that committed the first row and then died
+        ImportJob.objects.filter(pk=response.data['pk']).update(
+            status=ImportJob.RUNNING,
+            processed_rows=1,
+            updated_timestamp=timezone.now() - timedelta(hours=1))
+        job = run_import_job(response.data['pk'])
+        assert job.status == ImportJob.DONE
+        assert job.imported_rows == 2
+        assert set(Drone.objects.values_list('name', flat=True)) == {'WonderDrone', 'Drone B', 'Drone C'}
+        assert Drone.objects.get(name='Drone C').owner == self.user
+
+    def test_imported_rows_are_published(self):
+        """
+        Ensure imported competitions and drones are announced like
+        other bulk inserts, for the caches of every process
+        """
+        updated = []
+        receiver = lambda sender, pks, **kwargs: updated.append((sender, list(pks)))
+        rows_updated.connect(receiver)
+        self.addCleanup(rows_updated.disconnect, receiver)
+        response = self.upload('results.csv', (
+            'pilot,drone,distance_in_feet,distance_achievement_date\n'
+            'Penelope,WonderDrone,800,2020-04-01T10:00:00Z\n'))
+        run_import_job(response.data['pk'])
+        assert (Pilot, [self.pilot.pk]) in updated
+        assert Competition in [sender for sender, pks in updated]
+        response = self.upload('drones.ndjson', (
+            '{"name": "Drone A", "drone_category": "Quadcopter", "manufacturing_date": "2020-01-01T00:00:00Z"}\n'),
+            kind=ImportJob.DRONES)
+        run_import_job(response.data['pk'])
+        assert (Drone, [Drone.objects.get(name='Drone A').pk]) in updated
+
+    def test_non_object_lines_are_row_errors(self):
+        """
+        Ensure an NDJSON line holding something else than an object
+        fails its own row and the uploaded file is deleted afterwards
+        """
+        content = (
+            '[]\n'
+            '{"name": "Drone A", "drone_category": "Quadcopter", "manufacturing_date": "2020-01-01T00:00:00Z"}\n'
+            '42\n')
+        response = self.upload('drones.ndjson', content, kind=ImportJob.DRONES)
+        job = run_import_job(response.data['pk'])
+        assert job.status == ImportJob.DONE
+        assert job.imported_rows == 1
+        assert [error['row'] for error in json.loads(job.errors)] == [1, 3]
+        assert not os.path.exists(job.file_path)
+
+    def test_import_job_requires_authentication(self):
+        """
+        Ensure anonymous users cannot upload import files
+        """
+        self.client.force_authenticate(None)
+        response = self.upload('results.csv', 'pilot\n')
+        assert response.status_code in (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN)
+
+
+class CompetitionPartitionTests(APITestCase):
+    def test_monthly_bounds(self):
+        """
+        Ensure partitions cover whole months, across a year end
+        """
+        bounds = partitions.monthly_bounds(
+            datetime(2019, 11, 15, tzinfo=timezone.utc),
+            datetime(2020, 1, 2, tzinfo=timezone.utc))
+        assert [name for name, start, end in bounds] == [
+            'drones_competition_p2019_11',
+            'drones_competition_p2019_12',
+            'drones_competition_p2020_01',
+            ]
+        assert bounds[1][1] == datetime(2019, 12, 1, tzinfo=timezone.utc)
+        assert bounds[1][2] == datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+    def test_scanned_relations(self):
+        """
+        Ensure the partitions read by a plan are found in nested nodes
+        """
+        plan = [{'Plan': {'Node Type': 'Append', 'Plans': [
+            {'Node Type': 'Seq Scan', 'Relation Name': 'drones_competition_p2020_03'},
+            {'Node Type': 'Index Scan', 'Relation Name': 'drones_competition_p2020_04'},
+            ]}}]
+        assert sorted(partitions.scanned_relations(plan)) == [
+            'drones_competition_p2020_03',
+            'drones_competition_p2020_04',
+            ]
+
+    def test_partitioning_requires_postgresql(self):
+        """
+        Ensure the command refuses to run on other databases
+        """
+        if connection.vendor == 'postgresql':
+            self.skipTest('Only meaningful on other databases')
+        with self.assertRaises(CommandError):
+            call_command('competition_partitions', 'list')
+
+
+class SparseFieldsetsTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('fields', 'fields@example.com', 'P4ssw0rD')
+        self.client.force_authenticate(self.user)
+        category = DroneCategory.objects.create(name='Quadcopter')
+        self.pilot = Pilot.objects.create(name='Penelope', races_count=1)
+        for number in range(3):
+            drone = Drone.objects.create(
+                name='Drone {0}'.format(number),
+                drone_category=category,
+                manufacturing_date=timezone.now(),
+                owner=self.user)
+            Competition.objects.create(
+                pilot=self.pilot,
+                drone=drone,
+                distance_in_feet=100 * number,
+                distance_achievement_date=timezone.now())
+
+    def get(self, view_name, params, *args):
+        url = '{0}?{1}'.format(reverse(view_name, args=args), urlencode(params))
+        return self.client.get(url, format='json')
+
+    def test_fields_keeps_listed_fields(self):
+        """
+        Ensure ?fields= keeps only the listed fields
+        """
+        response = self.get(views.DroneList.name, {'fields': 'name,drone_category'})
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['results'][0] == {'name': 'Drone 0', 'drone_category': 'Quadcopter'}
+
+    def test_nested_fields_and_omit(self):
+        """
+        Ensure dotted paths select and omit nested fields
+        """
+        response = self.get(
+            views.PilotDetail.name,
+            {'fields': 'name,competitions.drone.name'},
+            self.pilot.pk)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['name'] == 'Penelope'
+        assert response.data['competitions'][0] == {'drone': {'name': 'Drone 2'}}
+
+        response = self.get(views.PilotDetail.name, {'omit': 'competitions,inserted_timestamp'}, self.pilot.pk)
+        assert 'competitions' not in response.data
+        assert 'inserted_timestamp' not in response.data
+        assert response.data['races_count'] == 1
+
+    def test_narrow_request_is_cheaper(self):
+        """
+        Ensure nested collections are prefetched and omitted
+        collections are not queried at all
+        """
+        with self.assertNumQueries(3):
+            # count, pilots, competitions with their drones
+            self.get(views.PilotList.name, {})
+        with self.assertNumQueries(2):
+            self.get(views.PilotList.name, {'omit': 'competitions'})
+
+    def test_unknown_field_is_rejected(self):
+        """
+        Ensure misspelled field names are reported
+        """
+        response = self.get(views.DroneList.name, {'fields': 'nmae'})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert 'fields' in response.data
+
+
+@override_settings(NESTED_COLLECTION_LIMIT=2)
+class NestedCollectionTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('nested', 'nested@example.com', 'P4ssw0rD')
+        self.client.force_authenticate(self.user)
+        self.category = DroneCategory.objects.create(name='Octocopter')
+        drone = Drone.objects.create(
+            name='Skipper',
+            drone_category=self.category,
+            manufacturing_date=timezone.now(),
+            owner=self.user)
+        for name in ('Abigail', 'Brandon'):
+            pilot = Pilot.objects.create(name=name, races_count=3)
+            for distance in (300, 100, 200):
+                Competition.objects.create(
+                    pilot=pilot,
+                    drone=drone,
+                    distance_in_feet=distance,
+                    distance_achievement_date=timezone.now())
+
+    def test_nested_collection_is_capped(self):
+        """
+        Ensure a pilot embeds its best competitions only,
+        with the total count and a link to all of them
+        """
+        pilot = Pilot.objects.get(name='Abigail')
+        response = self.client.get(reverse(views.PilotDetail.name, args=(pilot.pk,)), format='json')
+        assert response.status_code == status.HTTP_200_OK
+        distances = [competition['distance_in_feet'] for competition in response.data['competitions']]
+        assert distances == [300, 200]
+        assert response.data['competitions_count'] == 3
+        assert response.data['competitions_url'].endswith('?pilot={0}'.format(pilot.pk))
+
+        response = self.client.get(response.data['competitions_url'], format='json')
+        assert response.data['count'] == 3
+        assert set(competition['pilot'] for competition in response.data['results']) == {'Abigail'}
+
+    def test_nested_collections_fetched_per_page(self):
+        """
+        Ensure the nested rows of a whole page take one query
+        """
+        with self.assertNumQueries(3):
+            # count, pilots with their competition counts, top competitions
+            response = self.client.get(reverse(views.PilotList.name), format='json')
+        assert [len(pilot['competitions']) for pilot in response.data['results']] == [2, 2]
+
+    def test_nested_rows_ranked_per_parent(self):
+        """
+        Ensure the top rows of every parent come from one ranking
+        query, capped per parent and in the nested ordering
+        """
+        pilot = Pilot.objects.create(name='Cornelia', races_count=1)
+        Competition.objects.create(
+            pilot=pilot,
+            drone=Drone.objects.get(),
+            distance_in_feet=50,
+            distance_achievement_date=timezone.now())
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(views.PilotList.name), format='json')
+        assert len(queries) == 3
+        if connection.features.supports_over_clause:
+            assert 'ROW_NUMBER() OVER' in queries[-1]['sql']
+        assert [
+            [competition['distance_in_feet'] for competition in pilot['competitions']]
+            for pilot in response.data['results']] == [[300, 200], [300, 200], [50]]
+
+    def test_category_links_its_drones(self):
+        """
+        Ensure the drone list linked by a category is filtered on it
+        """
+        response = self.client.get(
+            reverse(views.DroneCategoryDetail.name, args=(self.category.pk,)), format='json')
+        assert response.data['drones_count'] == 1
+        response = self.client.get(response.data['drones_url'], format='json')
+        assert [drone['name'] for drone in response.data['results']] == ['Skipper']
+
+
+class ApproximateCountTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user('counter', 'counter@example.com', 'P4ssw0rD')
+        category = DroneCategory.objects.create(name='Tricopter')
+        self.drone = Drone.objects.create(
+            name='Counter',
+            drone_category=category,
+            manufacturing_date=timezone.now(),
+            owner=user)
+        self.pilot = Pilot.objects.create(name='Cecilia', races_count=2)
+        for distance in (100, 200):
+            self.create_competition(distance)
+
+    def create_competition(self, distance):
+        return Competition.objects.create(
+            pilot=self.pilot,
+            drone=self.drone,
+            distance_in_feet=distance,
+            distance_achievement_date=timezone.now())
+
+    def get_competitions(self, query):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(views.CompetitionList.name) + query, format='json')
+        counted = any('COUNT(' in query['sql'] for query in queries.captured_queries)
+        return response, counted
+
+    def test_exact_count_cached_until_write(self):
+        """
+        Ensure exact counts are cached per filter and
+        invalidated when the counted table changes
+        """
+        response, counted = self.get_competitions('?pilot_name=Cecilia&min_distance_in_feet=50')
+        assert counted
+        assert response.data['count'] == 2
+        assert response.data['count_is_exact']
+
+        response, counted = self.get_competitions('?min_distance_in_feet=50&pilot_name=Cecilia&offset=1')
+        assert not counted
+        assert response.data['count'] == 2
+
+        self.create_competition(300)
+        response, counted = self.get_competitions('?pilot_name=Cecilia&min_distance_in_feet=50')
+        assert counted
+        assert response.data['count'] == 3
+
+    def test_replica_counts_not_cached(self):
+        """
+        Ensure a count that may come from a lagging replica
+        is not cached for the later requests
+        """
+        query = '?pilot_name=Cecilia&min_distance_in_feet=50'
+        with dbrouter.reading_from_replica():
+            response, counted = self.get_competitions(query)
+        assert counted
+        response, counted = self.get_competitions(query)
+        assert counted
+        assert response.data['count'] == 2
+
+    def test_large_lists_return_estimates(self):
+        """
+        Ensure big lists return the planner estimate flagged as inexact
+        """
+        with mock.patch('drones.counts.estimate_count', return_value=250000):
+            response, counted = self.get_competitions('')
+        assert not counted
+        assert response.data['count'] == 250000
+        assert not response.data['count_is_exact']
+        assert len(response.data['results']) == 2
+
+    @mock.patch('drones.counts.plan_estimate', return_value=250000)
+    def test_estimates_cached_per_filter(self, plan_estimate):
+        """
+        Ensure the planner is asked once per filter, without the
+        joins of select_related()
+        """
+        queryset = Competition.objects.select_related('pilot', 'drone')
+        with mock.patch.object(connection, 'vendor', 'postgresql'):
+            for distance in (50, 50, 100):
+                assert counts.estimate_count(queryset.filter(distance_in_feet__gte=distance)) == 250000
+        assert plan_estimate.call_count == 2
+        estimated = plan_estimate.call_args[0][1]
+        assert not estimated.query.select_related
+        assert 'JOIN' not in str(estimated.query)
+
+
+@override_settings(AUTOCOMPLETE_CHOICES=5)
+class BrowsableFormTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('browser', 'browser@example.com', 'P4ssw0rD')
+        self.client.force_authenticate(self.user)
+        category = DroneCategory.objects.create(name='Hexacopter')
+        for number in range(10):
+            Drone.objects.create(
+                name='Browsable {0:02d}'.format(number),
+                drone_category=category,
+                manufacturing_date=timezone.now(),
+                owner=self.user)
+
+    def test_related_choices_are_capped(self):
+        """
+        Ensure the competition form suggests a few drones
+        and the filter form does not list every name
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(views.CompetitionList.name), HTTP_ACCEPT='text/html')
+        assert response.status_code == status.HTTP_200_OK
+        html = response.content.decode()
+        assert '<option value="Browsable 04">' in html
+        assert 'Browsable 05' not in html
+        assert 'data-autocomplete-url="{0}"'.format(reverse(views.DroneList.name)) in html
+        assert not any('DISTINCT' in query['sql'] for query in queries.captured_queries)
+
+
+class SlugCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        # The local-memory cache of the tests only caches slugs with the bus
+        patcher = mock.patch('drones.relatedfields.slug_cache_enabled', return_value=True)
+        self.slug_cache_enabled = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.default_slug_cache_enabled = patcher.temp_original
+        self.user = User.objects.create_user('slugs', 'slugs@example.com', 'P4ssw0rD')
+        self.client.force_authenticate(self.user)
+        category = DroneCategory.objects.create(name='Quadcopter')
+        Drone.objects.create(
+            name='Resolver',
+            drone_category=category,
+            manufacturing_date=timezone.now(),
+            owner=self.user)
+        self.pilot = Pilot.objects.create(name='Dorothy', races_count=1)
+
+    def post_competition(self, pilot_name):
+        data = {
+            'pilot': pilot_name,
+            'drone': 'Resolver',
+            'distance_in_feet': 500,
+            'distance_achievement_date': '2020-01-01T00:00:00Z',
+            }
+        return self.client.post(reverse(views.CompetitionList.name), data, format='json')
+
+    def test_cached_slugs_cost_no_query(self):
+        """
+        Ensure a write with known names only runs its insert
+        """
+        assert self.post_competition('Dorothy').status_code == status.HTTP_201_CREATED
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post_competition('Dorothy')
+        # Besides the savepoint and foreign key check of the test's transaction
+        assert [query['sql'].split()[0] for query in queries if 'drones_' in query['sql']] == [
+            'INSERT', 'PRAGMA'] if connection.vendor == 'sqlite' else ['INSERT']
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.data['pilot'] == 'Dorothy'
+        assert Competition.objects.filter(pilot=self.pilot).count() == 2
+
+    def test_renamed_row_forgets_its_slug(self):
+        """
+        Ensure the cache follows renames
+        """
+        assert self.post_competition('Dorothy').status_code == status.HTTP_201_CREATED
+        self.pilot.name = 'Dot'
+        self.pilot.save()
+        assert self.post_competition('Dorothy').status_code == status.HTTP_400_BAD_REQUEST
+        assert self.post_competition('Dot').status_code == status.HTTP_201_CREATED
+
+    def test_deleted_row_is_a_validation_error(self):
+        """
+        Ensure a cached pk of a row another process deleted is
+        reported as an unknown name and forgotten
+        """
+        assert self.post_competition('Dorothy').status_code == status.HTTP_201_CREATED
+        # Deleted by another process, the name stays cached in this one
+        Competition.objects.all()._raw_delete(connection.alias)
+        Pilot.objects.filter(pk=self.pilot.pk)._raw_delete(connection.alias)
+        response = self.post_competition('Dorothy')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data['pilot'] == ['Object with name=Dorothy does not exist.']
+        with CaptureQueriesContext(connection) as queries:
+            assert self.post_competition('Dorothy').status_code == status.HTTP_400_BAD_REQUEST
+        # The name is looked up again
+        assert [query['sql'].split()[0] for query in queries] == ['SELECT']
+
+    def test_deleted_category_is_a_validation_error(self):
+        """
+        Ensure a drone or a bulk change naming a cached category
+        another process deleted is a 400, not a failed commit
+        """
+        spare = DroneCategory.objects.create(name='Spare')
+        relatedfields.resolve_slugs(DroneCategory, 'name', ['Spare'])
+        DroneCategory.objects.filter(pk=spare.pk)._raw_delete(connection.alias)
+        response = self.client.post(reverse(views.DroneList.name), {
+            'name': 'Orphan', 'drone_category': 'Spare',
+            'manufacturing_date': '2020-01-01T00:00:00Z', 'has_it_competed': False}, format='json')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data['drone_category'] == ['Object with name=Spare does not exist.']
+        assert not Drone.objects.filter(name='Orphan').exists()
+
+        # Forgotten by the 400, cached again by another request meanwhile
+        cache.set(relatedfields.slug_key(DroneCategory, 'name', 'Spare'), spare.pk)
+        response = self.client.patch(reverse(views.DroneList.name), {
+            'ids': [Drone.objects.get().pk], 'changes': {'drone_category': 'Spare'}}, format='json')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data['drone_category'] == ['Object with name=Spare does not exist.']
+        assert Drone.objects.get().drone_category.name == 'Quadcopter'
+
+    def test_local_cache_without_bus_is_skipped(self):
+        """
+        Ensure names are not cached where the other processes
+        could not tell this one about renames and deletes
+        """
+        with override_settings(INVALIDATION_TRANSPORT=None):
+            assert not self.default_slug_cache_enabled()
+        self.slug_cache_enabled.return_value = False
+        assert self.post_competition('Dorothy').status_code == status.HTTP_201_CREATED
+        with CaptureQueriesContext(connection) as queries:
+            self.post_competition('Dorothy')
+        assert sum(query['sql'].startswith('SELECT') for query in queries) == 2
+
+    def test_duplicate_drone_name_is_a_validation_error(self):
+        """
+        Ensure the unique constraint violation is reported as a 400
+        """
+        data = {
+            'name': 'Resolver',
+            'drone_category': 'Quadcopter',
+            'manufacturing_date': '2020-01-01T00:00:00Z',
+            }
+        response = self.client.post(reverse(views.DroneList.name), data, format='json')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data['name'] == ['drone with this name already exists.']
+
+
+class ObjectCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('cached', 'cached@example.com', 'P4ssw0rD')
+        self.category = DroneCategory.objects.create(name='Quadcopter')
+        self.drone = Drone.objects.create(
+            name='Cached',
+            drone_category=self.category,
+            manufacturing_date=timezone.now(),
+            owner=self.user)
+        self.pilot = Pilot.objects.create(name='Edith', races_count=1)
+        self.create_competition(800)
+
+    def create_competition(self, distance):
+        return Competition.objects.create(
+            pilot=self.pilot,
+            drone=self.drone,
+            distance_in_feet=distance,
+            distance_achievement_date=timezone.now())
+
+    def get(self, view_name, pk):
+        return self.client.get(reverse(view_name, args=(pk,)), format='json')
+
+    def test_cached_detail_runs_no_query(self):
+        """
+        Ensure a repeated detail GET is served from the cache
+        and follows changes to the rows it embeds
+        """
+        assert self.get(views.DroneDetail.name, self.drone.pk).data['drone_category'] == 'Quadcopter'
+        with self.assertNumQueries(0):
+            response = self.get(views.DroneDetail.name, self.drone.pk)
+        assert response.data['name'] == 'Cached'
+
+        self.category.name = 'Quad'
+        self.category.save()
+        assert self.get(views.DroneDetail.name, self.drone.pk).data['drone_category'] == 'Quad'
+
+    def test_replica_reads_are_not_cached(self):
+        """
+        Ensure a representation read from a replica is not cached,
+        the replica may not have replayed the latest write yet
+        """
+        with mock.patch('drones.dbrouter.get_replica_aliases', return_value=['default']):
+            self.get(views.DroneDetail.name, self.drone.pk)
+            with CaptureQueriesContext(connection) as queries:
+                self.get(views.DroneDetail.name, self.drone.pk)
+        assert len(queries) > 0
+
+    def test_pilot_follows_its_competitions(self):
+        """
+        Ensure the cached pilot changes with its competitions
+        and with the drones they embed
+        """
+        self.client.force_authenticate(self.user)
+        assert self.get(views.PilotDetail.name, self.pilot.pk).data['competitions_count'] == 1
+        with self.assertNumQueries(0):
+            self.get(views.PilotDetail.name, self.pilot.pk)
+
+        self.create_competition(900)
+        response = self.get(views.PilotDetail.name, self.pilot.pk)
+        assert response.data['competitions_count'] == 2
+
+        self.drone.name = 'Renamed'
+        self.drone.save()
+        response = self.get(views.PilotDetail.name, self.pilot.pk)
+        assert set(competition['drone']['name'] for competition in response.data['competitions']) == {'Renamed'}
+
+
+class SingleFlightTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_concurrent_calls_share_one_computation(self):
+        """
+        Ensure calls with the same key made while one is
+        running wait for its result instead of computing
+        """
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return {'count': len(calls)}
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(singleflight.do('competitions', compute)))
+        leader.start()
+        started.wait(5)
+        followers = [
+            threading.Thread(target=lambda: results.append(singleflight.do('competitions', compute)))
+            for i in range(3)]
+        for follower in followers:
+            follower.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join(5)
+        assert len(calls) == 1
+        assert results == [{'count': 1}] * 4
+        # Finished flights are not reused
+        assert singleflight.do('competitions', compute) == {'count': 2}
+
+    def test_key_ignores_parameter_order(self):
+        """
+        Ensure reordered query parameters coalesce
+        """
+        factory = RequestFactory()
+        keys = []
+        for query in ('?pilot_name=Ann&min_distance_in_feet=10', '?min_distance_in_feet=10&pilot_name=Ann'):
+            view = views.CompetitionList()
+            view.request = views.CompetitionList().initialize_request(factory.get('/competitions/' + query))
+            keys.append(view.flight_key())
+        assert keys[0] == keys[1]
+
+    def test_key_follows_writes_and_replica_reads(self):
+        """
+        Ensure a request made after a write, or routed differently,
+        does not share the result of one made before
+        """
+        def flight_key():
+            view = views.CompetitionList()
+            view.request = view.initialize_request(RequestFactory().get('/competitions/'))
+            return view.flight_key()
+
+        before = flight_key()
+        assert flight_key() == before
+        Pilot.objects.create(name='Flora', races_count=1)
+        after = flight_key()
+        assert after != before
+        with dbrouter.reading_from_replica():
+            assert flight_key() != after
+
+
+class AdaptiveConcurrencyTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_low_priorities_are_shed_first(self):
+        """
+        Ensure each priority class only uses its share of the limit
+        """
+        limiter = concurrency.ConcurrencyLimiter(initial_limit=4, shares={'critical': 1.0, 'browse': 0.5})
+        browsing = [limiter.acquire('drone-list', 'browse') for i in range(3)]
+        assert browsing[2] is None
+        critical = [limiter.acquire('drone-detail', 'critical') for i in range(3)]
+        assert critical[1] is not None
+        assert critical[2] is None
+        for ticket in critical[:2]:
+            limiter.release(ticket)
+        assert limiter.acquire('drone-list', 'browse') is None
+        limiter.release(browsing[0])
+        assert limiter.acquire('drone-list', 'browse') is not None
+
+    def test_limit_follows_latency(self):
+        """
+        Ensure the limit grows while latency is steady
+        and is cut when it degrades
+        """
+        limiter = concurrency.ConcurrencyLimiter(initial_limit=4, min_limit=1)
+        for i in range(20):
+            tickets = [limiter.acquire('drone-list', 'critical') for j in range(3)]
+            for ticket in tickets:
+                ticket.started -= 0.01
+                limiter.release(ticket)
+        grown = limiter.limit
+        assert grown > 4
+        ticket = limiter.acquire('drone-list', 'critical')
+        ticket.started -= 1
+        limiter.release(ticket)
+        assert limiter.limit < grown
+
+    def test_request_priorities(self):
+        """
+        Ensure owner writes to drones rank highest and anonymous browsing lowest
+        """
+        assert concurrency.request_priority(views.DroneDetail.name, 'PATCH', True, lambda: True) == 'critical'
+        assert concurrency.request_priority(views.DroneDetail.name, 'PATCH', True, lambda: False) == 'write'
+        assert concurrency.request_priority(views.DroneList.name, 'POST', True) == 'write'
+        assert concurrency.request_priority(views.DroneList.name, 'GET', True) == 'read'
+        assert concurrency.request_priority(views.DroneList.name, 'GET', False) == 'browse'
+
+    def test_priority_of_authenticated_user(self):
+        """
+        Ensure requests are classified by the user their credentials
+        authenticate, and drone writes are only critical for its owner
+        """
+        owner = User.objects.create_user('owner', 'owner@example.com', 'P4ssw0rD')
+        User.objects.create_user('other', 'other@example.com', 'P4ssw0rD')
+        drone = Drone.objects.create(
+            name='Owned',
+            drone_category=DroneCategory.objects.create(name='Quadcopter'),
+            manufacturing_date=timezone.now(),
+            owner=owner)
+        middleware = AdaptiveConcurrencyMiddleware(lambda request: HttpResponse())
+        factory = RequestFactory()
+
+        def priority(method, view, credentials, **kwargs):
+            headers = {}
+            if credentials is not None:
+                headers['HTTP_AUTHORIZATION'] = 'Basic ' + base64.b64encode(credentials.encode()).decode()
+            request = getattr(factory, method)('/', **headers)
+            return middleware.priority(request, view.as_view(), kwargs)
+
+        assert priority('get', views.DroneList, 'owner:wrong') == 'browse'
+        assert priority('get', views.DroneList, 'owner:P4ssw0rD') == 'read'
+        assert priority('patch', views.DroneDetail, 'owner:P4ssw0rD', pk=drone.pk) == 'critical'
+        assert priority('patch', views.DroneDetail, 'other:P4ssw0rD', pk=drone.pk) == 'write'
+        assert priority('patch', views.DroneDetail, None, pk=drone.pk) == 'browse'
+
+    def test_overload_answers_503(self):
+        """
+        Ensure shed requests get a 503 with Retry-After
+        """
+        limiter = concurrency.ConcurrencyLimiter(initial_limit=2, shares={'browse': 0.5})
+        held = limiter.acquire(views.DroneList.name, 'browse')
+        with mock.patch('drones.concurrency.get_limiter', return_value=limiter):
+            response = self.client.get(reverse(views.DroneList.name))
+            assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+            assert response['Retry-After'] == '1'
+            limiter.release(held)
+            response = self.client.get(reverse(views.DroneList.name))
+            assert response.status_code == status.HTTP_200_OK
+        assert limiter.in_flight == 0
+
+
+@override_settings(FAST_DELETE_CHUNK_SIZE=2)
+class FastDeleteTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('deleter', 'deleter@example.com', 'P4ssw0rD')
+        self.category = DroneCategory.objects.create(name='Hexacopter')
+        self.pilot = Pilot.objects.create(name='Gaston', races_count=2)
+        self.drones = []
+        for number in range(3):
+            drone = Drone.objects.create(
+                name='Doomed {0}'.format(number),
+                drone_category=self.category,
+                manufacturing_date=timezone.now(),
+                owner=self.user)
+            Competition.objects.create(
+                pilot=self.pilot,
+                drone=drone,
+                distance_in_feet=100 + number,
+                distance_achievement_date=timezone.now())
+            self.drones.append(drone)
+
+    def test_delete_category_cascades_in_chunks(self):
+        """
+        Ensure deleting a category deletes its drones and their
+        competitions, leaving tombstones and no stale cached detail
+        """
+        url = reverse(views.DroneDetail.name, args=(self.drones[0].pk,))
+        assert self.client.get(url, format='json').status_code == status.HTTP_200_OK
+        response = self.client.delete(reverse(views.DroneCategoryDetail.name, args=(self.category.pk,)))
+        assert response.status_code == status.HTTP_204_NO_CONTENT
+        assert not DroneCategory.objects.exists()
+        assert not Drone.objects.exists()
+        assert not Competition.objects.exists()
+        assert Tombstone.objects.filter(model_name='drone').count() == 3
+        assert Tombstone.objects.filter(model_name='competition').count() == 3
+        assert self.client.get(url, format='json').status_code == status.HTTP_404_NOT_FOUND
+
+    def test_background_delete(self):
+        """
+        Ensure a background delete answers 202 with a job
+        that reports the deleted rows once it has run
+        """
+        self.client.force_authenticate(self.user)
+        url = reverse(views.PilotDetail.name, args=(self.pilot.pk,))
+        with mock.patch('drones.fastdelete.submit_delete_job') as submit, \
+                mock.patch('django.db.transaction.on_commit', side_effect=lambda function: function()):
+            response = self.client.delete(url + '?background=true')
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        assert response['Location'] == response.data['url']
+        job = DeleteJob.objects.get()
+        submit.assert_called_once_with(job.pk)
+        assert job.status == DeleteJob.PENDING
+        assert Pilot.objects.exists()
+
+        # Only the job's token leads to it
+        assert job.token in response['Location']
+        fastdelete.run_delete_job(job.pk)
+        response = self.client.get(response['Location'], format='json')
+        assert response.data['status'] == DeleteJob.DONE
+        assert response.data['deleted_rows'] == 4
+        assert not Pilot.objects.exists()
+        assert Drone.objects.count() == 3
+        response = self.client.get(reverse(views.DeleteJobDetail.name, args=(str(job.pk),)), format='json')
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_interrupted_delete_job_resumes(self):
+        """
+        Ensure a job records its progress with each chunk and a
+        crashed job resumes where it stopped, counting on
+        """
+        job = DeleteJob.objects.create(model_label='drones.dronecategory', object_pk=self.category.pk)
+        send = rows_deleted.send
+        chunks = []
+
+        def crash_on_second_chunk(**kwargs):
+            chunks.append(1)
+            if len(chunks) == 2:
+                raise RuntimeError('worker died')
+            return send(**kwargs)
+
+        with mock.patch('drones.fastdelete.rows_deleted.send', side_effect=crash_on_second_chunk):
+            with self.assertRaises(RuntimeError):
+                fastdelete.run_delete_job(job.pk)
+        job.refresh_from_db()
+        assert job.status == DeleteJob.RUNNING
+        assert job.deleted_rows == 2
+        # Another worker takes over once the job looks stale
+        assert fastdelete.run_delete_job(job.pk) is None
+        DeleteJob.objects.filter(pk=job.pk).update(updated_timestamp=timezone.now() - timedelta(hours=1))
+        job = fastdelete.run_delete_job(job.pk)
+        assert job.status == DeleteJob.DONE
+        assert job.deleted_rows == 7
+        assert not DroneCategory.objects.exists()
+
+    def test_deleted_user_leaves_no_uploads(self):
+        """
+        Ensure the files of the import jobs of a deleted user are removed
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'upload')
+        open(path, 'w').close()
+        ImportJob.objects.create(
+            owner=self.user, kind=ImportJob.DRONES, file_format=ImportJob.CSV, file_path=path)
+        with mock.patch('django.db.transaction.on_commit', side_effect=lambda function: function()):
+            fastdelete.fast_delete(self.user)
+        assert not ImportJob.objects.exists()
+        assert not os.path.exists(path)
+
+
+class SlowQueryLogTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        log_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, log_dir)
+        self.log = os.path.join(log_dir, 'slow.log')
+        category = DroneCategory.objects.create(name='Quadcopter')
+        drone = Drone.objects.create(
+            name='Slowpoke',
+            drone_category=category,
+            manufacturing_date=timezone.now(),
+            owner=User.objects.create_user('slow', 'slow@example.com', 'P4ssw0rD'))
+        Competition.objects.create(
+            pilot=Pilot.objects.create(name='Tortoise', races_count=1),
+            drone=drone,
+            distance_in_feet=10,
+            distance_achievement_date=timezone.now())
+
+    def test_slow_queries_logged_by_filter_signature(self):
+        """
+        Ensure the queries of a sampled request over the threshold are
+        logged with their view, filter signature and plan, and summarized
+        """
+        query = {'drone_name': 'Slowpoke', 'ordering': '-distance_in_feet', 'limit': 2}
+        with self.settings(SLOW_QUERY_LOG=self.log, SLOW_QUERY_THRESHOLD_MS=0, SLOW_QUERY_SAMPLE_RATE=1):
+            response = self.client.get(
+                reverse(views.CompetitionList.name) + '?' + urlencode(query), format='json')
+        assert response.status_code == status.HTTP_200_OK
+        records = list(slowqueries.read_records(self.log))
+        assert records
+        record = records[-1]
+        assert record['view'] == views.CompetitionList.name
+        assert record['signature'] == 'drone_name&ordering=-distance_in_feet'
+        assert record['plan']
+
+        out = io.StringIO()
+        call_command('slowqueries', log=self.log, stdout=out)
+        assert 'competition-list ?drone_name&ordering=-distance_in_feet' in out.getvalue()
+
+    def test_not_logged_unless_enabled(self):
+        """
+        Ensure nothing is logged without SLOW_QUERY_LOG, whatever
+        the threshold and sample rate
+        """
+        with self.settings(SLOW_QUERY_THRESHOLD_MS=0, SLOW_QUERY_SAMPLE_RATE=1):
+            self.client.get(reverse(views.CompetitionList.name), format='json')
+        assert not os.path.exists(self.log)
+
+    def test_locking_queries_not_explained(self):
+        """
+        Ensure SELECT ... FOR UPDATE is logged without a plan, only
+        other SELECTs are explained
+        """
+        sql, params = Drone.objects.filter(name='Slowpoke').query.sql_with_params()
+        assert slowqueries.explain(connection, sql, params)
+        assert slowqueries.explain(connection, sql + ' FOR UPDATE', params) is None
+        assert slowqueries.explain(connection, sql + ' FOR NO KEY UPDATE', params) is None
+
+
+class PrecompiledSQLTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('compiled', 'compiled@example.com', 'P4ssw0rD')
+        category = DroneCategory.objects.create(name='Quadcopter')
+        self.pilot = Pilot.objects.create(name='Ada', races_count=3)
+        self.drones = []
+        for number, name in enumerate(('Atom', 'Bolt', 'Comet')):
+            drone = Drone.objects.create(
+                name=name,
+                drone_category=category,
+                manufacturing_date=timezone.now(),
+                owner=self.user)
+            Competition.objects.create(
+                pilot=self.pilot,
+                drone=drone,
+                distance_in_feet=100 * (number + 1),
+                distance_achievement_date=timezone.now())
+            self.drones.append(drone)
+
+    def test_sql_matches_orm(self):
+        """
+        Ensure queries bound into a template give the SQL, parameters
+        and rows of the ORM, and that a shape is compiled once
+        """
+        querysets = []
+        for drone in self.drones:
+            querysets.append(Drone.objects.select_related('drone_category', 'owner').filter(pk=drone.pk))
+            querysets.append(
+                Competition.objects.filter(drone__name__icontains=drone.name[:2])
+                .order_by('-distance_in_feet')[1:3])
+        precompiled._templates.clear()
+        for queryset in querysets:
+            compiled = precompiled.precompile(queryset, 'equivalence')
+            assert compiled.query.sql_with_params() == queryset.query.sql_with_params()
+            assert [obj.__dict__.keys() for obj in compiled] == [obj.__dict__.keys() for obj in queryset]
+            assert list(compiled) == list(queryset)
+        assert len(precompiled._templates) == 2
+
+    def test_views_match_orm(self):
+        """
+        Ensure the views answer the same with and without precompiled SQL
+        """
+        urls = [
+            reverse(views.DroneDetail.name, args=(self.drones[1].pk,)),
+            reverse(views.PilotDetail.name, args=(self.pilot.pk,)),
+            reverse(views.CompetitionList.name) + '?' + urlencode({'drone_name': 'Bolt'}),
+            reverse(views.CompetitionList.name) + '?ordering=-distance_in_feet&limit=2&offset=1',
+            reverse(views.DroneList.name) + '?search=o',
+            ]
+        self.client.force_authenticate(self.user)
+        for url in urls:
+            cache.clear()
+            with self.settings(PRECOMPILED_SQL=False):
+                expected = self.client.get(url, format='json').data
+            for repeat in range(2):
+                cache.clear()
+                assert self.client.get(url, format='json').data == expected
+
+
+class ProfilingTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, profile_dir)
+        settings_override = self.settings(PROFILE_DIR=profile_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        User.objects.create_superuser('admin', 'admin@example.com', 'P4ssw0rD')
+        User.objects.create_user('regular', 'regular@example.com', 'P4ssw0rD')
+        DroneCategory.objects.create(name='Quadcopter')
+
+    def test_staff_request_profiled(self):
+        """
+        Ensure a staff request with the header is profiled and
+        its profile attributes time to the DRF phases
+        """
+        self.client.login(username='admin', password='P4ssw0rD')
+        response = self.client.get(reverse(views.DroneCategoryList.name), HTTP_X_DRONES_PROFILE='1')
+        assert response.status_code == status.HTTP_200_OK
+        profile_url = response['X-Drones-Profile']
+
+        summary = self.client.get(profile_url, format='json').data
+        assert summary['path'] == reverse(views.DroneCategoryList.name)
+        assert summary['phases_ms']['serialize'] > 0
+        assert summary['phases_ms']['render'] > 0
+        assert summary['allocations']
+        assert summary['memory_scope'] == 'process'
+        listing = self.client.get(reverse(views.ProfileList.name), format='json').data
+        assert listing[0]['url'] == profile_url
+        download = self.client.get(profile_url + '?download=1')
+        assert download['Content-Disposition'].startswith('attachment')
+
+    def test_other_requests_not_profiled(self):
+        """
+        Ensure the header is ignored for other users and
+        that they cannot read the profiles
+        """
+        self.client.login(username='regular', password='P4ssw0rD')
+        response = self.client.get(reverse(views.DroneCategoryList.name) + '?profile=1')
+        assert 'X-Drones-Profile' not in response
+        response = self.client.get(reverse(views.ProfileList.name), format='json')
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    def test_profile_parameter_parsed(self):
+        """
+        Ensure only a profile parameter asks for a profile,
+        not one merely ending with profile
+        """
+        self.client.login(username='admin', password='P4ssw0rD')
+        url = reverse(views.DroneCategoryList.name)
+        assert 'X-Drones-Profile' not in self.client.get(url + '?myprofile=1')
+        assert 'X-Drones-Profile' not in self.client.get(url + '?profile=0')
+        assert 'X-Drones-Profile' in self.client.get(url + '?name=x&profile=1')
+
+    def test_profile_removed_while_listing(self):
+        """
+        Ensure a profile removed between listing and reading it is skipped
+        """
+        self.client.login(username='admin', password='P4ssw0rD')
+        self.client.get(reverse(views.DroneCategoryList.name), HTTP_X_DRONES_PROFILE='1')
+        with mock.patch('drones.profiling.list_profiles', return_value=['0' * 32] + profiling.list_profiles()):
+            response = self.client.get(reverse(views.ProfileList.name), format='json')
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.data) == 1
+
+
+class CompetitionSnapshotTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        snapshot_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, snapshot_dir)
+        settings_override = self.settings(COMPETITION_SNAPSHOT_DIR=os.path.join(snapshot_dir, 'snapshot'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        owner = User.objects.create_user('analyst', 'analyst@example.com', 'P4ssw0rD')
+        category = DroneCategory.objects.create(name='Quadcopter')
+        self.drone = Drone.objects.create(
+            name='Columbus', drone_category=category, manufacturing_date=timezone.now(), owner=owner)
+        self.pilots = [Pilot.objects.create(name=name, races_count=1) for name in ('Ann', 'Bob')]
+        self.competitions = [
+            self.create_competition(self.pilots[number % 2], distance)
+            for number, distance in enumerate((300, 700, 500, 100))]
+
+    def create_competition(self, pilot, distance):
+        return Competition.objects.create(
+            pilot=pilot,
+            drone=self.drone,
+            distance_in_feet=distance,
+            distance_achievement_date=timezone.now())
+
+    def stats(self, **params):
+        response = self.client.get(reverse(views.CompetitionStats.name) + '?' + urlencode(params), format='json')
+        assert response.status_code == status.HTTP_200_OK
+        return response.data['results']
+
+    def test_stats_from_snapshot(self):
+        """
+        Ensure the group-by and top-k answers of the snapshot
+        match the competitions, without querying them
+        """
+        call_command('competition_snapshot', stdout=io.StringIO())
+        with self.assertNumQueries(0):
+            groups = self.stats(group_by='pilot', aggregate='sum')
+        assert groups == [
+            {'pilot': 'Ann', 'value': 800.0, 'competitions': 2},
+            {'pilot': 'Bob', 'value': 800.0, 'competitions': 2},
+            ]
+        assert self.stats(group_by='pilot', aggregate='max', top=1)[0]['pilot'] == 'Bob'
+        assert [row['distance_in_feet'] for row in self.stats(top=3)] == [700, 500, 300]
+        for top in (0, -5):
+            response = self.client.get(reverse(views.CompetitionStats.name) + '?top={0}'.format(top), format='json')
+            assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_one_export_at_a_time(self):
+        """
+        Ensure an export is refused while another process holds
+        the snapshot's lock
+        """
+        directory = columnar.snapshot_dir()
+        with columnar.export_lock(directory):
+            with self.assertRaises(columnar.SnapshotError):
+                columnar.export()
+        assert not os.path.exists(directory)
+        assert columnar.export()['rows'] == 4
+
+    def test_incremental_refresh(self):
+        """
+        Ensure a refresh picks up created, updated and deleted
+        competitions, renamed pilots and drones moved to another category
+        """
+        call_command('competition_snapshot', stdout=io.StringIO())
+        self.create_competition(self.pilots[0], 900)
+        self.competitions[1].distance_in_feet = 50
+        self.competitions[1].save()
+        self.competitions[2].delete()
+        self.pilots[1].name = 'Robert'
+        self.pilots[1].save()
+        self.drone.drone_category = DroneCategory.objects.create(name='Hexacopter')
+        self.drone.save()
+        call_command('competition_snapshot', stdout=io.StringIO())
+
+        assert columnar.get_snapshot().rows == 5
+        assert [row['distance_in_feet'] for row in self.stats(top=10)] == [900, 300, 100, 50]
+        counts = dict((row['pilot'], row['value']) for row in self.stats(group_by='pilot', aggregate='count'))
+        assert counts == {'Ann': 2.0, 'Robert': 2.0}
+        categories = dict(
+            (row['category'], row['value']) for row in self.stats(group_by='category', aggregate='count'))
+        assert categories == {'Hexacopter': 4.0}
+
+
+class WarmUpTests(APITestCase):
+    def test_warm_up(self):
+        """
+        Ensure the warm-up builds every view's serializer,
+        closes the connections and freezes the heap
+        """
+        assert views.DroneList in warmup.view_classes()
+        with mock.patch('gc.freeze') as freeze, \
+                mock.patch('django.db.connections.close_all') as close_all:
+            warmup.warm_up()
+        assert freeze.called
+        assert close_all.called
+
+
+
+class BulkDroneTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('fleet', 'fleet@example.com', 'P4ssw0rD')
+        self.other = User.objects.create_user('rival', 'rival@example.com', 'P4ssw0rD')
+        self.category = DroneCategory.objects.create(name='Quadcopter')
+        self.other_category = DroneCategory.objects.create(name='Octocopter')
+        self.pilot = Pilot.objects.create(name='Gaston', races_count=2)
+        self.drones = []
+        for number, owner in enumerate((self.user, self.user, self.other)):
+            drone = Drone.objects.create(
+                name='Fleet {0}'.format(number),
+                drone_category=self.category,
+                manufacturing_date=timezone.now(),
+                owner=owner)
+            Competition.objects.create(
+                pilot=self.pilot,
+                drone=drone,
+                distance_in_feet=100 + number,
+                distance_achievement_date=timezone.now())
+            self.drones.append(drone)
+        self.url = reverse(views.DroneList.name)
+
+    def test_bulk_patch_by_ids(self):
+        """
+        Ensure a bulk PATCH only changes the requester's drones and
+        reports every id, bumping updated_timestamp and cached details
+        """
+        detail = reverse(views.DroneDetail.name, args=(self.drones[0].pk,))
+        assert self.client.get(detail, format='json').data['drone_category'] == 'Quadcopter'
+        before = self.drones[0].updated_timestamp
+        self.client.force_authenticate(self.user)
+        ids = [drone.pk for drone in self.drones] + [9999]
+        response = self.client.patch(self.url, {
+            'ids': ids,
+            'changes': {'drone_category': 'Octocopter', 'has_it_competed': True},
+            }, format='json')
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['updated'] == 2
+        assert [result['status'] for result in response.data['results']] == [
+            'updated', 'updated', 'forbidden', 'not_found']
+        assert Drone.objects.filter(drone_category=self.other_category, has_it_competed=True).count() == 2
+        assert Drone.objects.get(pk=self.drones[2].pk).drone_category == self.category
+        assert Drone.objects.get(pk=self.drones[0].pk).updated_timestamp > before
+        assert self.client.get(detail, format='json').data['drone_category'] == 'Octocopter'
+
+        response = self.client.patch(self.url, {'ids': ids, 'changes': {'name': 'Renamed'}}, format='json')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_bulk_delete_by_filter(self):
+        """
+        Ensure a bulk DELETE by filter cascades to the competitions of
+        the requester's drones only and rejects unknown or empty filters
+        """
+        self.client.force_authenticate(self.user)
+        for conditions in ({'name': ''}, {'name': '', 'owner': None}):
+            response = self.client.delete(self.url, {'filter': conditions}, format='json')
+            assert response.status_code == status.HTTP_400_BAD_REQUEST
+        response = self.client.patch(self.url, {
+            'filter': {'name': ''}, 'changes': {'has_it_competed': True}}, format='json')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert Drone.objects.count() == 3
+        assert not Drone.objects.filter(has_it_competed=True).exists()
+        response = self.client.delete(self.url, {'filter': {'drone_category': self.category.pk}}, format='json')
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['deleted'] == 2
+        assert list(Drone.objects.values_list('pk', flat=True)) == [self.drones[2].pk]
+        assert Competition.objects.count() == 1
+        assert Tombstone.objects.filter(model_name='drone').count() == 2
+
+        response = self.client.delete(self.url, {'filter': {'distance': 1}}, format='json')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        self.client.force_authenticate(None)
+        response = self.client.delete(self.url, {'ids': [self.drones[2].pk]}, format='json')
+        assert response.status_code in (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN)
+        assert Drone.objects.count() == 1
+
+
+class InvalidationBusTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.changes = []
+        self.flushes = []
+        on_change = lambda model, pks: self.changes.append((model, pks))
+        on_flush = lambda: self.flushes.append(True)
+        invalidation.register(on_change, on_flush)
+        self.addCleanup(invalidation.unregister, on_change, on_flush)
+        self.listener = invalidation.Bus(invalidation.LocalTransport())
+        self.listener.transport.connect()
+        self.addCleanup(self.listener.transport.close)
+
+    def receive(self):
+        for message in self.listener.transport.receive(timeout=1):
+            self.listener.handle(message)
+
+    def test_commit_publishes_changed_rows(self):
+        """
+        Ensure a saved drone reaches the other processes' caches, its
+        cached version bumped and its slug forgotten there too
+        """
+        user = User.objects.create_user('writer', 'writer@example.com', 'P4ssw0rD')
+        category = DroneCategory.objects.create(name='Quadcopter')
+        # The test case never commits, run the on-commit callbacks at once
+        with override_settings(INVALIDATION_TRANSPORT='drones.invalidation.LocalTransport'), \
+                mock.patch('django.db.transaction.on_commit', side_effect=lambda function: function()):
+            drone = Drone.objects.create(
+                name='Bus', drone_category=category, manufacturing_date=timezone.now(), owner=user)
+        before = cacheversions.get_versions([cacheversions.object_name(Drone, drone.pk)])
+        self.receive()
+        assert (Drone, [drone.pk]) in self.changes
+        after = cacheversions.get_versions([cacheversions.object_name(Drone, drone.pk)])
+        assert after != before
+
+        # Messages of the listener's own origin are not applied twice
+        self.changes.clear()
+        self.listener.publish(Drone, [drone.pk])
+        self.receive()
+        assert self.changes == []
+
+    def test_missed_messages_flush(self):
+        """
+        Ensure a gap in a publisher's sequence and a truncated
+        file flush the per-process caches
+        """
+        publisher = invalidation.Bus(invalidation.LocalTransport())
+        publisher.publish(Pilot, [1])
+        publisher.sequence += 1
+        publisher.publish(Pilot, [2])
+        self.receive()
+        assert self.changes == [(Pilot, [1])]
+        assert self.flushes == [True]
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'invalidation.log')
+        transport = invalidation.FileTransport(path)
+        transport.connect()
+        self.addCleanup(transport.close)
+        invalidation.FileTransport(path).send('first')
+        assert transport.receive(timeout=0) == ['first']
+        open(path, 'w').close()
+        with self.assertRaises(invalidation.TransportError):
+            transport.receive(timeout=0)
+
+    def test_bus_follows_transport_setting(self):
+        """
+        Ensure the bus of the process is rebuilt when
+        INVALIDATION_TRANSPORT changes
+        """
+        with override_settings(INVALIDATION_TRANSPORT='drones.invalidation.LocalTransport'):
+            bus = invalidation.get_bus()
+            assert isinstance(bus.transport, invalidation.LocalTransport)
+            assert invalidation.get_bus() is bus
+        with override_settings(INVALIDATION_TRANSPORT='drones.invalidation.FileTransport'):
+            assert isinstance(invalidation.get_bus().transport, invalidation.FileTransport)
+        with override_settings(INVALIDATION_TRANSPORT=None):
+            assert invalidation.get_bus() is None
+
+    def test_flush_keeps_other_entries(self):
+        """
+        Ensure a flush drops the version stamps and slugs
+        of the process but not its other cache entries
+        """
+        versions = cacheversions.get_versions(['drones_drone'])
+        cache.set(relatedfields.slug_key(Drone, 'name', 'Bus'), 1)
+        cache.set('throttle_user_elsewhere', 1)
+        with mock.patch('drones.cacheversions.initial_version', return_value=versions['drones_drone'] + 10):
+            invalidation.flush_local_cache()
+            assert cacheversions.get_versions(['drones_drone']) != versions
+        assert cache.get(relatedfields.slug_key(Drone, 'name', 'Bus')) is None
+        assert cache.get('throttle_user_elsewhere') == 1
+
+    def test_publish_sends_in_sequence_order(self):
+        """
+        Ensure a message is sent before another thread can take
+        the next sequence number
+        """
+        publisher = invalidation.Bus(invalidation.LocalTransport())
+        locked = []
+        with mock.patch.object(publisher.transport, 'send', side_effect=lambda message: locked.append(
+                publisher._lock.locked())):
+            publisher.publish(Pilot, range(invalidation.MAX_PKS_PER_MESSAGE + 1))
+            # Rows unknown to the publisher still change the table
+            publisher.publish(Competition, [])
+        assert locked == [True, True, True]
+
+
+class CompressionTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('reader', 'reader@example.com', 'P4ssw0rD')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        for number in range(4):
+            Pilot.objects.create(name='Pilot {0} {1}'.format(number, 'x' * 300), races_count=number)
+        self.url = reverse(views.PilotList.name) + '?limit=4'
+
+    def test_pilot_list_served_precompressed(self):
+        """
+        Ensure pilot pages are cached compressed, served in the encoding
+        asked for and rebuilt once a pilot changes
+        """
+        identity = self.client.get(self.url, format='json')
+        assert identity.status_code == status.HTTP_200_OK
+        assert not identity.has_header('Content-Encoding')
+        assert 'Accept-Encoding' in identity['Vary']
+
+        with mock.patch('drones.compression.compress', wraps=compression.compress) as compress:
+            response = self.client.get(self.url, format='json', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        assert response['Content-Encoding'] == 'gzip'
+        assert not compress.called
+        assert gzip.decompress(response.content) == identity.content
+
+        Pilot.objects.filter(name__startswith='Pilot 0').update(races_count=9)
+        Pilot.objects.get(name__startswith='Pilot 1').save()
+        response = self.client.get(self.url, format='json', HTTP_ACCEPT_ENCODING='gzip;q=0, identity')
+        assert not response.has_header('Content-Encoding')
+        assert response.content != identity.content
+
+    def test_replica_pages_not_cached(self):
+        """
+        Ensure a page that may come from a lagging replica is
+        not cached for the later requests
+        """
+        with dbrouter.reading_from_replica():
+            response = self.client.get(self.url, format='json', HTTP_ACCEPT_ENCODING='gzip')
+        assert response.status_code == status.HTTP_200_OK
+        with mock.patch('drones.compression.compress', wraps=compression.compress) as compress:
+            self.client.get(self.url, format='json', HTTP_ACCEPT_ENCODING='gzip')
+        assert compress.called
+
+    def test_large_responses_compressed_in_chunks(self):
+        """
+        Ensure uncached JSON responses above the size threshold are
+        streamed gzipped, small and HTML ones left alone
+        """
+        middleware = CompressionMiddleware(lambda request: HttpResponse(
+            b'{"rows": [' + b'1, ' * 3000 + b'1]}', content_type='application/json'))
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip')
+        with override_settings(COMPRESSION_CHUNK_SIZE=1000):
+            response = middleware(request)
+            body = b''.join(response.streaming_content)
+        assert response['Content-Encoding'] == 'gzip'
+        assert not response.has_header('Content-Length')
+        assert gzip.decompress(body) == b'{"rows": [' + b'1, ' * 3000 + b'1]}'
+
+        for content, content_type in ((b'{}', 'application/json'), (b'<p>' * 1000, 'text/html')):
+            response = CompressionMiddleware(lambda request: HttpResponse(content, content_type=content_type))(request)
+            assert not response.has_header('Content-Encoding')
+            assert response.content == content
+
+
+class DroneCategoryActionsTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('maker', 'maker@example.com', 'P4ssw0rD')
+        self.category = DroneCategory.objects.create(name='Quadcopter')
+        self.url = reverse('dronecategory-drones', args=(self.category.pk,))
+
+    def batch(self, *names):
+        return [
+            {'name': name, 'manufacturing_date': '2020-01-01T00:00:00Z', 'has_it_competed': False}
+            for name in names]
+
+    def test_batch_create_and_cursor_pages(self):
+        """
+        Ensure a batch of drones is created in the category, all or none,
+        and listed a filtered cursor page at a time
+        """
+        self.client.force_authenticate(self.user)
+        names = ['Batch {0:02d}'.format(number) for number in range(12)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, self.batch(*names), format='json')
+        assert response.status_code == status.HTTP_201_CREATED
+        assert len(response.data) == 12
+        assert len([query for query in queries if query['sql'].startswith('INSERT INTO "drones_drone"')]) == 1
+        assert Drone.objects.filter(drone_category=self.category, owner=self.user).count() == 12
+
+        response = self.client.post(self.url, self.batch('Batch 13', 'Batch 00'), format='json')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert not Drone.objects.filter(name='Batch 13').exists()
+
+        seen = []
+        url = self.url + '?page_size=5&search=Batch&ordering=-name'
+        while url:
+            response = self.client.get(url, format='json')
+            assert response.status_code == status.HTTP_200_OK
+            assert 'count' not in response.data
+            seen.extend(drone['name'] for drone in response.data['results'])
+            url = response.data['next']
+        assert seen == names[::-1]
+        response = self.client.get(self.url + '?name=Batch%2003', format='json')
+        assert [drone['name'] for drone in response.data['results']] == ['Batch 03']
+
+    def test_single_create(self):
+        """
+        Ensure the drone action creates one drone for the requester
+        without touching the request data, and rejects anonymous clients
+        """
+        url = reverse('dronecategory-drone', args=(self.category.pk,))
+        response = self.client.post(url, self.batch('Solo')[0], format='json')
+        assert response.status_code in (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN)
+        self.client.force_authenticate(self.user)
+        response = self.client.post(url, self.batch('Solo')[0], format='json')
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.data['owner'] == self.user.pk
+        assert response.data['drone_category'] == self.category.pk
+        response = self.client.post(url, self.batch('Solo')[0], format='json')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+class GroupCommitTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user('timer', 'timer@example.com', 'P4ssw0rD')
+        category = DroneCategory.objects.create(name='Quadcopter')
+        self.drone = Drone.objects.create(
+            name='Timed', drone_category=category, manufacturing_date=timezone.now(), owner=user)
+        self.pilot = Pilot.objects.create(name='Gaston', races_count=2)
+
+    def competition(self, distance, date=True):
+        return Competition(
+            pilot=self.pilot, drone=self.drone, distance_in_feet=distance,
+            distance_achievement_date=timezone.now() if date else None)
+
+    def test_rows_isolated_within_a_batch(self):
+        """
+        Ensure a row the database rejects fails alone
+        and the rest of its batch is committed
+        """
+        competitions = [self.competition(100), self.competition(200, date=False), self.competition(300)]
+        errors = groupcommit.insert(competitions)
+        assert errors[0] is None and errors[2] is None
+        assert isinstance(errors[1], IntegrityError)
+        assert sorted(Competition.objects.values_list('distance_in_feet', flat=True)) == [100, 300]
+
+        competition = groupcommit.GroupCommitter().commit(self.competition(400))
+        assert Competition.objects.get(pk=competition.pk).distance_in_feet == 400
+
+    def test_group_commit_post(self):
+        """
+        Ensure POSTs are saved through the group commit when enabled
+        and turned away with a 503 once too many wait
+        """
+        data = {
+            'pilot': 'Gaston', 'drone': 'Timed', 'distance_in_feet': 800,
+            'distance_achievement_date': '2020-01-01T00:00:00Z'}
+        url = reverse(views.CompetitionList.name)
+        # The test case's transaction would hold the acknowledgements back
+        with override_settings(COMPETITION_GROUP_COMMIT=True), \
+                mock.patch('drones.groupcommit.in_transaction', return_value=False), \
+                mock.patch('drones.groupcommit.insert', wraps=groupcommit.insert) as insert:
+            response = self.client.post(url, data, format='json')
+            assert response.status_code == status.HTTP_201_CREATED
+            assert insert.call_count == 1
+            assert Competition.objects.get(pk=response.data['pk']).distance_in_feet == 800
+            with override_settings(COMPETITION_GROUP_COMMIT_MAX_QUEUED=0):
+                response = self.client.post(url, data, format='json')
+        assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+        assert response['Retry-After'] == '1'
+        assert Competition.objects.count() == 1
+
+    def test_deleted_drone_fails_its_row_only(self):
+        """
+        Ensure a row whose drone is gone fails within its savepoint,
+        not at the commit of the whole batch
+        """
+        competitions = [self.competition(100), self.competition(200), self.competition(300)]
+        competitions[1].drone_id = self.drone.pk + 1000
+        errors = groupcommit.insert(competitions)
+        assert errors[0] is None and errors[2] is None
+        assert isinstance(errors[1], IntegrityError)
+        assert sorted(Competition.objects.values_list('distance_in_feet', flat=True)) == [100, 300]
+
+    def test_failed_batch_is_a_503(self):
+        """
+        Ensure a batch the database could not save at all
+        answers 503 rather than 500
+        """
+        data = {
+            'pilot': 'Gaston', 'drone': 'Timed', 'distance_in_feet': 800,
+            'distance_achievement_date': '2020-01-01T00:00:00Z'}
+        with override_settings(COMPETITION_GROUP_COMMIT=True), \
+                mock.patch('drones.groupcommit.in_transaction', return_value=False), \
+                mock.patch('drones.groupcommit.get_committer', return_value=groupcommit.GroupCommitter()), \
+                mock.patch('drones.groupcommit.insert', side_effect=OperationalError('server closed the connection')):
+            response = self.client.post(reverse(views.CompetitionList.name), data, format='json')
+        assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+        assert response['Retry-After'] == '1'
+
+
+class ConcurrentGroupCommitTests(APITransactionTestCase):
+    """
+    POSTs from several threads, committed for real
+    """
+
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user('timer', 'timer@example.com', 'P4ssw0rD')
+        category = DroneCategory.objects.create(name='Quadcopter')
+        Drone.objects.create(name='Timed', drone_category=category, manufacturing_date=timezone.now(), owner=user)
+        Pilot.objects.create(name='Gaston', races_count=2)
+        self.committer = groupcommit.GroupCommitter()
+        patcher = mock.patch('drones.groupcommit.get_committer', return_value=self.committer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, distance, events):
+        try:
+            response = self.client_class().post(reverse(views.CompetitionList.name), {
+                'pilot': 'Gaston', 'drone': 'Timed', 'distance_in_feet': distance,
+                'distance_achievement_date': '2020-01-01T00:00:00Z'}, format='json')
+            events.append(('answered', distance, response.status_code))
+        finally:
+            connection.close()
+
+    def test_concurrent_posts_share_a_batch(self):
+        """
+        Ensure POSTs arriving while a batch is inserted wait for it,
+        then go in one batch whose clients are answered once committed
+        """
+        events = []
+        first_flushing = threading.Event()
+        release_first = threading.Event()
+        insert = groupcommit.insert
+
+        def tracked_insert(competitions):
+            distances = sorted(competition.distance_in_feet for competition in competitions)
+            if not first_flushing.is_set():
+                first_flushing.set()
+                release_first.wait(5)
+            errors = insert(competitions)
+            events.append(('committed', distances))
+            return errors
+
+        with override_settings(COMPETITION_GROUP_COMMIT=True, COMPETITION_GROUP_COMMIT_DELAY_MS=5000), \
+                mock.patch('drones.groupcommit.insert', side_effect=tracked_insert):
+            leader = threading.Thread(target=self.post, args=(100, events))
+            leader.start()
+            assert first_flushing.wait(5)
+            followers = [threading.Thread(target=self.post, args=(distance, events)) for distance in (200, 300, 400)]
+            for thread in followers:
+                thread.start()
+            # The next batch's leader waits for the first batch while the others join it
+            deadline = time.monotonic() + 5
+            while self.committer._queued < 4 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            assert self.committer._queued == 4
+            assert [event for event in events if event[0] == 'committed'] == []
+            release_first.set()
+            for thread in [leader] + followers:
+                thread.join(10)
+
+        assert [event for event in events if event[0] == 'committed'] == [
+            ('committed', [100]), ('committed', [200, 300, 400])]
+        second_commit = events.index(('committed', [200, 300, 400]))
+        for distance in (200, 300, 400):
+            assert events.index(('answered', distance, status.HTTP_201_CREATED)) > second_commit
+        assert sorted(Competition.objects.values_list('distance_in_feet', flat=True)) == [100, 200, 300, 400]
@@ -8,14 +8,25 @@ router.register("drone-categories2",views.DroneCategoryList2)
 urlpatterns = [
     path('drone-categories/',views.DroneCategoryList.as_view(),name=views.DroneCategoryList.name),
     path('drone-categories/<int:pk>',views.DroneCategoryDetail.as_view(),name=views.DroneCategoryDetail.name),
+    path('drone-categories/sync/',views.DroneCategorySync.as_view(),name=views.DroneCategorySync.name),
     path('drones/',views.DroneList.as_view(),name=views.DroneList.name),
     path('drones/<int:pk>',views.DroneDetail.as_view(),name=views.DroneDetail.name),
+    path('drones/sync/',views.DroneSync.as_view(),name=views.DroneSync.name),
     path('pilots/',views.PilotList.as_view(),name=views.PilotList.name),
     path('pilots/<int:pk>',views.PilotDetail.as_view(),name=views.PilotDetail.name),
+    path('pilots/sync/',views.PilotSync.as_view(),name=views.PilotSync.name),
     path('competitions/',views.CompetitionList.as_view(),name=views.CompetitionList.name),
     path('competitions/<int:pk>',views.CompetitionDetail.as_view(),name=views.CompetitionDetail.name),
+    path('competitions/sync/',views.CompetitionSync.as_view(),name=views.CompetitionSync.name),
+    path('competitions/stats/',views.CompetitionStats.as_view(),name=views.CompetitionStats.name),
+    path('competitions/snapshot/',views.CompetitionSnapshot.as_view(),name=views.CompetitionSnapshot.name),
     path('users/',views.UserList.as_view(),name=views.UserList.name),
     path('users/<int:pk>',views.UserDetail.as_view(),name=views.UserDetail.name),
+    path('import-jobs/',views.ImportJobList.as_view(),name=views.ImportJobList.name),
+    path('import-jobs/<int:pk>',views.ImportJobDetail.as_view(),name=views.ImportJobDetail.name),
+    path('delete-jobs/<str:token>',views.DeleteJobDetail.as_view(),name=views.DeleteJobDetail.name),
+    path('profiles/',views.ProfileList.as_view(),name=views.ProfileList.name),
+    path('profiles/<str:profile_id>',views.ProfileDetail.as_view(),name=views.ProfileDetail.name),
     path('',views.ApiRoot.as_view(),name=views.ApiRoot.name),
 ]
 urlpatterns+=router.urls
\ No newline at end of file
@@ -1,24 +1,84 @@
+from functools import partial
+from importlib import import_module
 from django.shortcuts import render
+from django.http import FileResponse, Http404
+from django.utils.dateparse import parse_datetime
 from django.contrib.auth.models import User
 from rest_framework import generics
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
-from drones.models import DroneCategory,Drone,Pilot,Competition
-from drones.serializers import DroneCategorySerializer,DroneSerializer,PilotSerializer,PilotCompetitionSerializer,UserSerializer,DroneSerializer2
+from django.db import DatabaseError, IntegrityError, transaction
+from drones.models import DroneCategory,Drone,Pilot,Competition,ImportJob,DeleteJob
+from drones.serializers import DroneCategorySerializer,DroneSerializer,PilotSerializer,PilotCompetitionSerializer,UserSerializer
+from drones.serializers import DroneCategorySyncSerializer,DroneSyncSerializer,PilotSyncSerializer,CompetitionSyncSerializer
+from drones.serializers import ImportJobSerializer,DeleteJobSerializer,DroneBulkUpdateSerializer,DroneBatchSerializer
+from drones.sparsefields import SparseFieldsetsMixin
+from drones.objectcache import CachedRepresentationMixin
+from drones.singleflight import SingleFlightMixin
+from drones.precompiled import PrecompiledQueryMixin
+from drones.compression import PrecompressedListMixin
 from rest_framework import filters #filters.FilterSet deprecated
 # from django_filters import AllValuesFilter, DateTimeFilter, NumberFilter
 from django_filters import rest_framework as dfilters  #using this instead of rest_framework.filters.FilterSet
 
 # permission classes
 from rest_framework import permissions,viewsets,status
+from rest_framework.exceptions import ValidationError
 from drones import custompermission
-from rest_framework.permissions import IsAuthenticated
+from drones.custompagination import ApproximateCountPagination, BoundedCursorPagination
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.authentication import TokenAuthentication
 
 from rest_framework.throttling import ScopedRateThrottle
 from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser, FormParser
 
-class DroneCategoryList(generics.ListCreateAPIView):
+
+# Modules only some requests need (columnar loads numpy when installed),
+# imported on first use rather than by every worker. warm_up() imports
+# them before a preforking server forks.
+LAZY_MODULES = ('sync', 'importjobs', 'fastdelete', 'bulk', 'groupcommit', 'columnar', 'profiling')
+
+
+def lazy_module(name):
+    return import_module('drones.{0}'.format(name))
+
+
+class FastDestroyMixin:
+    """
+    Deletes the object and everything cascading from it in chunks
+    (drones.fastdelete) instead of loading them all first. With
+    ?background=true or a "Prefer: respond-async" header the delete
+    runs as a job and the response points to its status.
+    """
+
+    def wants_background(self, request):
+        return (
+            'respond-async' in request.META.get('HTTP_PREFER', '')
+            or request.query_params.get('background') in ('1', 'true'))
+
+    def destroy(self, request, *args, **kwargs):
+        fastdelete = lazy_module('fastdelete')
+        instance = self.get_object()
+        if not self.wants_background(request):
+            try:
+                fastdelete.fast_delete(instance)
+            except fastdelete.FastDeleteError:
+                # Let the collector handle what the fast path does not
+                instance.delete()
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        job = DeleteJob.objects.create(
+            owner=request.user if request.user.is_authenticated else None,
+            model_label=instance._meta.label_lower,
+            object_pk=instance.pk)
+        transaction.on_commit(lambda: fastdelete.submit_delete_job(job.pk))
+        serializer = DeleteJobSerializer(job, context=self.get_serializer_context())
+        return Response(
+            serializer.data,
+            status=status.HTTP_202_ACCEPTED,
+            headers={'Location': serializer.data['url']})
+
+class DroneCategoryList(SparseFieldsetsMixin, generics.ListCreateAPIView):
     """
     Return a list of all the drone categories that 
     present within the queryset, with optional filtering.
@@ -39,7 +99,7 @@ class DroneCategoryList(generics.ListCreateAPIView):
         'name',
         )
 
-class DroneCategoryDetail(generics.RetrieveUpdateDestroyAPIView):
+class DroneCategoryDetail(FastDestroyMixin, SparseFieldsetsMixin, generics.RetrieveUpdateDestroyAPIView):
     """
     Shows details of the drone-category per its primary key
     and lists all drones registered under the category 
@@ -48,13 +108,36 @@ class DroneCategoryDetail(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = DroneCategorySerializer
     name = 'dronecategory-detail'
 
-class DroneList(generics.ListCreateAPIView):
+class DroneFilter(dfilters.FilterSet):
+    """
+    Filters by related ids as numbers, model choice filters
+    would render every category and user in the browsable API
+    """
+
+    drone_category = dfilters.NumberFilter(field_name='drone_category') #id of drone category
+    owner = dfilters.NumberFilter(field_name='owner') #id of the owner
+    class Meta:
+        model = Drone
+        fields = (
+            'name', #name of the drone
+            'drone_category',
+            'manufacturing_date', #manufacturing datetime delta of the drone
+            'has_it_competed', #bool value 
+            'owner',
+            )
+
+class DroneList(SingleFlightMixin, PrecompiledQueryMixin, SparseFieldsetsMixin, generics.ListCreateAPIView):
     """
     Return a list of all the drones that 
     present within the queryset, with optional filtering.
     ?search=<search-text>&ordering=<ordering key>&<any of the filtering_fields key below>
 
     ie 127.0.0.1:8000/drones/?drone-category=1
+
+    PATCH and DELETE change many of the requester's drones at once,
+    picked by {"ids": [...]} or {"filter": {<filtering fields>}}:
+    PATCH {"ids": [1, 2], "changes": {"has_it_competed": true}}
+    Each id is reported updated/deleted, forbidden or not_found.
     """
 
     throttle_scope = 'drones'
@@ -63,12 +146,9 @@ class DroneList(generics.ListCreateAPIView):
     queryset = Drone.objects.all()
     serializer_class = DroneSerializer
     name = 'drone-list'
-    filter_fields=(
-        'name', #name of the drone
-        'drone_category', #id of drone category
-        'manufacturing_date', #manufacturing datetime delta of the drone
-        'has_it_competed', #bool value 
-        )
+    pagination_class = ApproximateCountPagination
+    flight_models = (DroneCategory, User)
+    filter_class = DroneFilter
     search_fields=(
         '^name',
         )
@@ -87,7 +167,20 @@ class DroneList(generics.ListCreateAPIView):
     def perform_create(self,serializer):
         return serializer.save(owner=self.request.user)
 
-class DroneDetail(generics.RetrieveUpdateDestroyAPIView):
+    def patch(self, request, *args, **kwargs):
+        bulk = lazy_module('bulk')
+        requested, queryset = bulk.selected_rows(request.data, Drone.objects.all(), DroneFilter, request)
+        serializer = DroneBulkUpdateSerializer(data=request.data.get('changes'), context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        return Response(serializer.save_checked(
+            partial(bulk.bulk_update, Drone, requested, queryset, request.user), serializer.validated_data))
+
+    def delete(self, request, *args, **kwargs):
+        bulk = lazy_module('bulk')
+        requested, queryset = bulk.selected_rows(request.data, Drone.objects.all(), DroneFilter, request)
+        return Response(bulk.bulk_delete(Drone, requested, queryset, request.user))
+
+class DroneDetail(FastDestroyMixin, CachedRepresentationMixin, PrecompiledQueryMixin, SparseFieldsetsMixin, generics.RetrieveUpdateDestroyAPIView):
     """
     Shows details of a drone per its primary key
     """
@@ -104,7 +197,16 @@ class DroneDetail(generics.RetrieveUpdateDestroyAPIView):
         custompermission.IsCurrentUserOwnerOrReadOnly,
         )
 
-class PilotList(generics.ListCreateAPIView):
+    def cache_dependencies(self, drone):
+        # The representation shows the category and owner names
+        return [(Drone, drone.pk), (DroneCategory, drone.drone_category_id), (User, drone.owner_id)]
+
+    @classmethod
+    def owned_by(cls, user, view_kwargs):
+        # Owner writes get the critical priority (CONCURRENCY_PRIORITY_RULES)
+        return Drone.objects.filter(pk=view_kwargs.get('pk'), owner=user).exists()
+
+class PilotList(PrecompressedListMixin, SparseFieldsetsMixin, generics.ListCreateAPIView):
     """
     Return a list of all the pilots that is 
     present within the queryset, with optional filtering.
@@ -121,6 +223,8 @@ class PilotList(generics.ListCreateAPIView):
     queryset = Pilot.objects.all()
     serializer_class = PilotSerializer
     name = 'pilot-list'
+    # Pilots embed their competitions and their drones
+    precompressed_models = (Pilot, Competition, Drone, DroneCategory, User)
     filter_fields=(
         'name',
         'gender',
@@ -140,7 +244,7 @@ class PilotList(generics.ListCreateAPIView):
         IsAuthenticated,
         )
 
-class PilotDetail(generics.RetrieveUpdateDestroyAPIView):
+class PilotDetail(FastDestroyMixin, CachedRepresentationMixin, PrecompiledQueryMixin, SparseFieldsetsMixin, generics.RetrieveUpdateDestroyAPIView):
     """
     Shows details of a pilot per its primary key
     and lists all competitions it has partaken in 
@@ -160,6 +264,20 @@ class PilotDetail(generics.RetrieveUpdateDestroyAPIView):
         IsAuthenticated,
     )
 
+    def cache_dependencies(self, pilot):
+        # New competitions bump their pilot, the embedded
+        # ones also show their drone's name, category and owner
+        dependencies = [(Pilot, pilot.pk)]
+        for competition in getattr(pilot, '_prefetched_objects_cache', {}).get('competitions', ()):
+            drone = competition.drone
+            dependencies.extend([
+                (Competition, competition.pk),
+                (Drone, drone.pk),
+                (DroneCategory, drone.drone_category_id),
+                (User, drone.owner_id),
+                ])
+        return dependencies
+
 class CompetitionFilter(dfilters.FilterSet):
     """
     Custom filter class for
@@ -170,8 +288,11 @@ class CompetitionFilter(dfilters.FilterSet):
     to_achievement_date = dfilters.DateTimeFilter(field_name='distance_achievement_date', lookup_expr='lte')
     min_distance_in_feet = dfilters.NumberFilter(field_name='distance_in_feet', lookup_expr='gte')
     max_distance_in_feet = dfilters.NumberFilter(field_name='distance_in_feet', lookup_expr='lte')
-    drone_name = dfilters.AllValuesFilter(field_name='drone__name') # drone.name field
-    pilot_name = dfilters.AllValuesFilter(field_name='pilot__name') # pilot.name field
+    # CharFilter rather than AllValuesFilter, whose choices are a
+    # SELECT DISTINCT over every drone and pilot name on each request
+    drone_name = dfilters.CharFilter(field_name='drone__name') # drone.name field
+    pilot_name = dfilters.CharFilter(field_name='pilot__name') # pilot.name field
+    pilot = dfilters.NumberFilter(field_name='pilot') # id of the pilot
     class Meta:
         model = Competition
         fields = (
@@ -180,16 +301,20 @@ class CompetitionFilter(dfilters.FilterSet):
             'to_achievement_date',
             'min_distance_in_feet',
             'max_distance_in_feet',
+            # id of the pilot
+            'pilot',
             # drone__name will be accessed as drone_name
             'drone_name',
             # pilot__name will be accessed as pilot_name
             'pilot_name',
             )
 
-class CompetitionList(generics.ListCreateAPIView):
+class CompetitionList(SingleFlightMixin, PrecompiledQueryMixin, SparseFieldsetsMixin, generics.ListCreateAPIView):
     queryset = Competition.objects.all()
     serializer_class = PilotCompetitionSerializer
     name = 'competition-list'
+    pagination_class = ApproximateCountPagination
+    flight_models = (Pilot, Drone)
     filter_backends = (dfilters.DjangoFilterBackend,)
     filter_class = CompetitionFilter
     # ordering_fields = (
@@ -197,12 +322,30 @@ class CompetitionList(generics.ListCreateAPIView):
     #     'distance_achievement_date',
     #     )
 
-class CompetitionDetail(generics.RetrieveUpdateDestroyAPIView):
+    def perform_create(self, serializer):
+        groupcommit = lazy_module('groupcommit')
+        # With COMPETITION_GROUP_COMMIT, inserted with the concurrent
+        # POSTs of the worker (drones/groupcommit.py)
+        if not groupcommit.enabled():
+            return super().perform_create(serializer)
+        competition = Competition(**serializer.validated_data)
+        try:
+            serializer.instance = groupcommit.get_committer().commit(competition)
+        except IntegrityError as error:
+            raise serializer.integrity_error(serializer.validated_data, error)
+        except DatabaseError:
+            # Rejected alone, the rest of its batch was saved
+            raise ValidationError({'non_field_errors': ['The database rejected this competition.']})
+
+class CompetitionDetail(CachedRepresentationMixin, PrecompiledQueryMixin, SparseFieldsetsMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Competition.objects.all()
     serializer_class = PilotCompetitionSerializer
     name = 'competition-detail'
 
-class UserList(generics.ListCreateAPIView):
+    def cache_dependencies(self, competition):
+        return [(Competition, competition.pk), (Pilot, competition.pilot_id), (Drone, competition.drone_id)]
+
+class UserList(PrecompressedListMixin, SparseFieldsetsMixin, generics.ListCreateAPIView):
     """
     Return a list of all users 
     present within the queryset,
@@ -210,12 +353,88 @@ class UserList(generics.ListCreateAPIView):
     queryset= User.objects.all()
     serializer_class= UserSerializer
     name="user-list"
+    precompressed_models = (User, Drone)
 
-class UserDetail(generics.RetrieveUpdateDestroyAPIView):
+class UserDetail(FastDestroyMixin, SparseFieldsetsMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset= User.objects.all()
     serializer_class= UserSerializer
     name="user-detail"
 
+class CompetitionStats(generics.GenericAPIView):
+    """
+    Competition analytics answered from the columnar snapshot
+    (drones/columnar.py), as fresh as its last export.
+    ?group_by=pilot|drone|category with ?aggregate=count|sum|mean|min|max
+    (of distance_in_feet, max by default) ranks the groups, without
+    group_by the longest competitions are listed. ?top= sets how many,
+    from_achievement_date and to_achievement_date filter the rows.
+    """
+    name = 'competition-stats'
+
+    def get(self, request, *args, **kwargs):
+        columnar = lazy_module('columnar')
+        params = request.query_params
+        try:
+            snapshot = columnar.get_snapshot()
+        except columnar.SnapshotError as error:
+            return Response({'detail': str(error)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        bounds = []
+        for param in ('from_achievement_date', 'to_achievement_date'):
+            value = params.get(param)
+            parsed = parse_datetime(value) if value else None
+            if value and parsed is None:
+                return Response({param: ['Enter a valid date/time.']}, status=status.HTTP_400_BAD_REQUEST)
+            bounds.append(parsed.timestamp() if parsed else None)
+        try:
+            top = min(int(params.get('top', 10)), 1000)
+        except ValueError:
+            return Response({'top': ['A valid integer is required.']}, status=status.HTTP_400_BAD_REQUEST)
+        if top < 1:
+            return Response(
+                {'top': ['Ensure this value is greater than or equal to 1.']}, status=status.HTTP_400_BAD_REQUEST)
+        group_by = params.get('group_by')
+        if group_by is None:
+            results = snapshot.top_rows(top, *bounds)
+        elif group_by not in dict(columnar.DICTIONARIES):
+            return Response({'group_by': ['Choose pilot, drone or category.']}, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            try:
+                results = snapshot.top_groups(group_by, params.get('aggregate', 'max'), top, *bounds)
+            except columnar.SnapshotError as error:
+                return Response({'aggregate': [str(error)]}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'exported_at': snapshot.manifest['exported_at'],
+            'rows': snapshot.rows,
+            'results': results,
+            })
+
+
+class CompetitionSnapshot(generics.GenericAPIView):
+    """
+    Manifest of the competition snapshot, POST to refresh it
+    (?full=1 to write it from scratch)
+    """
+    name = 'competition-snapshot'
+    permission_classes = (
+        IsAdminUser,
+        )
+
+    def get(self, request, *args, **kwargs):
+        columnar = lazy_module('columnar')
+        try:
+            return Response(columnar.get_snapshot().manifest)
+        except columnar.SnapshotError as error:
+            return Response({'detail': str(error)}, status=status.HTTP_404_NOT_FOUND)
+
+    def post(self, request, *args, **kwargs):
+        columnar = lazy_module('columnar')
+        try:
+            manifest = columnar.export(full=bool(request.query_params.get('full')))
+        except columnar.SnapshotError as error:
+            return Response({'detail': str(error)}, status=status.HTTP_409_CONFLICT)
+        return Response(manifest, status=status.HTTP_201_CREATED)
+
+
 class DroneCategoryList2(viewsets.ModelViewSet):
     """
     Return a list of all the drone categories that 
@@ -237,25 +456,229 @@ class DroneCategoryList2(viewsets.ModelViewSet):
         'name',
         )
 
-    @action(detail=True, methods=["GET"])
+    # Set by the drones action, like DroneList
+    filter_class = None
+    ordering_fields = None
+    ordering = None
+
+    @action(detail=True, methods=["GET", "POST"],
+        serializer_class=DroneBatchSerializer,
+        pagination_class=BoundedCursorPagination,
+        filter_class=DroneFilter,
+        search_fields=DroneList.search_fields,
+        ordering_fields=DroneList.ordering_field,
+        ordering=('pk',),
+        permission_classes=(permissions.IsAuthenticatedOrReadOnly,))
     def drones(self,request,pk=None):
-        drone_category=self.get_object()
-        drones=drone_category.drones
-        serializer=DroneSerializer2(drones,many=True)
-        return Response(serializer.data,status=200)
+        """
+        GET: the drones of the category a cursor page at a time,
+        ?cursor=<next link>&page_size=<at most 100>, filtered and ordered as
+        the drone list is.
+        POST: a list of drones created in the category in one transaction,
+        all or none of them
+        """
+        drone_category=self.get_category(pk)
+        if request.method == 'POST':
+            return self.create_drones(request, drone_category, many=True)
+        drones=self.filter_queryset(Drone.objects.filter(drone_category=drone_category))
+        page=self.paginate_queryset(drones)
+        serializer=self.get_serializer(page,many=True)
+        return self.get_paginated_response(serializer.data)
 
-    @action(detail=True, methods=["POST"])
+    @action(detail=True, methods=["POST"],
+        serializer_class=DroneBatchSerializer,
+        permission_classes=(permissions.IsAuthenticated,))
     def drone(self,request,pk=None):
-        drone_category=self.get_object()
-        data=request.data
-        data['drone_category']= drone_category.pk
-        data['owner']= request.user.pk
-        serializer=DroneSerializer2(data=data)
-        if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data,status=200)
-        return Response(serializer.errors,status=200)
+        drone_category=self.get_category(pk)
+        return self.create_drones(request, drone_category, many=False)
+
+    def get_category(self, pk):
+        # Not get_object(), the actions filter drones rather than categories
+        drone_category=generics.get_object_or_404(DroneCategory, pk=pk)
+        self.check_object_permissions(self.request, drone_category)
+        return drone_category
+
+    def create_drones(self, request, drone_category, many):
+        bulk = lazy_module('bulk')
+        if many and (not isinstance(request.data, list) or len(request.data) > bulk.bulk_limit()):
+            return Response(
+                {'non_field_errors': ['Give a list of at most {0} drones.'.format(bulk.bulk_limit())]},
+                status=status.HTTP_400_BAD_REQUEST)
+        serializer=self.get_serializer(data=request.data, many=many)
+        serializer.is_valid(raise_exception=True)
+        serializer.save(drone_category=drone_category, owner=request.user)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
         
+class SyncView(SparseFieldsetsMixin, generics.GenericAPIView):
+    """
+    Change feed: returns the rows created or updated and the pks of
+    the rows deleted after the client's cursor, oldest first.
+    ?since=<next_since from the previous response>
+    Omit since for the initial sync, keep calling with the returned
+    next_since while has_more is true.
+    """
+    pagination_class = None
+    filter_backends = ()
+
+    def get(self, request, *args, **kwargs):
+        sync = lazy_module('sync')
+        since = request.query_params.get('since')
+        cursor = sync.decode_cursor(since) if since else None
+        rows, deleted, next_cursor, has_more = sync.get_changes(self.get_queryset(), cursor)
+        serializer = self.get_serializer(rows, many=True)
+        return Response({
+            'results': serializer.data,
+            'deleted': deleted,
+            'next_since': sync.encode_cursor(next_cursor),
+            'has_more': has_more,
+            })
+
+class DroneCategorySync(SyncView):
+    queryset = DroneCategory.objects.all()
+    serializer_class = DroneCategorySyncSerializer
+    name = 'dronecategory-sync'
+
+class DroneSync(SyncView):
+    throttle_scope = 'drones'
+    throttle_classes = (ScopedRateThrottle,)
+
+    queryset = Drone.objects.select_related('drone_category', 'owner')
+    serializer_class = DroneSyncSerializer
+    name = 'drone-sync'
+
+class PilotSync(SyncView):
+    throttle_scope = 'pilots'
+    throttle_classes = (ScopedRateThrottle,)
+
+    queryset = Pilot.objects.all()
+    serializer_class = PilotSyncSerializer
+    name = 'pilot-sync'
+    authentication_classes = (
+        TokenAuthentication,
+        )
+    permission_classes = (
+        IsAuthenticated,
+        )
+
+class CompetitionSync(SyncView):
+    queryset = Competition.objects.select_related('pilot', 'drone')
+    serializer_class = CompetitionSyncSerializer
+    name = 'competition-sync'
+
+class ImportJobList(generics.ListCreateAPIView):
+    """
+    Upload a CSV or NDJSON file of drones or competitions,
+    it is imported in the background and the response points
+    to the job's status. Lists the current user's jobs.
+    Drones columns: name, drone_category, manufacturing_date, has_it_competed
+    Competitions columns: pilot, drone, distance_in_feet, distance_achievement_date
+    """
+    serializer_class = ImportJobSerializer
+    name = 'importjob-list'
+    parser_classes = (
+        MultiPartParser,
+        FormParser,
+        )
+    permission_classes = (
+        IsAuthenticated,
+        )
+
+    def get_queryset(self):
+        return ImportJob.objects.filter(owner=self.request.user)
+
+    def create(self, request, *args, **kwargs):
+        importjobs = lazy_module('importjobs')
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        job = ImportJob.objects.create(
+            owner=request.user,
+            kind=data['kind'],
+            file_format=data['file_format'],
+            file_path=importjobs.save_upload(data['file']))
+        transaction.on_commit(lambda: importjobs.submit_import_job(job.pk))
+        serializer = self.get_serializer(job)
+        return Response(
+            serializer.data,
+            status=status.HTTP_202_ACCEPTED,
+            headers={'Location': serializer.data['url']})
+
+class ImportJobDetail(generics.RetrieveAPIView):
+    """
+    Status and progress of an import job
+    """
+    serializer_class = ImportJobSerializer
+    name = 'importjob-detail'
+    permission_classes = (
+        IsAuthenticated,
+        )
+
+    def get_queryset(self):
+        return ImportJob.objects.filter(owner=self.request.user)
+
+class DeleteJobDetail(generics.RetrieveAPIView):
+    """
+    Status of a background delete
+    """
+    queryset = DeleteJob.objects.all()
+    serializer_class = DeleteJobSerializer
+    name = 'deletejob-detail'
+    # The unguessable token of the URL returned when the delete was
+    # requested, whoever made it and even once their account is deleted
+    lookup_field = 'token'
+
+class ProfileList(generics.GenericAPIView):
+    """
+    Request profiles, newest first
+    """
+    name = 'profile-list'
+    permission_classes = (
+        IsAdminUser,
+        )
+
+    def get(self, request, *args, **kwargs):
+        profiling = lazy_module('profiling')
+        profiles = []
+        for profile_id in profiling.list_profiles():
+            try:
+                summary = profiling.load_summary(profile_id)
+            except FileNotFoundError:
+                # Dropped by a request saving a newer profile
+                continue
+            profiles.append({
+                'url': reverse(ProfileDetail.name, args=(profile_id,), request=request),
+                'method': summary['method'],
+                'path': summary['path'],
+                'status': summary['status'],
+                'wall_ms': summary['wall_ms'],
+                })
+        return Response(profiles)
+
+
+class ProfileDetail(generics.GenericAPIView):
+    """
+    Time per DRF phase, slowest functions and allocation sites of a
+    profiled request, ?download=1 for its stats file (pstats, snakeviz)
+    """
+    name = 'profile-detail'
+    permission_classes = (
+        IsAdminUser,
+        )
+
+    def get(self, request, profile_id, *args, **kwargs):
+        profiling = lazy_module('profiling')
+        if not profiling.is_valid_id(profile_id):
+            raise Http404
+        try:
+            if request.query_params.get('download'):
+                return FileResponse(
+                    open(profiling.profile_path(profile_id, 'prof'), 'rb'),
+                    as_attachment=True,
+                    filename='{0}.prof'.format(profile_id))
+            return Response(profiling.load_summary(profile_id))
+        except FileNotFoundError:
+            raise Http404
+
 class ApiRoot(generics.GenericAPIView):
     """
     API homepage
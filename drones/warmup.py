@@ -0,0 +1,82 @@
+"""
+Work done once in the master process of a preforking server (gunicorn
+--preload, uWSGI without lazy-apps) instead of by every worker on its
+first requests. What warm_up() loads is then shared copy-on-write.
+"""
+import gc
+
+from django.conf import settings
+from django.db import connections
+from django.template import TemplateDoesNotExist
+from django.template.loader import get_template
+from django.urls import URLPattern, URLResolver, get_resolver
+from django.utils import translation
+
+# Templates of the browsable API
+TEMPLATES = (
+    'rest_framework/api.html',
+    'rest_framework/horizontal/form.html',
+    'drones/autocomplete.html',
+    )
+
+
+def url_patterns(resolver):
+    for pattern in resolver.url_patterns:
+        if isinstance(pattern, URLResolver):
+            yield from url_patterns(pattern)
+        elif isinstance(pattern, URLPattern):
+            yield pattern
+
+
+def view_classes():
+    found = []
+    for pattern in url_patterns(get_resolver()):
+        view_class = getattr(pattern.callback, 'cls', None) or getattr(pattern.callback, 'view_class', None)
+        if view_class is not None and view_class not in found:
+            found.append(view_class)
+    return found
+
+
+def build_serializers(view_class):
+    """
+    Build the fields of the view's serializer once, which fills the
+    model metadata caches they are built from
+    """
+    serializer_class = getattr(view_class, 'serializer_class', None)
+    if serializer_class is None:
+        return
+    serializer = serializer_class(context={'request': None})
+    for field in serializer.fields.values():
+        child = getattr(field, 'child', None)
+        if hasattr(child, 'fields'):
+            child.fields
+
+
+def warm_up():
+    """
+    Load the URL patterns, views and the modules they import lazily,
+    serializer metadata, translations and templates, then freeze the heap so that the workers' garbage
+    collections do not copy it
+    """
+    resolver = get_resolver()
+    # Compiles every pattern
+    resolver.reverse_dict
+    # The modules the views only import on first use
+    from drones import views
+    for name in views.LAZY_MODULES:
+        views.lazy_module(name)
+    for view_class in view_classes():
+        build_serializers(view_class)
+    translation.activate(settings.LANGUAGE_CODE)
+    translation.gettext('')
+    translation.deactivate()
+    for name in TEMPLATES:
+        try:
+            get_template(name)
+        except TemplateDoesNotExist:
+            pass
+    # Workers must not share the master's database sockets
+    connections.close_all()
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()